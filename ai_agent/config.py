@@ -4,4 +4,31 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
\ No newline at end of file
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+
+# Base URL of the completion API, e.g. a proxy or a local stub server; the
+# OpenAI API when unset.
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+
+# Chat model of the assistant.
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+
+# Seconds to wait for the completion API to connect or send data, and most
+# seconds one streamed answer of the assistant may take.
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 30))
+AI_STREAM_TIMEOUT = float(os.getenv('AI_STREAM_TIMEOUT', 60))
+
+# Retries of a failed request to the completion API, with exponential backoff.
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 2))
+
+# Cache of the assistant's answers (see ai_agent.prompt_cache): seconds an
+# answer is kept, and most answers kept in memory.
+AI_CACHE_TTL = int(os.getenv('AI_CACHE_TTL', 600))
+AI_CACHE_MAX_ENTRIES = int(os.getenv('AI_CACHE_MAX_ENTRIES', 1000))
+
+# Conversations of the AI assistant (see ai_agent.conversations): tokens of
+# system prompt plus history sent per request, seconds before an idle session
+# is dropped, and most sessions kept in memory.
+CONVERSATION_TOKEN_BUDGET = int(os.getenv('CONVERSATION_TOKEN_BUDGET', 3000))
+CONVERSATION_IDLE_TIMEOUT = int(os.getenv('CONVERSATION_IDLE_TIMEOUT', 1800))
+CONVERSATION_MAX_SESSIONS = int(os.getenv('CONVERSATION_MAX_SESSIONS', 1000))
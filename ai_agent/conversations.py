@@ -0,0 +1,174 @@
+"""
+Per-session conversation state of the AI assistant.
+
+Each session keeps its own turns, so users never see each other's context.
+Requests to the model carry the system prompt plus only the newest turns
+that fit in CONVERSATION_TOKEN_BUDGET, so payloads and latency stay bounded
+however long a conversation runs. Sessions idle for more than
+CONVERSATION_IDLE_TIMEOUT seconds are evicted, and at most
+CONVERSATION_MAX_SESSIONS are kept, least recently used first out.
+
+The store is in memory, so each process has its own sessions.
+
+Session ids are issued by the server, signed with the SECRET_KEY (see
+new_session_id), and sent back by the client with each message; the
+dashboard authenticates with a token from another origin, so it does not
+send cookies. An id the server did not sign starts a new session, so a
+client can never continue someone else's conversation.
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from django.core import signing
+from .config import CONVERSATION_IDLE_TIMEOUT, CONVERSATION_MAX_SESSIONS, CONVERSATION_TOKEN_BUDGET
+
+SYSTEM_PROMPT = [
+    {"role": "system", "content": "You are a helpful assistant called OfiA. You were designed by the company Ofiservices to help with duplicate invoice identification. Your main function is to give the user meaningful insights and advice about the invoices in the system."},
+    {"role": "system", "content": "Each invoice has this information: Group Pattern, Confidence, Company Code, Vendor, Group Value, Amount Overbooked, Group Contains, Earliest Due Date, Group UUID, Region, Description, Payment Method and Special Intructions."},
+    {"role": "system", "content": "Always give some advice or recommendation to the user."},
+    {"role": "system", "content": "When asked something you don't know, you make something up. You never say you dont know or that you cant access data. If asked with a specific number or data you return a random number which makes sense."},
+    {"role": "system", "content": "This is the list of vendors: Acme Corporation, Destec Office, Global Business, AluCast, Manhattan Corporation, State of California, Enigma, IOT Furniture, Pyramid Systems, WCB, Noe Food Company, Meyers Real Estate, GATORSA, Aztec Supplies, World Wide, CAFS Chemicals, CET New York"},
+    {"role": "system", "content": "Always start by introducing yourself"},
+    {"role": "system", "content": "The references of each invoices have this structure: INV-<number>"},
+    {"role": "system", "content": "These are the current KPI: Total similar invoices: 401 Total open similar invoices: 309 Total value of similar invoices: 1976659.459 Total value of open similar invoices: 1431130.88 "},
+]
+
+# Tokens a chat message costs on top of its content (role and separators).
+MESSAGE_OVERHEAD = 4
+
+SESSION_ID_SALT = 'ai_agent.conversations.session_id'
+
+
+def new_session_id():
+    """
+    A new unguessable session id, signed by the server.
+    """
+    return signing.Signer(salt=SESSION_ID_SALT).sign(secrets.token_urlsafe(16))
+
+
+def verified_session_id(session_id):
+    """
+    The session id sent by a client if the server signed it, otherwise a new one.
+    """
+    if isinstance(session_id, str):
+        try:
+            signing.Signer(salt=SESSION_ID_SALT).unsign(session_id)
+            return session_id
+        except signing.BadSignature:
+            pass
+    return new_session_id()
+
+
+def estimate_tokens(message):
+    """
+    Approximate token count of a chat message: about 4 characters per token.
+    """
+    return len(message["content"]) // 4 + MESSAGE_OVERHEAD
+
+
+def trim_turns(turns, budget):
+    """
+    The newest turns whose estimated tokens fit in budget, oldest first.
+
+    The last turn is always kept, even if it alone is over the budget.
+    """
+    kept = []
+    used = 0
+    for message in reversed(turns):
+        used += estimate_tokens(message)
+        if kept and used > budget:
+            break
+        kept.append(message)
+    kept.reverse()
+    return kept
+
+
+class Conversation:
+    """
+    The turns of one session.
+
+    Attributes:
+        turns (list): The user and assistant messages, oldest first.
+        last_used (float): time.monotonic() of the last access.
+    """
+
+    def __init__(self):
+        self.turns = []
+        self.last_used = time.monotonic()
+
+
+class ConversationStore:
+    """
+    Conversations by session id, bounded in size, age and tokens per request.
+    """
+
+    def __init__(self, system_prompt=SYSTEM_PROMPT, token_budget=CONVERSATION_TOKEN_BUDGET,
+                 idle_timeout=CONVERSATION_IDLE_TIMEOUT, max_sessions=CONVERSATION_MAX_SESSIONS):
+        self.system_prompt = list(system_prompt)
+        self.token_budget = token_budget
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.conversations = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.conversations)
+
+    def turn_budget(self):
+        """
+        Tokens left for the turns once the system prompt is counted.
+        """
+        return self.token_budget - sum(estimate_tokens(prompt) for prompt in self.system_prompt)
+
+    def evict(self, now):
+        """
+        Drop the idle sessions, then the least recently used ones over max_sessions.
+        """
+        while self.conversations:
+            session_id, conversation = next(iter(self.conversations.items()))
+            if now - conversation.last_used <= self.idle_timeout and len(self.conversations) <= self.max_sessions:
+                break
+            del self.conversations[session_id]
+
+    def conversation(self, session_id):
+        now = time.monotonic()
+        conversation = self.conversations.pop(session_id, None) or Conversation()
+        conversation.last_used = now
+        self.conversations[session_id] = conversation
+        self.evict(now)
+        return conversation
+
+    def messages(self, session_id, message):
+        """
+        The messages to send for a new user message: the system prompt plus
+        the newest turns of the session and the message, within the token budget.
+        """
+        user_message = {"role": "user", "content": message}
+        with self.lock:
+            turns = self.conversation(session_id).turns + [user_message]
+        return self.system_prompt + trim_turns(turns, self.turn_budget())
+
+    def record(self, session_id, message, reply):
+        """
+        Add a user message and the reply of the model to the session.
+
+        The stored turns are trimmed to the token budget too, so a session
+        holds no more than what could be sent.
+        """
+        with self.lock:
+            conversation = self.conversation(session_id)
+            conversation.turns.append({"role": "user", "content": message})
+            conversation.turns.append({"role": "assistant", "content": reply})
+            conversation.turns = trim_turns(conversation.turns, self.turn_budget())
+
+    def clear(self, session_id=None):
+        with self.lock:
+            if session_id is None:
+                self.conversations.clear()
+            else:
+                self.conversations.pop(session_id, None)
+
+
+conversations = ConversationStore()
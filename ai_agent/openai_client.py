@@ -1,5 +1,73 @@
-from openai import OpenAI
-from .config import OPENAI_API_KEY
+import asyncio
+import threading
+import weakref
+from openai import AsyncOpenAI, OpenAI
+from .config import OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MAX_RETRIES, OPENAI_TIMEOUT
+
+_client = None
+_client_lock = threading.Lock()
+# (AsyncOpenAI client, closer) by event loop, since their connections belong to the loop.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def client_options():
+    return {
+        'api_key': OPENAI_API_KEY,
+        'base_url': OPENAI_BASE_URL,
+        'timeout': OPENAI_TIMEOUT,
+        'max_retries': OPENAI_MAX_RETRIES,
+    }
 
 def get_openai_client():
-    return OpenAI(api_key=OPENAI_API_KEY)
\ No newline at end of file
+    """
+    The OpenAI client of the process, created on first use.
+
+    Its connection pool keeps the connections to the API alive, so the
+    messages after the first skip the TCP and TLS handshakes.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(**client_options())
+    return _client
+
+async def close_on_shutdown(loop, client):
+    """
+    Async generator closing client when it is closed, which the event loop
+    does for its async generators when it shuts down (asyncio.run, and the
+    ASGI servers running on it, call loop.shutdown_asyncgens on exit).
+    """
+    try:
+        yield
+    finally:
+        _async_clients.pop(loop, None)
+        await client.close()
+
+async def get_async_openai_client():
+    """
+    The AsyncOpenAI client of the running event loop, created on first use
+    and closed when the loop shuts down.
+
+    Under ASGI the loop lives as long as the server, so every streamed answer
+    reuses the client's pooled connections. Under WSGI each request runs in
+    a loop of its own, so the client only lives for that request.
+    """
+    loop = asyncio.get_running_loop()
+    found = _async_clients.get(loop)
+    if found is None:
+        client = AsyncOpenAI(**client_options())
+        closer = close_on_shutdown(loop, client)
+        # Started in the loop, so the loop tracks it; kept here, since the loop only holds it weakly.
+        await anext(closer)
+        found = _async_clients[loop] = (client, closer)
+    return found[0]
+
+def reset_openai_clients():
+    """
+    Forget the clients, so the next ones are created with the current configuration.
+    """
+    global _client
+    with _client_lock:
+        _client = None
+        _async_clients.clear()
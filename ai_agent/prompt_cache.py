@@ -0,0 +1,105 @@
+"""
+Cache of the AI assistant's answers.
+
+An answer is cached under the messages sent to the model, with the user
+messages normalized (case, spacing and trailing punctuation), plus the
+model and the data version of the invoices. The same question asked at the
+start of two conversations, by any users, is answered by the model once
+until the invoices change. A follow-up question is only shared by
+conversations with the same history.
+
+Entries expire after AI_CACHE_TTL seconds, and at most AI_CACHE_MAX_ENTRIES
+are kept, least recently used first out. Each process has its own cache.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from api.versioning import current_data_version
+from .config import AI_CACHE_MAX_ENTRIES, AI_CACHE_TTL, OPENAI_MODEL
+
+
+def normalize_prompt(text):
+    """
+    A user message without case, repeated spaces or trailing punctuation.
+    """
+    return ' '.join(text.casefold().split()).rstrip('?!. ')
+
+
+def prompt_key(messages, version, model=OPENAI_MODEL):
+    """
+    The cache key of the messages sent to the model at a data version.
+    """
+    normalized = [
+        [message['role'], normalize_prompt(message['content']) if message['role'] == 'user' else message['content']]
+        for message in messages
+    ]
+    raw = json.dumps([model, version, normalized])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def data_version():
+    return current_data_version()[0]
+
+
+class PromptCache:
+    """
+    Answers by key, with a TTL and LRU eviction, counting hits and misses.
+    """
+
+    def __init__(self, ttl=AI_CACHE_TTL, max_entries=AI_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        The answer cached under key, or None.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < now:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, answer):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, answer)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'entries': len(self.entries),
+                'evictions': self.evictions,
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+            }
+
+
+prompt_cache = PromptCache()
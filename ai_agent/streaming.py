@@ -0,0 +1,89 @@
+"""
+Streaming answers of the AI assistant as server-sent events.
+
+The completion is requested with stream=True through the AsyncOpenAI client
+of the event loop, and each piece of text is sent to the dashboard as soon as it
+arrives, so no worker thread waits for the whole answer. Events:
+
+    data: {"delta": "..."}                  a piece of the answer
+    event: done, data: {"session_id": ..., "cached": ...}
+                                            the answer is complete; cached
+                                            answers come in one delta
+    event: error, data: {"error": "..."}    the answer failed or took too long
+
+The whole answer must arrive within AI_STREAM_TIMEOUT seconds. When the
+client disconnects, the server cancels the response and the request to the
+completion API is closed, so the model stops generating.
+"""
+
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from .config import AI_STREAM_TIMEOUT, OPENAI_MODEL
+from .conversations import conversations
+from .openai_client import get_async_openai_client
+from .prompt_cache import data_version, prompt_cache, prompt_key
+
+
+def sse(data, event=None):
+    """
+    A server-sent event with a JSON payload.
+    """
+    prefix = f'event: {event}\n' if event else ''
+    return f'{prefix}data: {json.dumps(data)}\n\n'
+
+
+async def stream_reply(session_id, message, timeout=AI_STREAM_TIMEOUT):
+    """
+    Async generator of the server-sent events answering a user message.
+
+    Answers are shared through the prompt cache with AiAssistant. The turn
+    is added to the session's conversation only once the answer is complete.
+    """
+    stream = None
+    deadline = asyncio.get_running_loop().time() + timeout
+    reply = []
+    try:
+        messages = conversations.messages(session_id, message)
+        key = prompt_key(messages, await sync_to_async(data_version)())
+        cached = prompt_cache.get(key)
+        if cached is not None:
+            conversations.record(session_id, message, cached)
+            yield sse({'delta': cached})
+            yield sse({'session_id': session_id, 'cached': True}, event='done')
+            return
+
+        client = await get_async_openai_client()
+        # The timeouts only cover the awaits on the completion API, never a
+        # yield, so the time the server takes to send the events is not
+        # cancelled as if the API were slow.
+        async with asyncio.timeout_at(deadline):
+            stream = await client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                stream=True,
+            )
+        chunks = aiter(stream)
+        while True:
+            try:
+                async with asyncio.timeout_at(deadline):
+                    chunk = await anext(chunks)
+            except StopAsyncIteration:
+                break
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                reply.append(delta)
+                yield sse({'delta': delta})
+        prompt_cache.set(key, ''.join(reply))
+        conversations.record(session_id, message, ''.join(reply))
+        yield sse({'session_id': session_id, 'cached': False}, event='done')
+    except TimeoutError:
+        print(f"OpenAI did not answer within {timeout} seconds")
+        yield sse({'error': "Sorry, the assistant took too long to answer."}, event='error')
+    except Exception as e:
+        print(f"Error communicating with OpenAI: {e}")
+        yield sse({'error': "Sorry, I couldn't process your request at the moment."}, event='error')
+    finally:
+        # Also runs when the client disconnected and the response was cancelled.
+        if stream is not None:
+            await stream.close()
@@ -1,3 +1,302 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+from django.contrib.sessions.models import Session
+from django.test import AsyncClient, SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+from .conversations import ConversationStore, conversations, estimate_tokens, new_session_id, verified_session_id
+from .openai_client import get_async_openai_client, get_openai_client, reset_openai_clients
+from .prompt_cache import PromptCache, normalize_prompt, prompt_cache, prompt_key
+from .streaming import stream_reply
 
-# Create your tests here.
+SYSTEM_PROMPT = [{"role": "system", "content": "You are a test assistant."}]
+
+
+class ConversationStoreTests(SimpleTestCase):
+    """
+    Conversations are kept per session, within the token budget, and dropped when idle.
+    """
+
+    def test_sessions_are_separate(self):
+        store = ConversationStore(SYSTEM_PROMPT)
+        store.record('a', 'hello from a', 'hi a')
+        messages = store.messages('b', 'hello from b')
+        self.assertEqual(messages, SYSTEM_PROMPT + [{"role": "user", "content": "hello from b"}])
+        self.assertEqual([m['content'] for m in store.messages('a', 'again')], [
+            'You are a test assistant.', 'hello from a', 'hi a', 'again',
+        ])
+
+    def test_budget_keeps_the_system_prompt_and_newest_turns(self):
+        turn = 'x' * 40
+        budget = estimate_tokens(SYSTEM_PROMPT[0]) + 3 * estimate_tokens({"content": turn})
+        store = ConversationStore(SYSTEM_PROMPT, token_budget=budget)
+        for k in range(10):
+            store.record('a', f'{k}'.ljust(40, 'x'), f'{k}'.ljust(40, 'y'))
+        messages = store.messages('a', turn)
+        self.assertEqual(messages[0], SYSTEM_PROMPT[0])
+        self.assertEqual([m['content'][0] for m in messages[1:]], ['9', '9', 'x'])
+        self.assertLessEqual(sum(estimate_tokens(m) for m in messages), budget)
+
+    def test_idle_and_excess_sessions_are_evicted(self):
+        store = ConversationStore(SYSTEM_PROMPT, idle_timeout=60, max_sessions=2)
+        with mock.patch('ai_agent.conversations.time.monotonic', return_value=0):
+            store.record('a', 'm', 'r')
+            store.record('b', 'm', 'r')
+            store.record('c', 'm', 'r')
+        self.assertEqual(list(store.conversations), ['b', 'c'])
+        with mock.patch('ai_agent.conversations.time.monotonic', return_value=120):
+            store.record('d', 'm', 'r')
+        self.assertEqual(list(store.conversations), ['d'])
+
+    def test_only_signed_session_ids_are_accepted(self):
+        session_id = new_session_id()
+        self.assertNotEqual(session_id, new_session_id())
+        self.assertEqual(verified_session_id(session_id), session_id)
+        for forged in [None, 42, 'a', session_id.rsplit(':', 1)[0], session_id[:-1] + '_']:
+            with self.subTest(session_id=forged):
+                self.assertNotIn(verified_session_id(forged), [forged, session_id])
+
+
+class PromptCacheTests(SimpleTestCase):
+    """
+    Answers are shared per normalized prompt and data version, within a TTL and a size.
+    """
+
+    def test_key(self):
+        messages = SYSTEM_PROMPT + [{"role": "user", "content": "How many  open duplicates?"}]
+        same = SYSTEM_PROMPT + [{"role": "user", "content": "how many open duplicates"}]
+        self.assertEqual(normalize_prompt(messages[-1]['content']), 'how many open duplicates')
+        self.assertEqual(prompt_key(messages, 1), prompt_key(same, 1))
+        self.assertNotEqual(prompt_key(messages, 1), prompt_key(messages, 2))
+
+    def test_ttl_lru_and_stats(self):
+        cache = PromptCache(ttl=60, max_entries=2)
+        with mock.patch('ai_agent.prompt_cache.time.monotonic', return_value=0):
+            cache.set('a', 'A')
+            cache.set('b', 'B')
+            self.assertEqual(cache.get('a'), 'A')
+            cache.set('c', 'C')
+            self.assertIsNone(cache.get('b'))
+        with mock.patch('ai_agent.prompt_cache.time.monotonic', return_value=120):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 2)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+class AiAssistantTests(TestCase):
+    """
+    The assistant sends each session's own history to the model.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        conversations.clear()
+        prompt_cache.clear()
+        self.sent = []
+
+        def create(model, messages):
+            self.sent.append(messages)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f'reply {len(self.sent)}'))])
+
+        openai_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        patcher = mock.patch('ai_agent.views.get_openai_client', return_value=openai_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, message, session_id=None):
+        body = {'message': message}
+        if session_id is not None:
+            body['session_id'] = session_id
+        return self.client.post('/ai/ai_assistant/', body, format='json')
+
+    def test_session_history(self):
+        first = self.post('hello')
+        self.assertEqual(first.data['response'], 'reply 1')
+        other = self.post('other user')
+        self.assertNotEqual(other.data['session_id'], first.data['session_id'])
+        again = self.post('again', first.data['session_id'])
+        self.assertEqual(again.data['session_id'], first.data['session_id'])
+        turns = [m['content'] for m in self.sent[2] if m['role'] != 'system']
+        self.assertEqual(turns, ['hello', 'reply 1', 'again'])
+        self.assertEqual(len(conversations.conversations), 2)
+        self.assertEqual(Session.objects.count(), 0)
+
+    def test_unsigned_session_id_starts_a_new_session(self):
+        first = self.post('hello')
+        forged = first.data['session_id'].rsplit(':', 1)[0]
+        conversations.record(forged, 'secret', 'reply')
+        response = self.post('what did they say?', forged)
+        self.assertNotIn(response.data['session_id'], [forged, first.data['session_id']])
+        self.assertEqual([m['content'] for m in self.sent[1] if m['role'] != 'system'], ['what did they say?'])
+
+    def test_same_question_is_answered_once(self):
+        first = self.post('How many open duplicates?')
+        second = self.post('  how many OPEN duplicates')
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(second.data['response'], 'reply 1')
+        self.assertEqual(len(self.sent), 1)
+        # The other session continues from the cached answer.
+        self.assertEqual(conversations.conversations[second.data['session_id']].turns[-1]['content'], 'reply 1')
+        self.assertEqual(self.client.get('/ai/ai_assistant/cache/').data['hits'], 1)
+
+    def test_data_change_misses(self):
+        self.post('hello')
+        with mock.patch('ai_agent.views.data_version', return_value=99):
+            response = self.post('hello')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(self.sent), 2)
+
+
+class StubCompletionServer(ThreadingHTTPServer):
+    """
+    Local server faking the streamed chat completion API.
+
+    Sends a chunk for each of pieces, then, with stall, keep-alive comments
+    until the client goes away instead of ending the stream.
+
+    Attributes:
+        requests (list): The JSON bodies received.
+        disconnected (threading.Event): Set when the client closed the connection early.
+    """
+
+    def __init__(self, pieces, stall=False):
+        super().__init__(('127.0.0.1', 0), StubCompletionHandler)
+        self.pieces = pieces
+        self.stall = stall
+        self.requests = []
+        self.disconnected = threading.Event()
+        self.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_port}/v1'
+
+
+class StubCompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_event(self, text):
+        self.wfile.write(text.encode())
+        self.wfile.flush()
+
+    def do_POST(self):
+        self.server.requests.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        try:
+            for piece in self.server.pieces:
+                chunk = {
+                    'id': 'chatcmpl-stub', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'stub',
+                    'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}],
+                }
+                self.send_event(f'data: {json.dumps(chunk)}\n\n')
+            while self.server.stall:
+                time.sleep(0.05)
+                self.send_event(': keep-alive\n\n')
+            self.send_event('data: [DONE]\n\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.disconnected.set()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def parse_events(text):
+    events = []
+    for block in text.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((fields.get('event', 'message'), json.loads(fields['data'])))
+    return events
+
+
+class AiAssistantStreamTests(TestCase):
+    """
+    The streaming assistant against a local stub of the completion API.
+    """
+
+    def start_stub(self, pieces, stall=False):
+        server = StubCompletionServer(pieces, stall)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        for name, value in [('OPENAI_BASE_URL', server.base_url), ('OPENAI_API_KEY', 'test')]:
+            patcher = mock.patch(f'ai_agent.openai_client.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        reset_openai_clients()
+        self.addCleanup(reset_openai_clients)
+        conversations.clear()
+        prompt_cache.clear()
+        return server
+
+    async def post(self, client, body):
+        response = await client.post('/ai/ai_assistant/stream/', body, content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return parse_events(''.join([chunk.decode() async for chunk in response.streaming_content]))
+
+    async def test_streams_the_answer(self):
+        server = self.start_stub(['Hel', 'lo'])
+        events = await self.post(AsyncClient(), {'message': 'hi'})
+        session_id = events[-1][1]['session_id']
+        self.assertEqual(events, [
+            ('message', {'delta': 'Hel'}), ('message', {'delta': 'lo'}), ('done', {'session_id': session_id, 'cached': False}),
+        ])
+        self.assertTrue(server.requests[0]['stream'])
+        self.assertEqual(conversations.conversations[session_id].turns[-1], {'role': 'assistant', 'content': 'Hello'})
+        await self.post(AsyncClient(), {'message': 'again', 'session_id': session_id})
+        self.assertEqual(len(conversations.conversations[session_id].turns), 4)
+
+    async def test_unsigned_session_id_starts_a_new_session(self):
+        server = self.start_stub(['Hel', 'lo'])
+        conversations.record('a', 'secret', 'reply')
+        events = await self.post(AsyncClient(), {'message': 'Hi again', 'session_id': 'a'})
+        self.assertNotEqual(events[-1][1]['session_id'], 'a')
+        self.assertEqual([m['content'] for m in server.requests[0]['messages'] if m['role'] != 'system'], ['Hi again'])
+        self.assertEqual(len(conversations.conversations['a'].turns), 2)
+
+    async def test_cached_answer(self):
+        server = self.start_stub(['Hel', 'lo'])
+        [event async for event in stream_reply('a', 'hi')]
+        text = ''.join([event async for event in stream_reply('b', 'Hi!')])
+        self.assertEqual(parse_events(text), [('message', {'delta': 'Hello'}), ('done', {'session_id': 'b', 'cached': True})])
+        self.assertEqual(len(server.requests), 1)
+
+    def test_one_client_per_event_loop(self):
+        server = self.start_stub(['Hel', 'lo'])
+        self.assertIs(get_openai_client(), get_openai_client())
+
+        async def answer_twice():
+            client = await get_async_openai_client()
+            with mock.patch.object(client.chat.completions, 'create', wraps=client.chat.completions.create) as create:
+                [event async for event in stream_reply('a', 'hi')]
+                [event async for event in stream_reply('a', 'again')]
+            self.assertEqual(create.call_count, 2)
+            self.assertIs(await get_async_openai_client(), client)
+            return client
+
+        client = asyncio.run(answer_twice())
+        self.assertEqual(len(server.requests), 2)
+        # Closed with its loop, and a new loop gets a new client.
+        self.assertTrue(client.is_closed())
+        self.assertIsNot(asyncio.run(get_async_openai_client()), client)
+
+    async def test_disconnect_cancels_the_completion(self):
+        server = self.start_stub(['Hel'], stall=True)
+        events = stream_reply('a', 'hi')
+        self.assertEqual(parse_events(await anext(events)), [('message', {'delta': 'Hel'})])
+        await events.aclose()
+        self.assertTrue(await asyncio.to_thread(server.disconnected.wait, 5))
+        self.assertEqual(conversations.conversations['a'].turns, [])
+
+    async def test_timeout(self):
+        server = self.start_stub([], stall=True)
+        text = ''.join([event async for event in stream_reply('a', 'hi', timeout=0.3)])
+        self.assertEqual(parse_events(text)[0][0], 'error')
+        self.assertTrue(await asyncio.to_thread(server.disconnected.wait, 5))
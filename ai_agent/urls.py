@@ -5,6 +5,10 @@ This module defines the URL patterns for the ai_agent app, mapping URL paths to
 Routes:
 - "alerts/": Maps to the Alerts view, accessible via the name "alerts".
 - "ai_assistant/": Maps to the AiAssistant view, accessible via the name "ai-assistant".
+- "ai_assistant/stream/": Maps to the async AiAssistantStream view, streaming the answers as
+  server-sent events, accessible via the name "ai-assistant-stream".
+- "ai_assistant/cache/": Maps to the AiCacheStats view, reporting the hits and misses of the
+  answer cache, accessible via the name "ai-cache-stats".
 Imports:
 - path: A function from django.urls used to define URL patterns.
 - views: The module containing the view classes for the ai_agent app.
@@ -15,4 +19,6 @@ from . import views
 urlpatterns = [
     path("alerts/", views.Alerts.as_view(), name="alerts"),
     path("ai_assistant/", views.AiAssistant.as_view(), name="ai-assistant"),
+    path("ai_assistant/stream/", views.AiAssistantStream.as_view(), name="ai-assistant-stream"),
+    path("ai_assistant/cache/", views.AiCacheStats.as_view(), name="ai-cache-stats"),
 ]
\ No newline at end of file
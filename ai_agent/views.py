@@ -1,7 +1,16 @@
+import json
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from .config import OPENAI_MODEL
+from .conversations import conversations, verified_session_id
 from .openai_client import get_openai_client
+from .prompt_cache import data_version, prompt_cache, prompt_key
+from .streaming import stream_reply
 
 
 class Alerts(APIView):
@@ -20,36 +29,100 @@ class Alerts(APIView):
         })
 
 class AiAssistant(APIView):
-    conversation_history = [
-        {"role": "system", "content": "You are a helpful assistant called OfiA. You were designed by the company Ofiservices to help with duplicate invoice identification. Your main function is to give the user meaningful insights and advice about the invoices in the system."},
-        {"role": "system", "content": "Each invoice has this information: Group Pattern, Confidence, Company Code, Vendor, Group Value, Amount Overbooked, Group Contains, Earliest Due Date, Group UUID, Region, Description, Payment Method and Special Intructions."},
-        {"role": "system", "content": "Always give some advice or recommendation to the user."},
-        {"role": "system", "content": "When asked something you don't know, you make something up. You never say you dont know or that you cant access data. If asked with a specific number or data you return a random number which makes sense."},
-        {"role": "system", "content": "This is the list of vendors: Acme Corporation, Destec Office, Global Business, AluCast, Manhattan Corporation, State of California, Enigma, IOT Furniture, Pyramid Systems, WCB, Noe Food Company, Meyers Real Estate, GATORSA, Aztec Supplies, World Wide, CAFS Chemicals, CET New York"}, 
-        {"role": "system", "content": "Always start by introducing yourself"},
-        {"role": "system", "content": "The references of each invoices have this structure: INV-<number>"},
-        {"role": "system", "content": "These are the current KPI: Total similar invoices: 401 Total open similar invoices: 309 Total value of similar invoices: 1976659.459 Total value of open similar invoices: 1431130.88 "},
-    ]
-
-    def message_openai(self, message):
+    """
+    API view to chat with the AI assistant.
+
+    Each session has its own conversation (see ai_agent.conversations): the
+    model gets the system prompt plus the newest turns of the session that fit
+    in the token budget. Session ids are signed by the server, so a client can
+    never continue someone else's conversation. Answers are cached per
+    normalized prompt and data version (see ai_agent.prompt_cache), and
+    responses carry X-Cache: HIT or MISS.
+
+    Body:
+        - message: The user message
+        - session_id: The session_id of a previous response, to continue its
+          conversation. A new session is started without one, or with one the
+          server did not issue.
+
+    Returns:
+        - response: The answer
+        - session_id: The session to send with the next message
+    """
+
+    def message_openai(self, session_id, message):
+        """
+        The answer to a message and whether it came from the prompt cache.
+        """
         try:
-            client = get_openai_client()
-            self.conversation_history.append({"role": "user", "content": message})
-            completion = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=self.conversation_history
-            )
-            return completion.choices[0].message.content
+            messages = conversations.messages(session_id, message)
+            key = prompt_key(messages, data_version())
+            response = prompt_cache.get(key)
+            cached = response is not None
+            if not cached:
+                client = get_openai_client()
+                completion = client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=messages
+                )
+                response = completion.choices[0].message.content
+                prompt_cache.set(key, response)
+            conversations.record(session_id, message, response)
+            return response, cached
         except Exception as e:
             print(f"Error communicating with OpenAI: {e}")
-            return "Sorry, I couldn't process your request at the moment."
+            return "Sorry, I couldn't process your request at the moment.", False
 
     def post(self, request, format=None):
         try:
             data = request.data
             message = data.get('message')
-            response = self.message_openai(message)
-            return Response({'response': response})
+            if not message:
+                return Response({"error": "message is required"}, status=400)
+            session_id = verified_session_id(data.get('session_id'))
+            response, cached = self.message_openai(session_id, message)
+            result = Response({'response': response, 'session_id': session_id})
+            result['X-Cache'] = 'HIT' if cached else 'MISS'
+            return result
         except Exception as e:
             print(f"Error processing request: {e}")
-            return Response({"error": str(e)}, status=500)
\ No newline at end of file
+            return Response({"error": str(e)}, status=500)
+
+class AiCacheStats(APIView):
+    """
+    API view to report the hits and misses of the assistant's answer cache (see ai_agent.prompt_cache).
+    """
+
+    def get(self, request, format=None):
+        return Response(prompt_cache.stats())
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AiAssistantStream(View):
+    """
+    Async view streaming the answers of the AI assistant as server-sent events.
+
+    Takes the same body as AiAssistant and shares its conversations; the
+    events are described in ai_agent.streaming. Served without blocking a
+    worker when the project runs on ASGI (ofi_dashboard_backend.asgi).
+
+    Body:
+        - message: The user message
+        - session_id: The session_id of a previous answer, to continue its
+          conversation. It is sent in the done event.
+    """
+
+    async def post(self, request):
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({"error": "The body must be JSON"}, status=400)
+        message = data.get('message') if isinstance(data, dict) else None
+        if not message:
+            return JsonResponse({"error": "message is required"}, status=400)
+
+        session_id = verified_session_id(data.get('session_id'))
+        response = StreamingHttpResponse(stream_reply(session_id, message), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Tell proxies such as nginx to pass the events on as they come.
+        response['X-Accel-Buffering'] = 'no'
+        return response
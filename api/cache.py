@@ -0,0 +1,102 @@
+"""
+Read-through cache of the responses of the read endpoints.
+
+A response is cached under its view, host, path, normalized query
+parameters and the data version, so a change of the invoices makes every
+older entry unreachable and the entries expire on their own. The backend is
+the Django cache named by settings.RESPONSE_CACHE_ALIAS: an in-memory LRU
+with a TTL by default, or files to share entries between processes.
+
+Concurrent misses of the same key in a process are coalesced: the first
+request computes the response while the others wait for it and read the
+cached entry.
+"""
+
+import functools
+import hashlib
+import threading
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+from .versioning import current_data_version, unseeded_random
+
+
+def response_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def normalized_params(params):
+    """
+    The query parameters as a canonical string: keys sorted, the values of
+    each key sorted, empty values dropped.
+    """
+    items = []
+    for key in sorted(params):
+        values = sorted(value for value in params.getlist(key) if value != '')
+        items.extend(f'{key}={value}' for value in values)
+    return '&'.join(items)
+
+
+def response_key(view_name, request):
+    version = current_data_version(request)[0]
+    raw = '|'.join([view_name, request.get_host(), request.path, normalized_params(request.query_params), str(version)])
+    return f'api:response:{hashlib.sha256(raw.encode()).hexdigest()}'
+
+
+class KeyLocks:
+    """
+    One lock per key, dropped when no thread holds or waits for it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    def acquire(self, key):
+        with self.lock:
+            entry = self.locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        entry[0].acquire()
+
+    def release(self, key):
+        with self.lock:
+            entry = self.locks[key]
+            entry[0].release()
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[key]
+
+
+_key_locks = KeyLocks()
+
+
+def cached_response(get):
+    """
+    Cache the successful responses of the get method of an APIView.
+
+    Cached responses carry X-Cache: HIT, computed ones X-Cache: MISS.
+    Unseeded random listings differ on every request and are not cached.
+    """
+    @functools.wraps(get)
+    def wrapper(view, request, *args, **kwargs):
+        if unseeded_random(request):
+            return get(view, request, *args, **kwargs)
+        cache = response_cache()
+        key = response_key(type(view).__name__, request)
+        data = cache.get(key)
+        if data is None:
+            _key_locks.acquire(key)
+            try:
+                data = cache.get(key)
+                if data is None:
+                    response = get(view, request, *args, **kwargs)
+                    if response.status_code == 200:
+                        cache.set(key, response.data)
+                    response['X-Cache'] = 'MISS'
+                    return response
+            finally:
+                _key_locks.release(key)
+        response = Response(data)
+        response['X-Cache'] = 'HIT'
+        return response
+    return wrapper
@@ -0,0 +1,130 @@
+"""
+Transitive duplicate groups from a stream of matched pairs.
+
+Matched pairs are folded into a union-find structure as they arrive, so the
+pairs themselves are never stored: memory grows with the number of invoices
+and groups, not with the number of pairs.
+"""
+
+from array import array
+from .matching import PATTERN_LABELS, pattern_confidence
+
+
+class UnionFind:
+    """
+    Disjoint sets over the integers 0..n-1, with path compression and union by size.
+    """
+
+    def __init__(self, n):
+        self.parent = array('q', range(n))
+        self.size = array('q', [1]) * n
+
+    def find(self, x):
+        parent = self.parent
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(self, a, b):
+        """
+        Merge the sets of a and b and return the root of the merged set.
+        """
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+        return root_a
+
+
+class DuplicateClusterer:
+    """
+    Build duplicate groups from matched pairs of invoices.
+
+    Invoices are identified by their position 0..n-1 (the compact ids used
+    by the matching engine). Besides the union-find, only the set of pattern
+    labels seen in each group is kept, keyed by the group's current root.
+
+    Attributes:
+        n (int): The number of invoices.
+        sets (UnionFind): The groups found so far.
+        labels (dict): Root -> set of Invoice.pattern labels matched inside the group.
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.sets = UnionFind(n)
+        self.labels = {}
+
+    def add(self, i, j, pattern):
+        """
+        Record that invoices i and j match under the given rule name.
+        """
+        root_i, root_j = self.sets.find(i), self.sets.find(j)
+        labels = self.labels.pop(root_i, set())
+        if root_j != root_i:
+            labels |= self.labels.pop(root_j, set())
+        labels.add(PATTERN_LABELS[pattern])
+        self.labels[self.sets.union(root_i, root_j)] = labels
+
+    def consume(self, matches):
+        """
+        Add every (i, j, pattern) of a stream of matches, such as matching.iter_matches.
+        """
+        for i, j, pattern in matches:
+            self.add(i, j, pattern)
+        return self
+
+    def group_pattern(self, root):
+        labels = self.labels.get(root)
+        if not labels:
+            return 'unique'
+        if len(labels) > 1:
+            return 'Multiple'
+        return next(iter(labels))
+
+    def groups(self):
+        """
+        Number the groups and summarize them.
+
+        Group ids are assigned in order of the first invoice of each group, so
+        the same input always gives the same ids. Invoices without matches get
+        a group of their own.
+
+        Returns:
+            tuple: (group_ids, summaries). group_ids holds the group id of
+            each invoice. summaries holds one dict per group id, with the
+            group's size, pattern and confidence.
+        """
+        group_ids = array('q', [0]) * self.n
+        root_ids = {}
+        summaries = []
+        for i in range(self.n):
+            root = self.sets.find(i)
+            group_id = root_ids.get(root)
+            if group_id is None:
+                group_id = root_ids[root] = len(summaries)
+                pattern = self.group_pattern(root)
+                summaries.append({
+                    'group_id': group_id,
+                    'size': self.sets.size[root],
+                    'pattern': pattern,
+                    'confidence': pattern_confidence(pattern),
+                })
+            group_ids[i] = group_id
+        return group_ids, summaries
+
+
+def cluster(n, matches):
+    """
+    Group n invoices from a stream of (i, j, pattern) matches.
+
+    Returns:
+        tuple: (group_ids, summaries), see DuplicateClusterer.groups.
+    """
+    return DuplicateClusterer(n).consume(matches).groups()
@@ -0,0 +1,136 @@
+"""
+Streaming exports of invoices and group summaries as NDJSON or CSV.
+
+Rows are read with a server-side iterator (QuerySet.iterator) in chunks,
+converted chunk by chunk and sent as they are produced, so memory use does
+not depend on the size of the export and there is no COUNT or OFFSET.
+"""
+
+import csv
+import json
+from django.http import StreamingHttpResponse
+from .ingest import batched
+from .serializers import invoice_rows
+
+# file_format parameter -> content type.
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Keys of an exported group summary, as in /api/groups/, and their InvoiceGroup fields.
+GROUP_FIELDS = (
+    ('group_id', 'group_id'),
+    ('amount_overpaid', 'amount_overpaid'),
+    ('itemCount', 'item_count'),
+    ('date', 'date'),
+    ('region', 'region'),
+    ('pattern', 'pattern'),
+    ('open', 'open'),
+    ('confidence', 'confidence'),
+)
+
+# Rows read from the database per round trip, and most accepted.
+DEFAULT_CHUNK_SIZE = 2000
+MAX_CHUNK_SIZE = 10000
+
+# Encodes like the API's JSON renderer.
+_encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+
+
+def export_options(params):
+    """
+    The file format and chunk size of an export request.
+
+    Raises:
+        ValueError: If file_format or chunk_size is not valid.
+    """
+    file_format = params.get('file_format') or 'ndjson'
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"file_format must be one of {', '.join(EXPORT_FORMATS)}")
+    try:
+        chunk_size = int(params.get('chunk_size') or DEFAULT_CHUNK_SIZE)
+    except ValueError:
+        raise ValueError('chunk_size must be an integer')
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f'chunk_size must be between 1 and {MAX_CHUNK_SIZE}')
+    return file_format, chunk_size
+
+
+def invoice_batches(invoices, chunk_size):
+    """
+    The invoices, as in /api/invoices/, in lists of up to chunk_size rows.
+    """
+    rows = invoice_rows.queryset(invoices).iterator(chunk_size=chunk_size)
+    for batch in batched(rows, chunk_size):
+        yield invoice_rows.to_representation(batch)
+
+
+def group_batches(groups, chunk_size):
+    """
+    The group summaries, as in /api/groups/ without their items, in lists of up to chunk_size rows.
+    """
+    names = [name for name, field in GROUP_FIELDS]
+    rows = groups.values_list(*(field for name, field in GROUP_FIELDS)).iterator(chunk_size=chunk_size)
+    for batch in batched(rows, chunk_size):
+        data = []
+        for row in batch:
+            item = dict(zip(names, row))
+            item['amount_overpaid'] = float(item['amount_overpaid'])
+            if item['date'] is not None:
+                date = item['date'].isoformat()
+                item['date'] = date[:-6] + 'Z' if date.endswith('+00:00') else date
+            data.append(item)
+        yield data
+
+
+def ndjson_chunks(batches):
+    """
+    One JSON object per line, one string per batch.
+    """
+    for batch in batches:
+        lines = ''.join(_encoder.encode(item) + '\n' for item in batch)
+        yield lines.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+class Echo:
+    """
+    File-like object handing back what csv.writer writes to it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_value(value):
+    """
+    A JSON value as a CSV cell: empty for null, true/false for booleans.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value
+
+
+def csv_chunks(names, batches):
+    """
+    A header row, then the rows of each batch, one string per batch.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(names)
+    for batch in batches:
+        yield ''.join(writer.writerow([csv_value(item[name]) for name in names]) for item in batch)
+
+
+def export_response(batches, names, file_format, filename):
+    """
+    Stream batches of rows as an NDJSON or CSV attachment.
+
+    Args:
+        batches (iterable): Lists of row dicts, produced lazily.
+        names (list): The keys of the rows, the CSV columns.
+        file_format (str): A key of EXPORT_FORMATS.
+        filename (str): The name of the file, without extension.
+    """
+    chunks = csv_chunks(names, batches) if file_format == 'csv' else ndjson_chunks(batches)
+    response = StreamingHttpResponse(chunks, content_type=EXPORT_FORMATS[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{file_format}"'
+    return response
@@ -0,0 +1,206 @@
+"""
+In-memory facet index of the invoices.
+
+For each facet (reference, vendor, pattern, region, payment method, and the
+invoice date with its day and month) the index keeps a value -> count
+dictionary and the sorted list of the values, so prefix lookups are a
+binary search and every answer can be cut to a limit. It is built with one
+pass over the invoices and kept current on writes through invoices_changed:
+created and deleted invoices are added and removed, updated ones moved from
+their old values to the new.
+
+Each process keeps its own index, with the data version it reflects (see
+api.versioning). A change is applied only on top of the version just before
+it; when the data version is ahead of the index on a read, because of a
+change made by another process or one the index could not apply, the index
+is rebuilt. So the index always matches the ETag the response is sent with.
+"""
+
+import bisect
+import threading
+from collections import Counter
+from datetime import timezone as dt_timezone
+from django.db import transaction
+from django.utils import timezone
+from .models import Invoice
+from .versioning import current_data_version
+
+# Facets of the index. date holds the invoice dates as UTC datetimes; day
+# and month are derived from them.
+FACETS = ('reference', 'vendor', 'pattern', 'region', 'payment_method', 'date', 'day', 'month')
+
+# Invoice fields read to build the facets.
+SOURCE_FIELDS = ('reference', 'vendor', 'pattern', 'region', 'payment_method', 'date')
+
+
+def date_buckets(date):
+    """
+    The day (YYYY-MM-DD) and month (YYYY-MM) of an invoice date, in the current time zone.
+    """
+    if date is None:
+        return None, None
+    if timezone.is_aware(date):
+        date = timezone.localtime(date)
+    day = date.date().isoformat()
+    return day, day[:7]
+
+
+def utc_date(date):
+    """
+    An invoice date as an aware UTC datetime, as read from the database.
+    """
+    if date is None:
+        return None
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date.astimezone(dt_timezone.utc)
+
+
+def facet_values(row):
+    """
+    The facet values of an invoice, from its SOURCE_FIELDS values.
+    """
+    reference, vendor, pattern, region, payment_method, date = row
+    return (reference, vendor, pattern, region, payment_method, utc_date(date)) + date_buckets(date)
+
+
+def invoice_row(invoice):
+    return tuple(getattr(invoice, field) for field in SOURCE_FIELDS)
+
+
+class FacetIndex:
+    """
+    Value counts and sorted values of each facet.
+
+    Attributes:
+        counts (dict): Facet -> Counter of its values.
+        keys (dict): Facet -> sorted list of the values with a count.
+        version (int): The data version the index reflects.
+    """
+
+    def __init__(self, version=0):
+        self.counts = {facet: Counter() for facet in FACETS}
+        self.keys = {facet: [] for facet in FACETS}
+        self.version = version
+        self.lock = threading.RLock()
+
+    @classmethod
+    def build(cls, rows, version=0):
+        """
+        Build an index from (reference, vendor, pattern, region, payment_method, date) rows.
+        """
+        index = cls(version)
+        for row in rows:
+            for facet, value in zip(FACETS, facet_values(row)):
+                if value is not None:
+                    index.counts[facet][value] += 1
+        for facet in FACETS:
+            index.keys[facet] = sorted(index.counts[facet])
+        return index
+
+    def update(self, rows, sign=1):
+        """
+        Count rows in (sign=1) or out (sign=-1) of the index.
+        """
+        with self.lock:
+            for row in rows:
+                for facet, value in zip(FACETS, facet_values(row)):
+                    if value is None:
+                        continue
+                    counts = self.counts[facet]
+                    counts[value] += sign
+                    if counts[value] <= 0:
+                        del counts[value]
+                        keys = self.keys[facet]
+                        position = bisect.bisect_left(keys, value)
+                        if position < len(keys) and keys[position] == value:
+                            del keys[position]
+                    elif sign > 0 and counts[value] == 1:
+                        bisect.insort(self.keys[facet], value)
+
+    def values(self, facet, prefix='', limit=None):
+        """
+        The values of a facet starting with prefix, in sorted order, at most limit of them.
+
+        The values of the date facet are datetimes, only listed without a prefix.
+        """
+        with self.lock:
+            keys = self.keys[facet]
+            start = bisect.bisect_left(keys, prefix) if prefix else 0
+            found = []
+            for value in keys[start:]:
+                if (prefix and not value.startswith(prefix)) or (limit is not None and len(found) >= limit):
+                    break
+                found.append(value)
+            return found
+
+    def facet(self, facet, prefix='', limit=None):
+        """
+        value -> count for the values of a facet starting with prefix, in sorted order.
+        """
+        with self.lock:
+            counts = self.counts[facet]
+            return {value: counts[value] for value in self.values(facet, prefix, limit)}
+
+    def apply(self, version, removed=(), added=()):
+        """
+        Count removed rows out and added rows in, if the change made data
+        version version right after the one of the index.
+        """
+        with self.lock:
+            if self.version != version - 1:
+                return False
+            self.update(removed, -1)
+            self.update(added, 1)
+            self.version = version
+            return True
+
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def build_facet_index():
+    """
+    Build an index of the invoices, with the data version they are at.
+    """
+    # One transaction, so the version and the rows are read from the same state.
+    with transaction.atomic():
+        version = current_data_version()[0]
+        rows = Invoice.objects.order_by().values_list(*SOURCE_FIELDS).iterator(chunk_size=5000)
+        return FacetIndex.build(rows, version)
+
+
+def get_facet_index(request=None):
+    """
+    The facet index of this process, built on first use and rebuilt when
+    behind the data version of the request.
+    """
+    global _index
+    version = current_data_version(request)[0]
+    index = _index
+    if index is None or index.version < version:
+        with _build_lock:
+            if _index is None or _index.version < version:
+                _index = build_facet_index()
+            index = _index
+    return index
+
+
+def apply_change(version, removed=(), added=()):
+    """
+    Apply the change that made data version version to the index, if it is
+    the next change of the index. Otherwise the index is rebuilt on the next
+    read, unless it was already built with the change.
+    """
+    if _index is not None:
+        _index.apply(version, removed, added)
+
+
+def invalidate_facets():
+    """
+    Forget the index, so the next read builds it again.
+    """
+    global _index
+    with _build_lock:
+        _index = None
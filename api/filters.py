@@ -0,0 +1,113 @@
+"""
+Query-parameter filters shared by the invoice and group endpoints.
+"""
+
+from .matching import vendor_key
+
+
+def filter_invoices(invoices, params):
+    """
+    Apply the invoice filters found in the query parameters.
+
+    Filters:
+        - reference: Filter by invoice references (multiple values allowed)
+        - vendor: Filter by vendor names (multiple values allowed)
+        - vendor_match: Filter by vendor names ignoring case, spaces and punctuation (multiple values allowed)
+        - pattern: Filter by pattern types (multiple values allowed)
+        - open: Filter by open status (true/false)
+        - group_id: Filter by group ID
+        - start_date: Filter by start date (inclusive)
+        - end_date: Filter by end date (inclusive)
+
+    Args:
+        invoices (QuerySet): The invoices to filter.
+        params (QueryDict): The query parameters of the request.
+
+    Returns:
+        QuerySet: The filtered invoices.
+    """
+    references = params.getlist('reference')
+    vendors = params.getlist('vendor')
+    vendor_matches = params.getlist('vendor_match')
+    patterns = params.getlist('pattern')
+    open = params.get('open')
+    group = params.get('group_id')
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+
+    if references:
+        invoices = invoices.filter(reference__in=references)
+    if vendors:
+        invoices = invoices.filter(vendor__in=vendors)
+    if vendor_matches:
+        invoices = invoices.filter(vendor_key__in=[vendor_key(vendor) for vendor in vendor_matches])
+    if patterns:
+        invoices = invoices.filter(pattern__in=patterns)
+    if open:
+        # open=True compiles to a bare WHERE "open", which SQLite cannot look
+        # up in an index; an IN lookup can.
+        invoices = invoices.filter(open__in=[open.lower() == 'true'])
+    if group:
+        invoices = invoices.filter(group_id=group)
+    if start_date:
+        invoices = invoices.filter(date__gte=start_date)
+    if end_date:
+        invoices = invoices.filter(date__lte=end_date)
+    return invoices
+
+
+# Values of the ordering parameter of the group endpoints -> InvoiceGroup field.
+GROUP_ORDERINGS = {'date': 'date', 'amount_overpaid': 'amount_overpaid', 'itemCount': 'item_count'}
+
+
+def filter_groups(groups, params):
+    """
+    Apply the group filters found in the query parameters.
+
+    Filters:
+        - pattern: Filter by pattern types (multiple values allowed)
+        - confidence: Filter by confidence levels (multiple values allowed)
+        - region: Filter by regions (multiple values allowed)
+        - open: Filter by open status (true/false)
+        - start_date: Filter by start date (inclusive)
+        - end_date: Filter by end date (inclusive)
+
+    Args:
+        groups (QuerySet): The InvoiceGroup rows to filter.
+        params (QueryDict): The query parameters of the request.
+
+    Returns:
+        QuerySet: The filtered groups.
+    """
+    patterns = params.getlist('pattern')
+    confidences = params.getlist('confidence')
+    regions = params.getlist('region')
+    open = params.get('open')
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+
+    if patterns:
+        groups = groups.filter(pattern__in=patterns)
+    if confidences:
+        groups = groups.filter(confidence__in=confidences)
+    if regions:
+        groups = groups.filter(region__in=regions)
+    if open:
+        # An IN lookup, so SQLite can use the index on open (see filter_invoices).
+        groups = groups.filter(open__in=[open.lower() == 'true'])
+    if start_date:
+        groups = groups.filter(date__gte=start_date)
+    if end_date:
+        groups = groups.filter(date__lte=end_date)
+    return groups
+
+
+def order_groups(groups, ordering):
+    """
+    Order the groups by a GROUP_ORDERINGS key, prefixed with - for descending
+    order, then by their first invoice. Without ordering, by their first invoice.
+    """
+    if not ordering:
+        return groups.order_by('first_invoice_id')
+    field = GROUP_ORDERINGS[ordering.lstrip('-')]
+    return groups.order_by(('-' if ordering.startswith('-') else '') + field, 'first_invoice_id')
@@ -0,0 +1,134 @@
+"""
+Maintenance of the InvoiceGroup summaries.
+
+Each InvoiceGroup row stores the aggregates the dashboard shows for a group
+of similar invoices. When invoices are saved, updated, bulk created or
+deleted, only the summaries of the groups they belong to (or left) are
+recomputed, from the invoices of those groups.
+
+Inside deferred_refresh, the groups to refresh are collected and refreshed
+once on exit, so bulk paths pay one refresh per group instead of one per
+invoice.
+"""
+
+import threading
+from contextlib import contextmanager
+from django.db import transaction
+from django.db.models import Count, Min, Sum
+from .models import Invoice, InvoiceGroup
+
+# Fields of InvoiceGroup recomputed by a refresh.
+SUMMARY_FIELDS = (
+    'first_invoice', 'total_value', 'amount_overpaid', 'item_count', 'date',
+    'region', 'pattern', 'open', 'confidence',
+)
+
+# Group ids refreshed per query, to stay below the database's parameter limits.
+CHUNK_SIZE = 500
+
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred_refresh():
+    """
+    Collect the groups refreshed inside the block and refresh them once, on exit.
+
+    Nested blocks join the outermost one. If the block raises, nothing is refreshed.
+    """
+    if getattr(_deferred, 'pending', None) is not None:
+        yield
+        return
+    _deferred.pending = set()
+    try:
+        yield
+        pending = _deferred.pending
+    finally:
+        _deferred.pending = None
+    refresh_groups(pending)
+
+
+def summarize(group_ids):
+    """
+    Compute the InvoiceGroup rows of the given groups from their invoices.
+
+    Returns:
+        list: Unsaved InvoiceGroup instances, one per group that still has invoices.
+    """
+    summaries = list(
+        Invoice.objects.filter(group_id__in=group_ids).order_by().values('group_id').annotate(
+            total_value=Sum('value'),
+            item_count=Count('id'),
+            first_date=Min('date'),
+            first_id=Min('id'),
+        )
+    )
+    firsts = {
+        invoice['id']: invoice
+        for invoice in Invoice.objects.filter(pk__in=[summary['first_id'] for summary in summaries]).values(
+            'id', 'value', 'region', 'pattern', 'open', 'confidence'
+        )
+    }
+    groups = []
+    for summary in summaries:
+        first = firsts[summary['first_id']]
+        groups.append(InvoiceGroup(
+            group_id=summary['group_id'],
+            first_invoice_id=first['id'],
+            total_value=summary['total_value'],
+            amount_overpaid=summary['total_value'] - first['value'],
+            item_count=summary['item_count'],
+            date=summary['first_date'],
+            region=first['region'],
+            pattern=first['pattern'],
+            open=first['open'],
+            confidence=first['confidence'],
+        ))
+    return groups
+
+
+def write_groups(group_ids):
+    """
+    Recompute and store the summaries of the given groups, removing the empty ones.
+    """
+    groups = summarize(group_ids)
+    if groups:
+        InvoiceGroup.objects.bulk_create(
+            groups, update_conflicts=True, unique_fields=['group_id'], update_fields=SUMMARY_FIELDS,
+        )
+    InvoiceGroup.objects.filter(group_id__in=group_ids).exclude(
+        group_id__in=[group.group_id for group in groups]
+    ).delete()
+
+
+def refresh_groups(group_ids):
+    """
+    Bring the summaries of the given groups up to date.
+
+    Invoices without a group_id (not grouped yet) have no summary.
+    """
+    group_ids = {group_id for group_id in group_ids if group_id}
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        pending |= group_ids
+        return
+    group_ids = sorted(group_ids)
+    for start in range(0, len(group_ids), CHUNK_SIZE):
+        write_groups(group_ids[start:start + CHUNK_SIZE])
+
+
+def rebuild_groups():
+    """
+    Recompute every InvoiceGroup from scratch, in one transaction.
+
+    Returns:
+        int: The number of groups.
+    """
+    with transaction.atomic():
+        InvoiceGroup.objects.all().delete()
+        group_ids = list(
+            Invoice.objects.exclude(group_id='').order_by('group_id').values_list('group_id', flat=True).distinct()
+        )
+        for start in range(0, len(group_ids), CHUNK_SIZE):
+            InvoiceGroup.objects.bulk_create(summarize(group_ids[start:start + CHUNK_SIZE]))
+    return len(group_ids)
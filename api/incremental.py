@@ -0,0 +1,158 @@
+"""
+Incremental duplicate detection for newly inserted invoices.
+
+A new invoice can only match an existing one if three of their four key
+fields (reference, date, value, vendor) are equal, so its candidates are
+looked up through the composite indexes on Invoice that cover each of those
+field triples. Matching a batch of new invoices therefore costs time
+proportional to the batch, not to the table.
+"""
+
+import copy
+import uuid
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from .matching import (
+    REFERENCE, DATE, VALUE, VENDOR, VENDOR_KEY, REFERENCE_KEY, DATE_DAY, VALUE_CENTS,
+    get_match_patterns, pattern_confidence, pattern_label,
+)
+from .models import Invoice
+
+
+def invoice_record(invoice):
+    """
+    Build the row compared by the matching rules from an Invoice, with its
+    precomputed search keys so the rules do not normalize it again.
+    """
+    return {
+        REFERENCE: invoice.reference,
+        DATE: invoice.date,
+        VALUE: invoice.value,
+        VENDOR: invoice.vendor,
+        VENDOR_KEY: invoice.vendor_key,
+        REFERENCE_KEY: invoice.reference_key,
+        DATE_DAY: invoice.date_day,
+        VALUE_CENTS: invoice.value_cents,
+    }
+
+
+def candidates(invoice):
+    """
+    Grouped invoices sharing three of the four key fields with the given one.
+    """
+    keys = [
+        Q(reference=invoice.reference, date=invoice.date, value=invoice.value),
+        Q(date=invoice.date, value=invoice.value, vendor=invoice.vendor),
+        Q(reference=invoice.reference, value=invoice.value, vendor=invoice.vendor),
+        Q(reference=invoice.reference, date=invoice.date, vendor=invoice.vendor),
+    ]
+    if invoice.date is None:
+        keys = [keys[2]]
+    query = keys[0]
+    for key in keys[1:]:
+        query |= key
+    return Invoice.objects.filter(query).exclude(pk=invoice.pk).exclude(group_id='').order_by('pk')
+
+
+def update_invoices(invoices, **fields):
+    """
+    Update a queryset of invoices without the bookkeeping of
+    InvoiceQuerySet.update: the caller refreshes the groups and reports the
+    change through invoices_changed.
+    """
+    return QuerySet.update(invoices, **fields)
+
+
+def assign_group(invoice, batch, retagged, group_ids):
+    """
+    Match one saved invoice against its candidates and write its group.
+
+    Candidates that were unique take the pattern of their new duplicate:
+    those of batch are updated in memory, the others are added to retagged
+    as (before, after) pairs. The groups touched are added to group_ids.
+    """
+    record = invoice_record(invoice)
+    patterns = set()
+    matched = []
+    for candidate in candidates(invoice):
+        found = get_match_patterns(record, invoice_record(candidate))
+        if found:
+            patterns.update(found)
+            matched.append(candidate)
+
+    pattern = pattern_label(patterns)
+    invoice.pattern = pattern
+    invoice.confidence = pattern_confidence(pattern)
+    if matched:
+        invoice.group_id = matched[0].group_id
+        other_groups = {candidate.group_id for candidate in matched} - {invoice.group_id}
+        if other_groups:
+            update_invoices(Invoice.objects.filter(group_id__in=other_groups), group_id=invoice.group_id)
+            group_ids.update(other_groups)
+            for member in batch.values():
+                if member.group_id in other_groups:
+                    member.group_id = invoice.group_id
+        # Invoices that were unique until now take the pattern of their new duplicate.
+        unique = [candidate for candidate in matched if candidate.pattern == 'unique']
+        if unique:
+            update_invoices(
+                Invoice.objects.filter(pk__in=[candidate.pk for candidate in unique], pattern='unique'),
+                pattern=invoice.pattern, confidence=invoice.confidence,
+            )
+        for candidate in unique:
+            member = batch.get(candidate.pk)
+            if member is None:
+                member = candidate
+                retagged.append((copy.copy(candidate), candidate))
+            member.group_id, member.pattern, member.confidence = invoice.group_id, invoice.pattern, invoice.confidence
+    else:
+        invoice.group_id = uuid.uuid4().hex
+
+    update_invoices(
+        Invoice.objects.filter(pk=invoice.pk),
+        group_id=invoice.group_id, pattern=invoice.pattern, confidence=invoice.confidence,
+    )
+    group_ids.add(invoice.group_id)
+
+
+def match_invoice(invoice):
+    """
+    Compare a saved invoice with its candidates and assign it a group.
+
+    The invoice joins the group of the oldest invoice it matches. If it
+    matches invoices of several groups, those groups are merged into that
+    one. An invoice without matches starts a new group.
+
+    Args:
+        invoice (Invoice): A saved invoice, usually without a group_id yet.
+
+    Returns:
+        Invoice: The same invoice, with group_id, pattern and confidence set.
+    """
+    return match_invoices([invoice])[0]
+
+
+def match_invoices(invoices):
+    """
+    Assign groups to a batch of saved invoices, in order, in one transaction.
+
+    Invoices of the batch are matched against each other as well: each one
+    sees the invoices of the batch that were matched before it.
+
+    The caller sends invoices_changed for the invoices of the batch, with
+    the patterns and groups set here. This function only sends it for the
+    other invoices whose pattern changed, as updated, so the facet index
+    moves them without a rebuild.
+    """
+    from .groups import refresh_groups
+    from .signals import invoices_changed
+    batch = {invoice.pk: invoice for invoice in invoices}
+    retagged = []
+    group_ids = set()
+    with transaction.atomic():
+        for invoice in invoices:
+            assign_group(invoice, batch, retagged, group_ids)
+        refresh_groups(group_ids)
+        if retagged:
+            invoices_changed.send(sender=Invoice, updated=retagged)
+    return invoices
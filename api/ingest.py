@@ -0,0 +1,66 @@
+"""
+Streaming bulk ingestion of invoices.
+
+Invoices are built lazily, collected in fixed-size batches and written with
+one bulk_create per batch, each batch in its own transaction. Memory stays
+bounded by the batch size and the database sees one round trip per batch
+instead of one per invoice.
+"""
+
+import time
+from itertools import islice
+from django.db import transaction
+from .models import Invoice
+
+
+def batched(iterable, size):
+    """
+    Yield lists of up to size items from iterable.
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class IngestReport:
+    """
+    Rows written and time spent by an ingestion run.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return f'{self.rows} invoices in {self.batches} batches, {self.elapsed:.2f}s ({self.rows_per_second:.0f} rows/sec)'
+
+
+def bulk_ingest(invoices, batch_size=1000, on_batch=None):
+    """
+    Write a stream of unsaved Invoice objects in batches.
+
+    Args:
+        invoices (iterable): Invoice instances, consumed lazily.
+        batch_size (int): Invoices per bulk_create and per transaction.
+        on_batch (function): Called with the report after each batch.
+
+    Returns:
+        IngestReport: The number of rows written and the throughput.
+    """
+    report = IngestReport()
+    for batch in batched(invoices, batch_size):
+        with transaction.atomic():
+            Invoice.objects.bulk_create(batch, batch_size=batch_size)
+        report.rows += len(batch)
+        report.batches += 1
+        report.elapsed = time.perf_counter() - report.started
+        if on_batch:
+            on_batch(report)
+    report.elapsed = time.perf_counter() - report.started
+    return report
@@ -0,0 +1,56 @@
+"""
+Dashboard KPIs, computed in one query and served from a cached snapshot.
+
+All the KPIs come from a single conditional-aggregation query over the
+invoices. The result is cached under the data version it was computed at,
+like the responses of api.cache: every write path bumps the version (see
+api.signals), in this process or any other, so the next request computes
+the KPIs again and polling dashboards only rescan the table after a change.
+Entries of older versions expire after the cache's timeout.
+"""
+
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from .models import Invoice
+from .versioning import current_data_version
+
+
+def kpi_key(version):
+    return f'api:kpis:v{version}'
+
+
+def compute_kpis():
+    """
+    Compute the KPIs with one aggregate query over the invoices.
+
+    Returns:
+        dict: The KPIs, as served by /api/kpis/.
+    """
+    # open__in rather than open=True, so SQLite can use the (open, ...) index.
+    is_open = Q(open__in=[True])
+    totals = Invoice.objects.aggregate(
+        invoice_count=Count('id'),
+        group_count=Count('group_id', distinct=True),
+        open_invoice_count=Count('id', filter=is_open),
+        open_group_count=Count('group_id', distinct=True, filter=is_open),
+        total_value=Sum('value'),
+        open_value=Sum('value', filter=is_open),
+    )
+    return {
+        'total_similar_invoices': totals['invoice_count'] - totals['group_count'],
+        'total_open_similar_invoices': totals['open_invoice_count'] - totals['open_group_count'],
+        'total_value_of_similar_invoices': totals['total_value'],
+        'total_value_of_open_similar_invoices': totals['open_value'],
+    }
+
+
+def get_kpis(request=None):
+    """
+    The KPI snapshot of the current data version, computed on first use.
+    """
+    key = kpi_key(current_data_version(request)[0])
+    kpis = cache.get(key)
+    if kpis is None:
+        kpis = compute_kpis()
+        cache.set(key, kpis)
+    return kpis
@@ -1,6 +1,7 @@
 import csv
 from django.core.management.base import BaseCommand
 from api.models import Invoice
+from api.ingest import bulk_ingest
 from django.utils.dateparse import parse_datetime
 from django.conf import settings
 import os
@@ -69,51 +70,84 @@ class Command(BaseCommand):
         else:
             return random.randint(0, 49)
         
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Invoices per bulk insert and transaction')
+
+    def iter_invoices(self, reader):
         """
-        Handle the command to add data to the database from the CSV file.
+        Build the invoices of each CSV row, and their generated duplicates, lazily.
         """
-        # Path to the CSV file
-        csv_file_path = os.path.join(settings.BASE_DIR, 'api', 'data', 'DummyData.csv')
-
-        # Read the CSV file
-        with open(csv_file_path, newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            counter = 0
+        counter = 0
 
-            for row in reader:
-                duplicate_n = random.randint(1, 5)
+        for row in reader:
+            duplicate_n = random.randint(1, 5)
+            invoice_ref = 'INV-' + str(counter)
+            date_str = row['Earliest Due Date']
+            if date_str == '':
+                date = datetime(2025, 1, 1) + timedelta(days=counter + random.randint(1, 100))
+            else:
+                try:
+                    date = datetime.strptime(date_str, '%m/%d/%Y')
+                except ValueError:
+                    raise ValueError(f"Invalid date format: {date_str} in row {counter}")
+            quantity = random.randint(1, 12)
+            value = Decimal(row['Group Value'])
+            unit_price = value / quantity
+            vendor = row['Vendor'].split(' - ', 1)[-1]
+            pattern = row['Group Pattern']
+            open_ = random.choice([True, False])
+            group_id = row['Group UUID']
+            confidence = row['Confidence'].strip()
+            region = random.choice(['North', 'South', 'East', 'West'])
+            description = row['Description']
+            payment_method = random.choice(['Credit Card', 'Bank Transfer', 'PayPal', 'Cash'])
+        
+            pay_date = date + timedelta(days=random.randint(15, 30)) if random.choice([True, False]) else None
+            special_instructions = row['Special Intructions']
+            accuracy = self.get_accuracy(confidence, pattern)
+        
+            if 'Open' in row['Group Contains']:
+                open_ = True
+            else:
+                open_ = False
+        
+            yield Invoice(
+                reference=invoice_ref,
+                date=date,
+                quantity=quantity,
+                unit_price=unit_price,
+                value=value,
+                vendor=vendor,
+                pattern=pattern,
+                open=open_,
+                group_id=group_id,
+                confidence=confidence,
+                region=region,
+                description=description,
+                payment_method=payment_method,
+                pay_date=pay_date,
+                special_instructions=special_instructions,
+                accuracy=accuracy
+            )
+        
+            counter += 1
+        
+            # Add duplicate data based on the pattern
+            for i in range(0, duplicate_n):
                 invoice_ref = 'INV-' + str(counter)
-                date_str = row['Earliest Due Date']
-                if date_str == '':
-                    date = datetime(2025, 1, 1) + timedelta(days=counter + random.randint(1, 100))
-                else:
-                    try:
-                        date = datetime.strptime(date_str, '%m/%d/%Y')
-                    except ValueError:
-                        raise ValueError(f"Invalid date format: {date_str} in row {counter}")
-                quantity = random.randint(1, 12)
-                value = Decimal(row['Group Value'])
-                unit_price = value / quantity
-                vendor = row['Vendor'].split(' - ', 1)[-1]
-                pattern = row['Group Pattern']
-                open_ = random.choice([True, False])
-                group_id = row['Group UUID']
-                confidence = row['Confidence'].strip()
-                region = random.choice(['North', 'South', 'East', 'West'])
-                description = row['Description']
-                payment_method = random.choice(['Credit Card', 'Bank Transfer', 'PayPal', 'Cash'])
-            
-                pay_date = date + timedelta(days=random.randint(15, 30)) if random.choice([True, False]) else None
-                special_instructions = row['Special Intructions']
-                accuracy = self.get_accuracy(confidence, pattern)
-            
-                if 'Open' in row['Group Contains']:
-                    open_ = True
-                else:
-                    open_ = False
-            
-                Invoice.objects.create(
+                if pattern == 'Similar Value':
+                    value = str(float(value) + random.randint(-30, 30))
+                elif pattern == 'Similar Vendor':
+                    vendor = self.similar_text(vendor)
+                elif pattern == 'Similar Date':
+                    date = date + timedelta(days=i)
+                elif pattern == 'Similar Reference':
+                    invoice_ref = self.similar_text(invoice_ref)
+                elif pattern == 'Similar Description':
+                    description = self.similar_text(description)
+                counter += 1
+        
+                yield Invoice(
                     reference=invoice_ref,
                     date=date,
                     quantity=quantity,
@@ -131,40 +165,18 @@ class Command(BaseCommand):
                     special_instructions=special_instructions,
                     accuracy=accuracy
                 )
-            
-                counter += 1
-            
-                # Add duplicate data based on the pattern
-                for i in range(0, duplicate_n):
-                    invoice_ref = 'INV-' + str(counter)
-                    if pattern == 'Similar Value':
-                        value = str(float(value) + random.randint(-30, 30))
-                    elif pattern == 'Similar Vendor':
-                        vendor = self.similar_text(vendor)
-                    elif pattern == 'Similar Date':
-                        date = date + timedelta(days=i)
-                    elif pattern == 'Similar Reference':
-                        invoice_ref = self.similar_text(invoice_ref)
-                    elif pattern == 'Similar Description':
-                        description = self.similar_text(description)
-                    counter += 1
-            
-                    Invoice.objects.create(
-                        reference=invoice_ref,
-                        date=date,
-                        quantity=quantity,
-                        unit_price=unit_price,
-                        value=value,
-                        vendor=vendor,
-                        pattern=pattern,
-                        open=open_,
-                        group_id=group_id,
-                        confidence=confidence,
-                        region=region,
-                        description=description,
-                        payment_method=payment_method,
-                        pay_date=pay_date,
-                        special_instructions=special_instructions,
-                        accuracy=accuracy
-                    )
+
+    def handle(self, *args, **options):
+        """
+        Handle the command to add data to the database from the CSV file.
+        """
+        # Path to the CSV file
+        csv_file_path = os.path.join(settings.BASE_DIR, 'api', 'data', 'DummyData.csv')
+
+        # Read the CSV file lazily and write the invoices in batches
+        with open(csv_file_path, newline='') as csvfile:
+            reader = csv.DictReader(csvfile)
+            report = bulk_ingest(self.iter_invoices(reader), batch_size=options['batch_size'])
+
+        self.stdout.write(f'Inserted {report}')
         self.stdout.write(self.style.SUCCESS('Data added successfully'))
\ No newline at end of file
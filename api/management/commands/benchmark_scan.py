@@ -0,0 +1,95 @@
+import random
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand
+from api.matching import REFERENCE, DATE, VALUE, VENDOR, get_match_patterns, scan_patterns
+
+
+class Command(BaseCommand):
+    """
+    Django management command to compare the blocked duplicate-pattern scan with the pairwise loop.
+    """
+    help = 'Benchmark the blocked duplicate-pattern scan against the pairwise loop on synthetic invoices'
+
+    vendors = [
+        'Acme Corp', 'Global Industries', 'Star Solutions', 'NovaTech', 'FutureVision',
+        'DataFlow LLC', 'Infinity Supplies', 'AeroTech', 'BrightWorks', 'Orion Group',
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[250, 500, 1000, 2000, 4000, 8000])
+        parser.add_argument('--pairwise-limit', type=int, default=1000,
+                            help='Largest size the pairwise loop is run on')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes for the blocked scan')
+
+    def make_records(self, n, rng):
+        """
+        Build n synthetic invoices, about a tenth of them duplicates of an earlier one.
+        """
+        records = []
+        while len(records) < n:
+            if records and rng.random() < 0.1:
+                row = dict(rng.choice(records))
+                case = rng.randrange(6)
+                if case == 1:
+                    row[VENDOR] = row[VENDOR].replace('o', '0', 1)
+                elif case == 2:
+                    row[REFERENCE] = row[REFERENCE] + 'A'
+                elif case == 3:
+                    day = date.fromisoformat(row[DATE]) + timedelta(days=rng.randint(1, 7))
+                    row[DATE] = day.isoformat()
+                elif case == 4:
+                    row[VALUE] = round(row[VALUE] + rng.randint(1, 100), 2)
+                elif case == 5:
+                    digits = list(f'{row[VALUE]:.2f}'.replace('.', ''))
+                    k = rng.randrange(len(digits) - 1)
+                    digits[k], digits[k + 1] = digits[k + 1], digits[k]
+                    row[VALUE] = int(''.join(digits)) / 100
+            else:
+                day = date(2023, 1, 1) + timedelta(days=rng.randrange(365))
+                row = {
+                    REFERENCE: f'INV-{len(records):07d}',
+                    DATE: day.isoformat(),
+                    VALUE: round(rng.uniform(10, 10000), 2),
+                    VENDOR: rng.choice(self.vendors),
+                }
+            records.append(row)
+        return records
+
+    def scan_pairwise(self, records):
+        """
+        The original scan: compare every record with every other record.
+        """
+        found = []
+        for i in range(len(records)):
+            patterns_found = set()
+            for j in range(len(records)):
+                if i == j:
+                    continue
+                patterns_found.update(get_match_patterns(records[i], records[j]))
+            found.append(patterns_found)
+        return found
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        self.stdout.write(f"{'rows':>8} {'pairwise (s)':>14} {'blocked (s)':>12} {'speedup':>9}")
+
+        for n in options['sizes']:
+            records = self.make_records(n, rng)
+
+            start_time = time.perf_counter()
+            blocked = scan_patterns(records, workers=options['workers'])
+            blocked_time = time.perf_counter() - start_time
+
+            if n <= options['pairwise_limit']:
+                start_time = time.perf_counter()
+                pairwise = self.scan_pairwise(records)
+                pairwise_time = time.perf_counter() - start_time
+                if pairwise != blocked:
+                    raise AssertionError(f'Blocked scan differs from the pairwise scan for {n} rows')
+                self.stdout.write(f'{n:>8} {pairwise_time:>14.3f} {blocked_time:>12.3f} {pairwise_time / blocked_time:>8.1f}x')
+            else:
+                self.stdout.write(f"{n:>8} {'-':>14} {blocked_time:>12.3f} {'-':>9}")
+
+        self.stdout.write(self.style.SUCCESS('Benchmark finished'))
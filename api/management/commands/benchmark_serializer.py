@@ -0,0 +1,51 @@
+import time
+from itertools import islice, cycle
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from api.models import Invoice
+from api.serializers import InvoiceSerializer, invoice_rows
+
+
+class Command(BaseCommand):
+    """
+    Django management command to compare the values_list() fast path of the
+    invoice serializer with InvoiceSerializer.
+    """
+    help = 'Benchmark the fast invoice serialization path against the DRF serializer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 1000, 5000],
+                            help='Rows per page; the invoices of the database are repeated to fill larger pages')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per size, the best one is reported')
+
+    def best_time(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start_time
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        largest = max(options['sizes'])
+        instances = list(Invoice.objects.order_by('id')[:largest])
+        rows = list(invoice_rows.queryset(Invoice.objects.order_by('id'))[:largest])
+        if not instances:
+            raise CommandError('No invoices in the database, load some with add_data or add_dummy_data')
+
+        self.stdout.write(f"{'rows':>8} {'serializer (ms)':>16} {'fast path (ms)':>15} {'speedup':>9}")
+        for n in options['sizes']:
+            page_instances = list(islice(cycle(instances), n))
+            page_rows = list(islice(cycle(rows), n))
+            drf_time, drf_json = self.best_time(
+                lambda: renderer.render(InvoiceSerializer(page_instances, many=True).data), options['repeat']
+            )
+            fast_time, fast_json = self.best_time(
+                lambda: renderer.render(invoice_rows.to_representation(page_rows)), options['repeat']
+            )
+            if fast_json != drf_json:
+                raise AssertionError(f'The fast path renders different JSON for {n} rows')
+            self.stdout.write(f'{n:>8} {drf_time * 1000:>16.2f} {fast_time * 1000:>15.2f} {drf_time / fast_time:>8.1f}x')
+        self.stdout.write(self.style.SUCCESS('Benchmark finished'))
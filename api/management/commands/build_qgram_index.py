@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.qgram import INDEXED_FIELDS, build_invoice_index, index_path
+
+
+class Command(BaseCommand):
+    """
+    Django management command to build the q-gram indexes of the invoice vendors and references.
+    """
+    help = 'Build and save the q-gram indexes used for fuzzy vendor and reference lookups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('fields', nargs='*', help=f"Fields to index (default: {', '.join(INDEXED_FIELDS)})")
+
+    def handle(self, *args, **options):
+        fields = options['fields'] or INDEXED_FIELDS
+        for field in fields:
+            if field not in INDEXED_FIELDS:
+                raise CommandError(f"Unknown field '{field}', choose from {', '.join(INDEXED_FIELDS)}")
+            index = build_invoice_index(field)
+            path = index_path(field)
+            index.save(path)
+            self.stdout.write(f'{field}: {len(index)} distinct values -> {path}')
+        self.stdout.write(self.style.SUCCESS('Indexes built successfully'))
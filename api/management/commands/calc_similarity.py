@@ -5,6 +5,8 @@ import time
 import csv
 import os
 from django.conf import settings
+from api.similarity import InvoiceSearch, invoice_from_row, normalize, stringify
+from api.snapshot import output_data_rows, snapshot_frame
 
 class Command(BaseCommand):
 
@@ -41,8 +43,13 @@ class Command(BaseCommand):
             "special_instructions": ""
             }
      
+    search = None
+    data_path = None
+    workers = 1
+    shortlist = False
+
     def normalize(self, s):
-        return s.replace(' ', '').replace('-', '').replace('/', '').replace('.', '').lower()
+        return normalize(s)
 
     # Calculates the Damerau Levenshtein distance between two strings. Useful for common typos in long strings.
     def dl_distance(self, s1, s2):
@@ -74,7 +81,7 @@ class Command(BaseCommand):
         print(self.jaccard_similarity(s1, s2), 'Jaccard similarity took ', time.time()-start_time, ' seconds')
     
     def stringify(self, dict):
-        return ' '.join([self.normalize(str(dict[key])) for key in dict])
+        return stringify(dict)
     
     def similarity(self, similarity):
 
@@ -121,10 +128,14 @@ class Command(BaseCommand):
         print(patterns)
 
     
+    def get_data_path(self):
+        return self.data_path or os.path.join(settings.BASE_DIR, 'api', 'data', 'OutputData.csv')
+
     def get_data(self):
                 # Path to the input CSV file
-        input_csv_file_path = os.path.join(settings.BASE_DIR, 'api', 'data', 'OutputData.csv')
-        
+        input_csv_file_path = self.get_data_path()
+        if input_csv_file_path.endswith('.npz'):
+            return output_data_rows(snapshot_frame(input_csv_file_path))
        
 
         # Read data from the input CSV file
@@ -134,38 +145,64 @@ class Command(BaseCommand):
         return data
     
     def get_invoice(self, row):
-        return {
-            "reference": row['reference'],
-            "date": row['Date'],
-            "value": row['value'],
-            "vendor": row['Vendor'],
-            "region": row['Region'],
-            "description": row['Description'],
-            "payment_method": row['Payment Method'],
-            "special_instructions": row['Special Intructions']
-        }
+        return invoice_from_row(row)
     
+    def get_search(self):
+        """
+        Build the search corpus from OutputData.csv once and reuse it for every query.
+        """
+        if self.search is None:
+            self.search = InvoiceSearch(self.get_data())
+        return self.search
+
     def find_most_similar(self, invoice):
-        data = self.get_data()
-        similarities = []
-        for row in data:
-            invoice1 = self.get_invoice(row)
-            str1 = self.stringify(invoice)
-            str2 = self.stringify(invoice1)
-            similarity = self.indel_distance(str1, str2)
-            similarities.append((similarity, row))
-        similarities.sort(key=lambda x: x[0], reverse=True)
-        return similarities[0]
+        """
+        The (similarity, row) of the most similar invoice, or None if the corpus is empty.
+
+        When the shortlist has no candidates, the whole corpus is searched.
+        """
+        if self.workers != 1 or self.shortlist:
+            matches = self.get_search().top_k([invoice], k=1, workers=self.workers, shortlist=self.shortlist)[0]
+            if matches:
+                return matches[0]
+        return self.get_search().best(invoice)
+
+    def find_top_k(self, invoices, k=5, score_cutoff=0):
+        """
+        Find the k most similar invoices in OutputData.csv for each of the given invoices.
+        """
+        return self.get_search().top_k(invoices, k=k, score_cutoff=score_cutoff, workers=self.workers, shortlist=self.shortlist)
 
     def find_most_similar_data(self, invoice):
-        most_similar = self.get_invoice(self.find_most_similar(invoice)[1])
+        match = self.find_most_similar(invoice)
+        if match is None:
+            print('No similar invoice found for', invoice['reference'])
+            return
+        most_similar = self.get_invoice(match[1])
         print('Most similar invoice: ', most_similar['reference'])
         self.test_invoices(invoice, most_similar)
 
     
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--input', help='Corpus: a CSV file like OutputData.csv (the default) or an invoice snapshot (.npz) written by export_snapshot')
+        parser.add_argument('--top', type=int, default=0, help='Also list the top N matches of each sample invoice')
+        parser.add_argument('--score-cutoff', type=float, default=0, help='Minimum similarity (0 to 1) of the listed matches')
+        parser.add_argument('--workers', type=int, default=1, help='Cores used to score the corpus (-1 for all)')
+        parser.add_argument('--shortlist', action='store_true', help='Only score invoices whose vendor or reference shares trigrams with the query')
+
+    def handle(self, *args, **options):
         """
         Handle the command to calculate the similarity between two invoices.
         """
+        self.data_path = options['input']
+        self.workers = options['workers']
+        self.shortlist = options['shortlist']
         self.find_most_similar_data(self.invoice3)
 
+        if options['top']:
+            invoices = [self.invoice1, self.invoice2, self.invoice3]
+            for invoice, matches in zip(invoices, self.find_top_k(invoices, options['top'], options['score_cutoff'])):
+                print('Top matches for', invoice['reference'])
+                for similarity, row in matches:
+                    print('   ', row['reference'], round(similarity, 4), self.similarity(similarity))
+
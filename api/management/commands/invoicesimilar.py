@@ -1,148 +1,73 @@
+import os
 import pandas as pd
-from rapidfuzz import fuzz
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.clustering import cluster
+from api.matching import REFERENCE, iter_matches, tag_patterns, describe_patterns, VENDOR_KEY, REFERENCE_KEY, DATE_DAY, VALUE_CENTS
+from api.snapshot import matching_frame, snapshot_frame
 
 
-
-df = pd.read_csv('Invoicesduplicates.csv')
-
-def exact_match(row_a, row_b):
-    """Coinciden exactamente los cuatro campos."""
-    return (
-        row_a['Invoice Reference'] == row_b['Invoice Reference'] and
-        row_a['Document Date']    == row_b['Document Date']    and
-        row_a['Invoice Value']    == row_b['Invoice Value']    and
-        row_a['Vendor Name']      == row_b['Vendor Name']
-    )
-
-def similar_vendor(row_a, row_b, threshold=90):
-    """
-    - 3 campos exactos: (Invoice Reference, Document Date, Invoice Value)
-    - Vendor Name fuzzy con un mínimo de similitud (threshold).
-    - Se ilustran algunas limpiezas mínimas (quitar caracteres no alfanuméricos).
-    """
-    if (
-        row_a['Invoice Reference'] == row_b['Invoice Reference'] and
-        row_a['Document Date']    == row_b['Document Date']    and
-        row_a['Invoice Value']    == row_b['Invoice Value']
-    ):
-        def clean_vendor(name):
-            # Quita todo lo que no sea alfanumérico
-            cleaned = ''.join(ch for ch in name if ch.isalnum())
-            return cleaned.upper()
-
-        vend_a = clean_vendor(row_a['Vendor Name'])
-        vend_b = clean_vendor(row_b['Vendor Name'])
-        ratio = fuzz.token_sort_ratio(vend_a, vend_b)
-        return ratio >= threshold
-    return False
-
-def similar_reference(row_a, row_b, threshold=85):
-    """
-    - 3 campos exactos: (Document Date, Invoice Value, Vendor Name)
-    - Invoice Reference fuzzy.
-    - Se usa una métrica simple de similitud (rapidfuzz).
-    """
-    if (
-        row_a['Document Date'] == row_b['Document Date'] and
-        row_a['Invoice Value'] == row_b['Invoice Value'] and
-        row_a['Vendor Name']   == row_b['Vendor Name']
-    ):
-        ref_a = ''.join(ch for ch in row_a['Invoice Reference'] if ch.isalnum())
-        ref_b = ''.join(ch for ch in row_b['Invoice Reference'] if ch.isalnum())
-        ratio = fuzz.token_sort_ratio(ref_a, ref_b)
-        return ratio >= threshold
-    return False
-
-def similar_date(row_a, row_b, max_days=7):
-    """
-    - 3 columnas exactas: (Invoice Reference, Invoice Value, Vendor Name)
-    - Document Date difiere a lo sumo X días (por defecto, 7 días).
-    - Se podría extender para día/mes invertido, etc.
-    """
-    if (
-        row_a['Invoice Reference'] == row_b['Invoice Reference'] and
-        row_a['Invoice Value']    == row_b['Invoice Value'] and
-        row_a['Vendor Name']      == row_b['Vendor Name']
-    ):
-        try:
-            d_a = pd.to_datetime(row_a['Document Date'])
-            d_b = pd.to_datetime(row_b['Document Date'])
-        except:
-            return False
-        
-        diff = abs((d_a - d_b).days)
-        return diff <= max_days
-    return False
-
-def similar_value(row_a, row_b, tolerance=100):
-    """
-    - 3 columnas exactas: (Invoice Reference, Document Date, Vendor Name)
-    - Invoice Value 'cerca' en el valor (<= tolerance).
-    - O se pueden agregar más reglas (transposición de dígitos, etc.).
-    """
-    if (
-        row_a['Invoice Reference'] == row_b['Invoice Reference'] and
-        row_a['Document Date']    == row_b['Document Date'] and
-        row_a['Vendor Name']      == row_b['Vendor Name']
-    ):
-        try:
-            v_a = float(row_a['Invoice Value'])
-            v_b = float(row_b['Invoice Value'])
-            if abs(v_a - v_b) <= tolerance:
-                return True
-        except:
-            pass
-    return False
-
-def get_match_patterns(row_a, row_b):
+class Command(BaseCommand):
     """
-    Devuelve una lista con TODOS los patrones que se cumplan
-    (podría devolver más de uno a la vez si, p.ej., exact match y similar date
-     se cumplen simultáneamente).
+    Django management command to tag each invoice of a CSV file with the duplicate patterns it shares with other invoices and its duplicate group.
     """
-    patterns = []
-    if exact_match(row_a, row_b):
-        patterns.append("exact match")
-    if similar_vendor(row_a, row_b):
-        patterns.append("similar vendor")
-    if similar_reference(row_a, row_b):
-        patterns.append("similar reference")
-    if similar_date(row_a, row_b):
-        patterns.append("similar date")
-    if similar_value(row_a, row_b):
-        patterns.append("similar value")
-    return patterns
-
-
-
-df["DuplicatePattern"] = ""
-
-records = df.to_dict('records')
-
-for i in range(len(records)):
-    row_a = records[i]
-   
-    patterns_found = set()
-    
-    for j in range(len(records)):
-        if i == j:
-            continue
-        
-        row_b = records[j]
-        # Obtenemos todos los patrones que se cumplan
-        patterns = get_match_patterns(row_a, row_b)
-        for p in patterns:
-            patterns_found.add(p)
-    
-    # Si no encontró ningún patrón, asigna "unique"
-    if len(patterns_found) == 0:
-        df.loc[i, "DuplicatePattern"] = "unique"
-    else:
-        # Unimos todos los patrones encontrados en un solo string
-        # Ordenamos alfabéticamente solo para consistencia.
-        df.loc[i, "DuplicatePattern"] = ", ".join(sorted(patterns_found))
-
-
-df.to_excel("datos_invoices_con_patrones.xlsx", index=False)
-
-print("Archivo 'datos_invoices_con_patrones.csv' generado con columna 'DuplicatePattern'.")
+    help = 'Add a DuplicatePattern column to an invoices CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--input',
+            default=os.path.join(settings.BASE_DIR, 'api', 'data', 'Invoicesduplicates.csv'),
+            help='CSV file with Invoice Reference, Document Date, Invoice Value and Vendor Name columns, '
+                 'or an invoice snapshot (.npz) written by export_snapshot',
+        )
+        parser.add_argument(
+            '--output',
+            default='datos_invoices_con_patrones.xlsx',
+            help='Output file (.xlsx or .csv)',
+        )
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker processes for the fuzzy rules')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Candidate pairs per worker task')
+        parser.add_argument('--max-days', type=int, default=7, help='Days two dates can differ by in the similar date rule')
+        parser.add_argument('--tolerance', type=float, default=100, help='Amount two values can differ by in the similar value rule')
+
+    def read_invoices(self, path):
+        """
+        Read the invoices file, accepting the 'Invoice' header used by Invoicesduplicates.csv.
+
+        Snapshots also carry the search keys of the invoices, so the rules do
+        not normalize them again.
+        """
+        if path.endswith('.npz'):
+            return matching_frame(snapshot_frame(path))
+        df = pd.read_csv(path, encoding='utf-8-sig')
+        return df.rename(columns={'Invoice': REFERENCE})
+
+    def handle(self, *args, **options):
+        """
+        Handle the command to tag the invoices with their duplicate patterns.
+        """
+        df = self.read_invoices(options['input'])
+        records = df.to_dict('records')
+
+        engine_options = {
+            'workers': options['workers'],
+            'chunk_size': options['chunk_size'],
+            'max_days': options['max_days'],
+            'tolerance': options['tolerance'],
+        }
+        # One run of the engine gives both the patterns of each invoice and the groups.
+        found = [set() for _ in records]
+        group_ids, groups = cluster(len(records), tag_patterns(records, iter_matches(records, **engine_options), found))
+        df["DuplicatePattern"] = [describe_patterns(patterns) for patterns in found]
+        df["GroupId"] = group_ids
+        df["GroupPattern"] = [groups[group_id]['pattern'] for group_id in group_ids]
+        df["GroupConfidence"] = [groups[group_id]['confidence'] for group_id in group_ids]
+        df = df.drop(columns=[VENDOR_KEY, REFERENCE_KEY, DATE_DAY, VALUE_CENTS], errors='ignore')
+
+        output = options['output']
+        if output.endswith('.csv'):
+            df.to_csv(output, index=False)
+        else:
+            df.to_excel(output, index=False)
+
+        self.stdout.write(self.style.SUCCESS(f"Archivo '{output}' generado con columna 'DuplicatePattern'."))
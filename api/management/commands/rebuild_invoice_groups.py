@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from api.groups import rebuild_groups
+
+
+class Command(BaseCommand):
+    """
+    Django management command to recompute the InvoiceGroup summaries from the invoices.
+    """
+    help = 'Rebuild the summary table of the groups of similar invoices from scratch'
+
+    def handle(self, *args, **options):
+        count = rebuild_groups()
+        self.stdout.write(self.style.SUCCESS(f'{count} groups rebuilt successfully'))
@@ -0,0 +1,549 @@
+"""
+Duplicate pattern rules and the blocking engine that applies them.
+
+Every fuzzy rule needs three of the four invoice fields to match exactly, so
+those three fields work as a blocking key: two invoices can only match a rule
+if they fall in the same block of that rule's key. Instead of comparing every
+invoice with every other invoice, the engine hashes the invoices on each key
+and only runs the fuzzy check inside each block.
+"""
+
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from rapidfuzz import fuzz
+
+REFERENCE = 'Invoice Reference'
+DATE = 'Document Date'
+VALUE = 'Invoice Value'
+VENDOR = 'Vendor Name'
+FIELDS = (REFERENCE, DATE, VALUE, VENDOR)
+
+
+# Shadow columns with the normalized form of each field, as stored on
+# api.models.Invoice. Rows may carry them to skip the normalization.
+VENDOR_KEY = 'vendor_key'
+REFERENCE_KEY = 'reference_key'
+DATE_DAY = 'date_day'
+VALUE_CENTS = 'value_cents'
+
+EPOCH = pd.Timestamp(0, tz='UTC')
+
+
+def vendor_key(name):
+    # Quita todo lo que no sea alfanumérico
+    return ''.join(ch for ch in name if ch.isalnum()).upper()
+
+def reference_key(reference):
+    return ''.join(ch for ch in reference if ch.isalnum())
+
+def day_number(date):
+    """Días desde 1970-01-01 (UTC), o None si la fecha falta o no es válida."""
+    day = pd.to_datetime(date, errors='coerce', utc=True)
+    if pd.isna(day):
+        return None
+    return (day.normalize() - EPOCH).days
+
+def to_cents(value):
+    return int(round(float(value) * 100))
+
+def search_key(row, column, field, normalize):
+    """El valor normalizado de un campo: el de la columna precalculada si la fila la trae."""
+    value = row.get(column)
+    return normalize(row[field]) if value is None else value
+
+
+def exact_match(row_a, row_b):
+    """Coinciden exactamente los cuatro campos."""
+    return (
+        row_a['Invoice Reference'] == row_b['Invoice Reference'] and
+        row_a['Document Date']    == row_b['Document Date']    and
+        row_a['Invoice Value']    == row_b['Invoice Value']    and
+        row_a['Vendor Name']      == row_b['Vendor Name']
+    )
+
+def similar_vendor(row_a, row_b, threshold=90):
+    """
+    - 3 campos exactos: (Invoice Reference, Document Date, Invoice Value)
+    - Vendor Name fuzzy con un mínimo de similitud (threshold).
+    - Se ilustran algunas limpiezas mínimas (quitar caracteres no alfanuméricos).
+    """
+    if (
+        row_a['Invoice Reference'] == row_b['Invoice Reference'] and
+        row_a['Document Date']    == row_b['Document Date']    and
+        row_a['Invoice Value']    == row_b['Invoice Value']
+    ):
+        vend_a = search_key(row_a, VENDOR_KEY, 'Vendor Name', vendor_key)
+        vend_b = search_key(row_b, VENDOR_KEY, 'Vendor Name', vendor_key)
+        ratio = fuzz.token_sort_ratio(vend_a, vend_b)
+        return ratio >= threshold
+    return False
+
+def similar_reference(row_a, row_b, threshold=85):
+    """
+    - 3 campos exactos: (Document Date, Invoice Value, Vendor Name)
+    - Invoice Reference fuzzy.
+    - Se usa una métrica simple de similitud (rapidfuzz).
+    """
+    if (
+        row_a['Document Date'] == row_b['Document Date'] and
+        row_a['Invoice Value'] == row_b['Invoice Value'] and
+        row_a['Vendor Name']   == row_b['Vendor Name']
+    ):
+        ref_a = search_key(row_a, REFERENCE_KEY, 'Invoice Reference', reference_key)
+        ref_b = search_key(row_b, REFERENCE_KEY, 'Invoice Reference', reference_key)
+        ratio = fuzz.token_sort_ratio(ref_a, ref_b)
+        return ratio >= threshold
+    return False
+
+def similar_date(row_a, row_b, max_days=7):
+    """
+    - 3 columnas exactas: (Invoice Reference, Invoice Value, Vendor Name)
+    - Document Date difiere a lo sumo X días (por defecto, 7 días).
+    - Se podría extender para día/mes invertido, etc.
+    """
+    if (
+        row_a['Invoice Reference'] == row_b['Invoice Reference'] and
+        row_a['Invoice Value']    == row_b['Invoice Value'] and
+        row_a['Vendor Name']      == row_b['Vendor Name']
+    ):
+        d_a = search_key(row_a, DATE_DAY, 'Document Date', day_number)
+        d_b = search_key(row_b, DATE_DAY, 'Document Date', day_number)
+        if d_a is None or d_b is None:
+            return False
+
+        diff = abs(d_a - d_b)
+        return diff <= max_days
+    return False
+
+def digit_key(cents):
+    """Clave canónica de un importe: sus dígitos ordenados."""
+    return ''.join(sorted(str(abs(cents))))
+
+def is_transposition(cents_a, cents_b):
+    """Los importes tienen los mismos dígitos con exactamente dos dígitos contiguos intercambiados."""
+    digits_a, digits_b = str(abs(cents_a)), str(abs(cents_b))
+    if len(digits_a) != len(digits_b):
+        return False
+    diff = [k for k in range(len(digits_a)) if digits_a[k] != digits_b[k]]
+    return (
+        len(diff) == 2 and
+        diff[1] == diff[0] + 1 and
+        digits_a[diff[0]] == digits_b[diff[1]] and
+        digits_a[diff[1]] == digits_b[diff[0]]
+    )
+
+def similar_value(row_a, row_b, tolerance=100):
+    """
+    - 3 columnas exactas: (Invoice Reference, Document Date, Vendor Name)
+    - Invoice Value 'cerca' en el valor (<= tolerance).
+    - O con dos dígitos contiguos transpuestos (p.ej. 2023.00 y 2203.00).
+    """
+    if (
+        row_a['Invoice Reference'] == row_b['Invoice Reference'] and
+        row_a['Document Date']    == row_b['Document Date'] and
+        row_a['Vendor Name']      == row_b['Vendor Name']
+    ):
+        try:
+            c_a = search_key(row_a, VALUE_CENTS, 'Invoice Value', to_cents)
+            c_b = search_key(row_b, VALUE_CENTS, 'Invoice Value', to_cents)
+            if abs(c_a - c_b) <= tolerance * 100:
+                return True
+            return is_transposition(c_a, c_b)
+        except:
+            pass
+    return False
+
+def get_match_patterns(row_a, row_b):
+    """
+    Devuelve una lista con TODOS los patrones que se cumplan
+    (podría devolver más de uno a la vez si, p.ej., exact match y similar date
+     se cumplen simultáneamente).
+    """
+    patterns = []
+    if exact_match(row_a, row_b):
+        patterns.append("exact match")
+    if similar_vendor(row_a, row_b):
+        patterns.append("similar vendor")
+    if similar_reference(row_a, row_b):
+        patterns.append("similar reference")
+    if similar_date(row_a, row_b):
+        patterns.append("similar date")
+    if similar_value(row_a, row_b):
+        patterns.append("similar value")
+    return patterns
+
+
+# Pattern names used by the matching rules and their Invoice.pattern label.
+PATTERN_LABELS = {
+    'exact match': 'Exact Match',
+    'similar vendor': 'Similar Vendor',
+    'similar reference': 'Similar Reference',
+    'similar date': 'Similar Date',
+    'similar value': 'Similar Value',
+}
+
+# Confidence given to an Invoice.pattern label; single fuzzy patterns are 'Medium'.
+CONFIDENCE = {
+    'Exact Match': 'High',
+    'Multiple': 'High',
+    'unique': 'Low',
+}
+
+
+def pattern_label(patterns):
+    """
+    Turn the rule names matched by an invoice into an Invoice.pattern value.
+    """
+    if not patterns:
+        return 'unique'
+    if 'exact match' in patterns:
+        return 'Exact Match'
+    labels = {PATTERN_LABELS[pattern] for pattern in patterns}
+    if len(labels) > 1:
+        return 'Multiple'
+    return labels.pop()
+
+
+def pattern_confidence(label):
+    return CONFIDENCE.get(label, 'Medium')
+
+
+# Fuzzy rules and the three fields each of them requires to match exactly.
+RULES = (
+    ('similar vendor', (REFERENCE, DATE, VALUE), similar_vendor),
+    ('similar reference', (DATE, VALUE, VENDOR), similar_reference),
+    ('similar date', (REFERENCE, VALUE, VENDOR), similar_date),
+    ('similar value', (REFERENCE, DATE, VENDOR), similar_value),
+)
+
+
+def build_block_index(records, fields):
+    """
+    Hash the records on the given fields.
+
+    Args:
+        records (list): Invoice rows as dicts.
+        fields (tuple): The fields that make up the blocking key.
+
+    Returns:
+        dict: Blocking key -> list of record positions, only for blocks with
+        at least two records. Rows with a missing key field are left out,
+        since a missing value never compares equal in the rules.
+    """
+    index = defaultdict(list)
+    for i, row in enumerate(records):
+        key = tuple(row[field] for field in fields)
+        if any(pd.isna(value) for value in key):
+            continue
+        index[key].append(i)
+    return {key: block for key, block in index.items() if len(block) > 1}
+
+
+def chunk_blocks(blocks, chunk_size):
+    """
+    Split blocks into chunks of about chunk_size candidate pairs each.
+
+    Blocks are never split, so a chunk may hold more pairs than chunk_size if
+    a single block does.
+    """
+    chunk, pairs = [], 0
+    for block in blocks:
+        chunk.append(block)
+        pairs += len(block) * (len(block) - 1) // 2
+        if pairs >= chunk_size:
+            yield chunk
+            chunk, pairs = [], 0
+    if chunk:
+        yield chunk
+
+
+MISSING = np.iinfo(np.int64).min
+
+
+def day_numbers(records, field=DATE):
+    """
+    Parse a date field of every record once, into days since 1970-01-01.
+
+    Returns:
+        numpy.ndarray: int64 day numbers, MISSING where the date is missing
+        or cannot be parsed.
+    """
+    dates = pd.to_datetime(
+        pd.Series([row[field] for row in records], dtype=object),
+        errors='coerce', format='mixed', utc=True,
+    )
+    days = dates.dt.tz_localize(None).to_numpy().astype('datetime64[D]').astype(np.int64)
+    days[dates.isna().to_numpy()] = MISSING
+    return days
+
+
+def value_cents(records, field=VALUE):
+    """
+    Parse a value field of every record once, into an amount in cents.
+
+    Returns:
+        numpy.ndarray: int64 amounts, MISSING where the value is missing or
+        not a number.
+    """
+    values = pd.to_numeric(pd.Series([row[field] for row in records], dtype=object), errors='coerce')
+    values = values.astype(float).to_numpy()
+    missing = ~np.isfinite(values)
+    cents = np.round(np.where(missing, 0, values) * 100).astype(np.int64)
+    cents[missing] = MISSING
+    return cents
+
+
+class Corpus:
+    """
+    The records of a matching run, plus the columns parsed once for all of them.
+
+    Attributes:
+        records (list): Invoice rows as dicts.
+        days (numpy.ndarray): Day number of each record's Document Date.
+        cents (numpy.ndarray): Each record's Invoice Value, in cents.
+        max_days (int): Tolerance of the similar date rule, in days.
+        tolerance (float): Tolerance of the similar value rule.
+    """
+
+    def __init__(self, records, max_days=7, tolerance=100):
+        self.records = records
+        self.max_days = max_days
+        self.tolerance = tolerance
+        self.days = day_numbers(records)
+        self.cents = value_cents(records)
+
+
+def match_pairwise(corpus, rule, blocks, flag_only=False):
+    """
+    Run a fuzzy rule on every candidate pair inside the given blocks.
+
+    Args:
+        corpus (Corpus): The records being matched.
+        rule (function): One of the rule functions.
+        blocks (list): Lists of record positions sharing the rule's key.
+        flag_only (bool): Skip pairs whose two records already matched, for
+            callers that only need to know which records match.
+
+    Returns:
+        list: The matching (i, j) pairs, in block order.
+    """
+    records = corpus.records
+    matches = []
+    flagged = set()
+    for block in blocks:
+        for i, j in combinations(block, 2):
+            if flag_only and i in flagged and j in flagged:
+                continue
+            if rule(records[i], records[j]):
+                matches.append((i, j))
+                flagged.add(i)
+                flagged.add(j)
+    return matches
+
+
+def match_window(column, tolerance, blocks, flag_only=False):
+    """
+    Pair the records of each block whose column values are at most tolerance apart.
+
+    Each block is sorted on the column and every record is paired with the
+    following ones up to tolerance above it, found by binary search. With
+    flag_only, only neighbours in the sorted order are paired, which is
+    enough to flag every record that has a match.
+    """
+    matches = []
+    for block in blocks:
+        positions = np.asarray(block)
+        values = column[positions]
+        present = values != MISSING
+        positions, values = positions[present], values[present]
+        order = np.argsort(values, kind='stable')
+        positions, values = positions[order].tolist(), values[order]
+
+        if flag_only:
+            for a in np.flatnonzero(np.diff(values) <= tolerance).tolist():
+                i, j = positions[a], positions[a + 1]
+                matches.append((min(i, j), max(i, j)))
+            continue
+
+        ends = np.searchsorted(values, values + tolerance, side='right').tolist()
+        for a, end in enumerate(ends):
+            i = positions[a]
+            for j in positions[a + 1:end]:
+                matches.append((min(i, j), max(i, j)))
+    return matches
+
+
+def match_date_window(corpus, rule, blocks, flag_only=False):
+    """
+    Find the similar date pairs of (reference, value, vendor) blocks on the day numbers.
+    """
+    return match_window(corpus.days, corpus.max_days, blocks, flag_only)
+
+
+def match_value_index(corpus, rule, blocks, flag_only=False):
+    """
+    Find the similar value pairs of (reference, date, vendor) blocks.
+
+    Close amounts come from range queries on the sorted amounts of the block.
+    Transposed amounts come from hashing each amount on its sorted digits, so
+    only amounts with the same digits are compared.
+    """
+    tolerance = int(round(corpus.tolerance * 100))
+    matches = match_window(corpus.cents, tolerance, blocks, flag_only)
+    for block in blocks:
+        by_digits = defaultdict(list)
+        for i in block:
+            if corpus.cents[i] != MISSING:
+                by_digits[digit_key(int(corpus.cents[i]))].append(i)
+        for same_digits in by_digits.values():
+            for i, j in combinations(same_digits, 2):
+                c_i, c_j = int(corpus.cents[i]), int(corpus.cents[j])
+                if abs(c_i - c_j) > tolerance and is_transposition(c_i, c_j):
+                    matches.append((i, j))
+    return matches
+
+
+# Rules checked with an index inside each block rather than pair by pair.
+BLOCK_MATCHERS = {
+    'similar date': match_date_window,
+    'similar value': match_value_index,
+}
+
+def match_blocks(corpus, rule_index, blocks, flag_only=False):
+    pattern, _, rule = RULES[rule_index]
+    matcher = BLOCK_MATCHERS.get(pattern, match_pairwise)
+    return matcher(corpus, rule, blocks, flag_only)
+
+
+# Corpus of the current run, set once per worker process by the pool
+# initializer so tasks only carry block positions.
+_worker_corpus = None
+
+def _init_worker(corpus):
+    global _worker_corpus
+    _worker_corpus = corpus
+
+def _match_task(task):
+    rule_index, blocks, flag_only = task
+    return match_blocks(_worker_corpus, rule_index, blocks, flag_only)
+
+
+def run_rules(corpus, workers=1, chunk_size=10000, flag_only=False):
+    """
+    Run every fuzzy rule inside its blocks, optionally on a process pool.
+
+    The blocks are split into chunks of about chunk_size candidate pairs. With
+    workers > 1 the chunks run in a process pool whose workers receive the
+    corpus once, when they start. Results always come back in task order, so
+    the output does not depend on the number of workers.
+
+    Yields:
+        tuple: (pattern, matches) for each chunk, matches being (i, j) pairs.
+    """
+    tasks = []
+    for rule_index, (pattern, fields, rule) in enumerate(RULES):
+        blocks = list(build_block_index(corpus.records, fields).values())
+        for chunk in chunk_blocks(blocks, chunk_size):
+            tasks.append((rule_index, chunk, flag_only))
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(corpus,)) as executor:
+            for task, matches in zip(tasks, executor.map(_match_task, tasks)):
+                yield RULES[task[0]][0], matches
+    else:
+        for task in tasks:
+            yield RULES[task[0]][0], match_blocks(corpus, *task)
+
+
+def iter_matches(records, workers=1, chunk_size=10000, max_days=7, tolerance=100):
+    """
+    Yield every matching pair found by the blocking engine.
+
+    Pairs that match exactly are only reported as 'exact match', not under
+    the fuzzy rules they trivially satisfy as well.
+
+    Args:
+        records (list): Invoice rows as dicts.
+        workers (int): Number of worker processes for the fuzzy rules.
+        chunk_size (int): Candidate pairs per task sent to the workers.
+        max_days (int): Tolerance of the similar date rule, in days.
+        tolerance (float): Tolerance of the similar value rule.
+
+    Yields:
+        tuple: (i, j, pattern) with i < j, the positions of both records.
+    """
+    for block in build_block_index(records, FIELDS).values():
+        for i, j in combinations(block, 2):
+            yield i, j, 'exact match'
+    for pattern, matches in run_rules(Corpus(records, max_days, tolerance), workers, chunk_size):
+        for i, j in matches:
+            if not exact_match(records[i], records[j]):
+                yield i, j, pattern
+
+
+def scan_patterns(records, workers=1, chunk_size=10000, max_days=7, tolerance=100):
+    """
+    Find, for every record, all the patterns it shares with any other record.
+
+    Gives the same result as calling get_match_patterns on every pair of
+    records, in time proportional to the records plus the size of the blocks.
+
+    Args:
+        records (list): Invoice rows as dicts.
+        workers (int): Number of worker processes for the fuzzy rules.
+        chunk_size (int): Candidate pairs per task sent to the workers.
+        max_days (int): Tolerance of the similar date rule, in days.
+        tolerance (float): Tolerance of the similar value rule.
+
+    Returns:
+        list: One set of pattern names per record.
+    """
+    found = [set() for _ in records]
+    for block in build_block_index(records, FIELDS).values():
+        for i in block:
+            found[i].add('exact match')
+    for pattern, matches in run_rules(Corpus(records, max_days, tolerance), workers, chunk_size, flag_only=True):
+        for i, j in matches:
+            found[i].add(pattern)
+            found[j].add(pattern)
+    return found
+
+
+def tag_patterns(records, matches, found):
+    """
+    Pass a stream of matches through, adding the patterns of each pair to found.
+
+    With the matches of iter_matches, found ends up as the result of
+    scan_patterns, so one run of the engine can feed both the patterns and
+    the clusters. Pairs that match exactly also get the fuzzy patterns they
+    satisfy, which only depend on the values shared by the whole block.
+
+    Args:
+        records (list): Invoice rows as dicts.
+        matches (iterable): (i, j, pattern) tuples, such as iter_matches.
+        found (list): One set of pattern names per record, updated in place.
+
+    Yields:
+        tuple: Each (i, j, pattern) of matches.
+    """
+    for i, j, pattern in matches:
+        if pattern != 'exact match':
+            found[i].add(pattern)
+            found[j].add(pattern)
+        elif 'exact match' not in found[i] or 'exact match' not in found[j]:
+            patterns = get_match_patterns(records[i], records[j])
+            found[i].update(patterns)
+            found[j].update(patterns)
+        yield i, j, pattern
+
+
+def describe_patterns(patterns):
+    """
+    Join a set of patterns into the DuplicatePattern label ('unique' if empty).
+    """
+    if not patterns:
+        return 'unique'
+    return ', '.join(sorted(patterns))
@@ -1,11 +1,13 @@
-class CorsMiddleware:
+from django.utils.deprecation import MiddlewareMixin
+
+
+class CorsMiddleware(MiddlewareMixin):
     """
     Middleware to add Access-Control-Allow-Origin header to responses.
-    """
-    def __init__(self, get_response):
-        self.get_response = get_response
 
-    def __call__(self, request):
-        response = self.get_response(request)
+    Runs in sync and async mode, so under ASGI the requests to async views
+    do not go through a thread.
+    """
+    def process_response(self, request, response):
         response["Access-Control-Allow-Origin"] = "*"
-        return response
\ No newline at end of file
+        return response
@@ -1,23 +0,0 @@
-# Generated by Django 5.1.6 on 2025-02-21 16:16
-
-from django.db import migrations, models
-
-
-class Migration(migrations.Migration):
-
-    dependencies = [
-        ('api', '0001_initial'),
-    ]
-
-    operations = [
-        migrations.AddField(
-            model_name='activity',
-            name='case_index',
-            field=models.IntegerField(default=0),
-        ),
-        migrations.AlterField(
-            model_name='activity',
-            name='id',
-            field=models.AutoField(primary_key=True, serialize=False),
-        ),
-    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['reference', 'date', 'value'], name='invoice_ref_date_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['date', 'value', 'vendor'], name='invoice_date_value_vendor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['reference', 'value', 'vendor'], name='invoice_ref_value_vendor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['reference', 'date', 'vendor'], name='invoice_ref_date_vendor_idx'),
+        ),
+    ]
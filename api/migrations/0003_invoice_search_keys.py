@@ -0,0 +1,50 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:30
+
+from django.db import migrations, models
+from api.matching import day_number, reference_key, to_cents, vendor_key
+
+
+def fill_search_keys(apps, schema_editor):
+    Invoice = apps.get_model('api', 'Invoice')
+    batch = []
+    for invoice in Invoice.objects.all().iterator(chunk_size=2000):
+        invoice.vendor_key = vendor_key(invoice.vendor or '')
+        invoice.reference_key = reference_key(invoice.reference or '')
+        invoice.date_day = day_number(invoice.date)
+        invoice.value_cents = to_cents(invoice.value)
+        batch.append(invoice)
+        if len(batch) == 2000:
+            Invoice.objects.bulk_update(batch, ['vendor_key', 'reference_key', 'date_day', 'value_cents'])
+            batch = []
+    Invoice.objects.bulk_update(batch, ['vendor_key', 'reference_key', 'date_day', 'value_cents'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_invoice_candidate_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='date_day',
+            field=models.IntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='reference_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='value_cents',
+            field=models.BigIntegerField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='vendor_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=50),
+        ),
+        migrations.RunPython(fill_search_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def fill_invoice_groups(apps, schema_editor):
+    Invoice = apps.get_model('api', 'Invoice')
+    InvoiceGroup = apps.get_model('api', 'InvoiceGroup')
+    summaries = Invoice.objects.exclude(group_id='').order_by().values('group_id').annotate(
+        total_value=Sum('value'), item_count=Count('id'), first_date=Min('date'), first_id=Min('id'),
+    )
+    batch = []
+    for summary in summaries.iterator(chunk_size=2000):
+        first = Invoice.objects.get(pk=summary['first_id'])
+        batch.append(InvoiceGroup(
+            group_id=summary['group_id'],
+            first_invoice_id=first.pk,
+            total_value=summary['total_value'],
+            amount_overpaid=summary['total_value'] - first.value,
+            item_count=summary['item_count'],
+            date=summary['first_date'],
+            region=first.region,
+            pattern=first.pattern,
+            open=first.open,
+            confidence=first.confidence,
+        ))
+        if len(batch) == 2000:
+            InvoiceGroup.objects.bulk_create(batch)
+            batch = []
+    InvoiceGroup.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_invoice_search_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group_id', models.CharField(max_length=50, unique=True)),
+                ('total_value', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('amount_overpaid', models.DecimalField(db_index=True, decimal_places=2, max_digits=12)),
+                ('item_count', models.IntegerField(db_index=True)),
+                ('date', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('region', models.CharField(db_index=True, max_length=50)),
+                ('pattern', models.CharField(choices=[('Similar Value', 'Similar Value'), ('Similar Reference', 'Similar Reference'), ('Exact Match', 'Exact Match'), ('Similar Date', 'Similar Date'), ('Similar Vendor', 'Similar Vendor'), ('Multiple', 'Multiple')], db_index=True, max_length=50)),
+                ('open', models.BooleanField(db_index=True)),
+                ('confidence', models.CharField(db_index=True, max_length=6)),
+                ('first_invoice', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.invoice')),
+            ],
+        ),
+        migrations.RunPython(fill_invoice_groups, migrations.RunPython.noop),
+    ]
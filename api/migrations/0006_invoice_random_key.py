@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:36
+
+import api.models
+from django.db import migrations, models
+
+
+def fill_random_keys(apps, schema_editor):
+    # AddField gives every existing row the same default, draw one per row instead.
+    Invoice = apps.get_model('api', 'Invoice')
+    batch = []
+    for invoice in Invoice.objects.all().iterator(chunk_size=2000):
+        invoice.random_key = api.models.new_random_key()
+        batch.append(invoice)
+        if len(batch) == 2000:
+            Invoice.objects.bulk_update(batch, ['random_key'])
+            batch = []
+    Invoice.objects.bulk_update(batch, ['random_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_invoice_date_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='random_key',
+            field=models.IntegerField(default=api.models.new_random_key, editable=False),
+        ),
+        migrations.RunPython(fill_random_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['random_key', 'id'], name='invoice_random_key_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_invoice_random_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['vendor', 'date'], name='invoice_vendor_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['pattern', 'date'], name='invoice_pattern_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['group_id', 'value'], name='invoice_group_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['open', 'group_id', 'value'], name='invoice_open_group_value_idx'),
+        ),
+    ]
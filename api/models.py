@@ -1,5 +1,113 @@
-from django.db import models
+import random
+from contextlib import nullcontext
+from django.db import models, transaction
 from .constants import PATTERN_CHOICES
+from .matching import day_number, reference_key, to_cents, vendor_key
+
+
+# Fields maintained by Invoice.update_search_keys.
+SEARCH_KEY_FIELDS = ('vendor_key', 'reference_key', 'date_day', 'value_cents')
+
+# The field each search key is derived from.
+SEARCH_KEY_SOURCES = {'vendor': 'vendor_key', 'reference': 'reference_key', 'date': 'date_day', 'value': 'value_cents'}
+
+
+# Invoice.random_key values are drawn from range(RANDOM_KEY_RANGE).
+RANDOM_KEY_RANGE = 2 ** 31
+
+
+def new_random_key():
+    return random.randrange(RANDOM_KEY_RANGE)
+
+
+# Invoice fields the InvoiceGroup summaries are computed from.
+GROUP_SOURCE_FIELDS = ('group_id', 'value', 'date', 'region', 'pattern', 'open', 'confidence')
+
+
+class InvoiceQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Bulk insert invoices, group the ones created without a group_id,
+        refresh the summaries of the groups they joined, and send
+        invoices_changed.
+        """
+        from .groups import deferred_refresh, refresh_groups
+        from .signals import invoices_changed
+        objs = list(objs)
+        for obj in objs:
+            obj.update_search_keys()
+        with deferred_refresh():
+            objs = super().bulk_create(objs, *args, **kwargs)
+            ungrouped = [obj for obj in objs if not obj.group_id and obj.pk is not None]
+            if ungrouped:
+                from .incremental import match_invoices
+                match_invoices(ungrouped)
+            refresh_groups(obj.group_id for obj in objs)
+        invoices_changed.send(sender=Invoice, created=objs)
+        return objs
+
+    def update(self, **kwargs):
+        """
+        Update the invoices, then refresh the summaries of the groups they
+        left and joined, when a summarized field changes, and send
+        invoices_changed.
+
+        Search keys are updated with the fields they derive from: in the same
+        query for plain values, and by reading the updated invoices back when
+        a source field is set from an expression.
+        """
+        from .groups import refresh_groups
+        from .signals import invoices_changed
+        sources = [field for field in SEARCH_KEY_SOURCES if field in kwargs]
+        computed = [field for field in sources if hasattr(kwargs[field], 'resolve_expression')]
+        if sources and not computed:
+            kwargs.update(search_keys(**{field: kwargs[field] for field in sources}))
+        with transaction.atomic(using=self.db) if computed else nullcontext():
+            pks = list(self.values_list('pk', flat=True)) if computed else None
+            if not set(kwargs) & set(GROUP_SOURCE_FIELDS):
+                rows = super().update(**kwargs)
+            else:
+                group_ids = set(self.order_by().values_list('group_id', flat=True).distinct())
+                rows = super().update(**kwargs)
+                if 'group_id' in kwargs:
+                    group_ids.add(kwargs['group_id'])
+                refresh_groups(group_ids)
+            if computed:
+                refresh_search_keys(pks, [SEARCH_KEY_SOURCES[field] for field in sources], self.db)
+        invoices_changed.send(sender=Invoice)
+        return rows
+
+    def delete(self):
+        """
+        Delete the invoices, refreshing each affected group once, and send
+        invoices_changed once with the deleted invoices, in one transaction.
+        """
+        from .groups import deferred_refresh
+        from .signals import collected_deletes
+        with transaction.atomic(using=self.db), collected_deletes(), deferred_refresh():
+            return super().delete()
+
+
+def search_keys(**fields):
+    """
+    The search keys derived from the given vendor, reference, date and value fields.
+    """
+    invoice = Invoice(**fields)
+    invoice.update_search_keys()
+    return {SEARCH_KEY_SOURCES[field]: getattr(invoice, SEARCH_KEY_SOURCES[field]) for field in fields}
+
+
+def refresh_search_keys(pks, keys, using='default', batch_size=1000):
+    """
+    Recompute the given search keys of the invoices with the given ids from their stored fields.
+    """
+    for start in range(0, len(pks), batch_size):
+        invoices = list(models.QuerySet(Invoice, using=using).filter(pk__in=pks[start:start + batch_size]))
+        for invoice in invoices:
+            invoice.update_search_keys()
+        # A plain QuerySet, so writing the keys does not go through InvoiceQuerySet.update again.
+        models.QuerySet(Invoice, using=using).bulk_update(invoices, keys)
+
 
 class Invoice(models.Model):
     """
@@ -21,6 +129,19 @@ class Invoice(models.Model):
         Payment_Method (str): The payment method for the invoice.
         Pay_Date (datetime): The payment date of the invoice.
         Special_Instructions (str): Any special instructions for the invoice.
+        vendor_key (str): The vendor name, alphanumeric characters only and upper-cased.
+        reference_key (str): The reference, alphanumeric characters only.
+        date_day (int): The date of the invoice, as days since 1970-01-01.
+        value_cents (int): The value of the invoice, in cents.
+        random_key (int): A random number drawn once per invoice, to sample
+            invoices in random order through an index (see api.pagination).
+
+    The last four fields are derived from the others on save, bulk_create and
+    queryset update, so matching and filtering can use them without
+    normalizing in Python.
+    Invoices saved or bulk created without a group_id are matched against the
+    existing invoices and grouped (see api.incremental). Saving, updating or
+    deleting invoices refreshes the InvoiceGroup summaries of their groups.
     """
     reference = models.CharField(max_length=50)
     date = models.DateTimeField(null=True, blank=True)
@@ -38,6 +159,113 @@ class Invoice(models.Model):
     pay_date = models.DateTimeField(null=True, blank=True)
     special_instructions = models.CharField(max_length=50, blank=True, null=True)
     accuracy = models.IntegerField(default=0)
+    vendor_key = models.CharField(max_length=50, default='', editable=False, db_index=True)
+    reference_key = models.CharField(max_length=50, default='', editable=False, db_index=True)
+    date_day = models.IntegerField(null=True, editable=False, db_index=True)
+    value_cents = models.BigIntegerField(null=True, editable=False, db_index=True)
+    random_key = models.IntegerField(default=new_random_key, editable=False)
+
+    objects = InvoiceQuerySet.as_manager()
+
+    class Meta:
+        # Candidate lookups of the incremental matcher: one index per set of
+        # three fields a matching rule requires to be equal.
+        indexes = [
+            models.Index(fields=['reference', 'date', 'value'], name='invoice_ref_date_value_idx'),
+            models.Index(fields=['date', 'value', 'vendor'], name='invoice_date_value_vendor_idx'),
+            models.Index(fields=['reference', 'value', 'vendor'], name='invoice_ref_value_vendor_idx'),
+            models.Index(fields=['reference', 'date', 'vendor'], name='invoice_ref_date_vendor_idx'),
+            # Filters of /api/invoices/, alone or with a date range.
+            models.Index(fields=['vendor', 'date'], name='invoice_vendor_date_idx'),
+            models.Index(fields=['pattern', 'date'], name='invoice_pattern_date_idx'),
+            # Items of /api/groups/ and InvoiceGroup refreshes; covers the
+            # distinct group count and the total value of /api/kpis/.
+            models.Index(fields=['group_id', 'value'], name='invoice_group_value_idx'),
+            # The open filter, and the open invoices, groups and value of /api/kpis/.
+            models.Index(fields=['open', 'group_id', 'value'], name='invoice_open_group_value_idx'),
+            # Keyset pagination of /api/invoices/ (api.pagination).
+            models.Index(fields=['date', 'id'], name='invoice_date_id_idx'),
+            # Seeded random sampling of /api/invoices/ (api.pagination).
+            models.Index(fields=['random_key', 'id'], name='invoice_random_key_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the group the invoice was loaded in, to refresh it if the invoice moves.
+        instance._loaded_group_id = instance.__dict__.get('group_id')
+        return instance
+
+    def update_search_keys(self):
+        """
+        Recompute the normalized shadow fields from reference, vendor, date and value.
+        """
+        self.vendor_key = vendor_key(self.vendor or '')
+        self.reference_key = reference_key(self.reference or '')
+        self.date_day = day_number(self.date)
+        try:
+            self.value_cents = to_cents(self.value)
+        except (TypeError, ValueError):
+            self.value_cents = None
+
+    def save(self, *args, **kwargs):
+        self.update_search_keys()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | set(SEARCH_KEY_FIELDS)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Invoice {self.reference} from {self.vendor} on {self.date}"
+
+
+class InvoiceGroup(models.Model):
+    """
+    Summary of a group of similar invoices, kept up to date as invoices change.
+
+    Attributes:
+        group_id (str): The group ID shared by the invoices of the group.
+        first_invoice (Invoice): The first invoice of the group, by id.
+        total_value (decimal): The sum of the values of the invoices of the group.
+        amount_overpaid (decimal): The total value minus the value of the first invoice.
+        item_count (int): The number of invoices in the group.
+        date (datetime): The earliest date of the invoices of the group.
+        region (str): The region of the first invoice.
+        pattern (str): The pattern type of the first invoice.
+        open (bool): The status of the first invoice.
+        confidence (str): The confidence level of the first invoice.
+
+    The rows are written by api.groups, never edited directly. The
+    rebuild_invoice_groups command recomputes them all from the invoices.
+    """
+    group_id = models.CharField(max_length=50, unique=True)
+    first_invoice = models.ForeignKey(Invoice, null=True, on_delete=models.SET_NULL, related_name='+')
+    total_value = models.DecimalField(max_digits=12, decimal_places=2)
+    amount_overpaid = models.DecimalField(max_digits=12, decimal_places=2, db_index=True)
+    item_count = models.IntegerField(db_index=True)
+    date = models.DateTimeField(null=True, blank=True, db_index=True)
+    region = models.CharField(max_length=50, db_index=True)
+    pattern = models.CharField(max_length=50, choices=PATTERN_CHOICES, db_index=True)
+    open = models.BooleanField(db_index=True)
+    confidence = models.CharField(max_length=6, db_index=True)
+
+    def __str__(self):
+        return f"Group {self.group_id} of {self.item_count} invoices"
+
+
+class DataVersion(models.Model):
+    """
+    Global version of the invoice data, bumped whenever invoices change.
+
+    A single row (pk=1). Views use it to answer conditional GETs (ETag and
+    Last-Modified) without running their queries, see api.versioning.
+
+    Attributes:
+        version (int): Incremented on every change of the invoices.
+        updated_at (datetime): When the invoices last changed.
+    """
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField()
 
     def __str__(self):
-        return f"Invoice {self.reference} from {self.vendor} on {self.date}"
\ No newline at end of file
+        return f"Data version {self.version} of {self.updated_at}"
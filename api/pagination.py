@@ -0,0 +1,221 @@
+"""
+Pagination of invoices beyond page numbers.
+
+KeysetPagination orders pages by (date, id), and each page starts right
+after the last row of the previous one, found through the (date, id) index.
+Unlike PageNumberPagination there is no OFFSET scan and no COUNT(*), so deep
+pages cost the same as the first one.
+
+RandomSamplePagination pages through invoices in a seeded random order read
+from the random_key index, instead of sorting the whole table by RANDOM().
+"""
+
+import base64
+import json
+import random
+import secrets
+from collections import OrderedDict
+from datetime import datetime
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from .models import RANDOM_KEY_RANGE
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination ordered by (date, id), invoices without a date first.
+
+    The cursor encodes the (date, id) of the row the page starts after (or
+    before, going back), so it stays valid when rows are added.
+
+    Attributes:
+        page_size (int): Number of results per page, overridden by ?page_size=.
+        max_page_size (int): Largest page size a client can ask for.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = api_settings.PAGE_SIZE or 20
+    max_page_size = 1000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        order = [F('date').asc(nulls_first=True), F('id').asc()]
+        if reverse:
+            order = [F('date').desc(nulls_last=True), F('id').desc()]
+        if position is not None:
+            queryset = queryset.filter(self.position_filter(*position, reverse))
+        rows = list(queryset.order_by(*order)[:self.page_size + 1])
+
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else position is not None
+        self.first, self.last = (self.position(rows[0]), self.position(rows[-1])) if rows else (None, None)
+        if not rows and position is not None:
+            # Past either end: link back to the position the client came from.
+            self.has_next, self.has_previous = reverse, not reverse
+            self.first = self.last = position
+        return rows
+
+    def position(self, row):
+        """
+        The (date, id) of a row: an Invoice, or a named values_list() row with date and id.
+        """
+        return row.date, row.id
+
+    def position_filter(self, date, id, reverse):
+        """
+        The rows after (date, id) in (date, id) order, or before it if reverse.
+        """
+        if not reverse:
+            if date is None:
+                return Q(date__isnull=False) | Q(date__isnull=True, id__gt=id)
+            return Q(date__gt=date) | Q(date=date, id__gt=id)
+        if date is None:
+            return Q(date__isnull=True, id__lt=id)
+        return Q(date__isnull=True) | Q(date__lt=date) | Q(date=date, id__lt=id)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(size, self.max_page_size) if size > 0 else self.page_size
+
+    def decode_cursor(self, request):
+        """
+        Returns:
+            tuple: ((date, id) or None, reverse).
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            date = datetime.fromisoformat(data['d']) if data['d'] is not None else None
+            return (date, int(data['i'])), bool(data['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position, reverse):
+        date, id = position
+        data = {'d': date.isoformat() if date is not None else None, 'i': id, 'r': reverse}
+        encoded = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or self.last is None:
+            return None
+        return self.encode_cursor(self.last, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.first is None:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.first, reverse=True)
+
+    def get_paginated_response(self, data, count=None):
+        response = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+        if count is not None:
+            response['count'] = count
+            response.move_to_end('count', last=False)
+        return Response(response)
+
+
+class RandomSample:
+    """
+    Invoices in a pseudo-random order fixed by a seed, read through the random_key index.
+
+    The seed picks a starting key and a direction. The invoices are read
+    from the starting key to the end of the index, then wrap around to the
+    beginning, so any slice is at most two index range scans. The keys
+    themselves are random, so the seed only chooses where the order starts.
+
+    Supports count() and slicing, which is all Django's Paginator needs.
+    """
+
+    def __init__(self, queryset, seed):
+        rng = random.Random(seed)
+        start = rng.randrange(RANDOM_KEY_RANGE)
+        queryset = queryset.order_by()
+        if rng.random() < 0.5:
+            self.head = queryset.filter(random_key__gte=start).order_by('random_key', 'id')
+            self.tail = queryset.filter(random_key__lt=start).order_by('random_key', 'id')
+        else:
+            self.head = queryset.filter(random_key__lt=start).order_by('-random_key', '-id')
+            self.tail = queryset.filter(random_key__gte=start).order_by('-random_key', '-id')
+        self.queryset = queryset
+        self.head_count = None
+
+    def count(self):
+        return self.queryset.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError('RandomSample only supports slices without a step.')
+        start, stop = index.start or 0, index.stop
+        rows = list(self.head[start:stop])
+        if stop is not None and len(rows) == stop - start:
+            return rows
+        if rows:
+            # The head ran out inside the slice: continue from the start of the tail.
+            tail_start = 0
+        else:
+            if self.head_count is None:
+                self.head_count = self.head.count()
+            tail_start = max(start - self.head_count, 0)
+        tail_stop = None if stop is None else tail_start + (stop - start) - len(rows)
+        return rows + list(self.tail[tail_start:tail_stop])
+
+
+class RandomSamplePagination(PageNumberPagination):
+    """
+    Page-number pagination over a RandomSample of the queryset.
+
+    The seed comes from ?seed=, or is drawn for the request. It is returned
+    in the response and kept in the next and previous links, so the pages
+    of one random view never overlap and can be requested again.
+
+    Attributes:
+        page_size_query_param (str): Overrides page_size, as in KeysetPagination.
+        max_page_size (int): Largest page size a client can ask for.
+    """
+    seed_query_param = 'seed'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.seed = request.query_params.get(self.seed_query_param) or str(secrets.randbelow(RANDOM_KEY_RANGE))
+        return super().paginate_queryset(RandomSample(queryset, self.seed), request, view)
+
+    def get_next_link(self):
+        link = super().get_next_link()
+        return replace_query_param(link, self.seed_query_param, self.seed) if link else None
+
+    def get_previous_link(self):
+        link = super().get_previous_link()
+        return replace_query_param(link, self.seed_query_param, self.seed) if link else None
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['seed'] = self.seed
+        return response
@@ -0,0 +1,171 @@
+"""
+Q-gram (trigram) inverted index for fuzzy vendor and reference lookups.
+
+Each distinct normalized string is split into overlapping q-grams, and every
+gram points to the strings containing it. A lookup only scores the strings
+sharing at least a minimum number of grams with the query, instead of the
+whole dataset. The index is saved to disk as gzipped JSON, so commands and
+API views can load it without rebuilding it.
+"""
+
+import gzip
+import json
+import os
+from collections import Counter, defaultdict
+from django.conf import settings
+from rapidfuzz import fuzz, process
+from .matching import vendor_key
+from .models import Invoice
+from .versioning import current_data_version
+
+
+def normalize_key(text):
+    """
+    Keep only the alphanumeric characters, upper-cased, as the vendor rule does.
+    """
+    return vendor_key(str(text))
+
+
+def qgrams(key, q=3):
+    """
+    The set of q-grams of a normalized key, padded so short keys still have grams.
+    """
+    padded = '#' * (q - 1) + key + '#' * (q - 1)
+    return {padded[k:k + q] for k in range(len(padded) - q + 1)}
+
+
+class QGramIndex:
+    """
+    Inverted index from q-grams to normalized strings.
+
+    Attributes:
+        q (int): The gram length.
+        keys (list): The normalized string of each id.
+        values (list): The payloads added under each id (the original
+            spellings, or any other value given to add).
+        ids (dict): Normalized string -> id.
+        postings (dict): Gram -> list of ids containing it, in increasing order.
+    """
+
+    def __init__(self, q=3):
+        self.q = q
+        self.keys = []
+        self.values = []
+        self.ids = {}
+        self.postings = defaultdict(list)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, text, payload=None):
+        """
+        Index a string, storing payload (text itself by default) under its normalized form.
+        """
+        key = normalize_key(text)
+        if not key:
+            return None
+        id_ = self.ids.get(key)
+        if id_ is None:
+            id_ = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+            self.values.append([])
+            for gram in qgrams(key, self.q):
+                self.postings[gram].append(id_)
+        if payload is None:
+            if text not in self.values[id_]:
+                self.values[id_].append(text)
+        else:
+            self.values[id_].append(payload)
+        return id_
+
+    def candidates(self, text, min_shared=2):
+        """
+        Ids of the strings sharing at least min_shared q-grams with text.
+
+        min_shared is capped at the number of grams of the query, so very
+        short queries still find candidates.
+
+        Returns:
+            list: Ids, most shared grams first, then in id order.
+        """
+        grams = qgrams(normalize_key(text), self.q)
+        counts = Counter()
+        for gram in grams:
+            counts.update(self.postings.get(gram, ()))
+        min_shared = min(min_shared, len(grams))
+        found = [id_ for id_, shared in counts.items() if shared >= min_shared]
+        found.sort(key=lambda id_: (-counts[id_], id_))
+        return found
+
+    def search(self, text, limit=10, score_cutoff=80, scorer=fuzz.token_sort_ratio, min_shared=2):
+        """
+        Fuzzy lookup: score the q-gram candidates of text and keep the best ones.
+
+        Returns:
+            list: (key, score, values) tuples, best score first.
+        """
+        ids = self.candidates(text, min_shared)
+        if not ids:
+            return []
+        choices = {id_: self.keys[id_] for id_ in ids}
+        matches = process.extract(
+            normalize_key(text), choices, scorer=scorer, limit=limit, score_cutoff=score_cutoff,
+        )
+        return [(key, score, self.values[id_]) for key, score, id_ in matches]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        data = {'q': self.q, 'keys': self.keys, 'values': self.values, 'postings': self.postings}
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls(data['q'])
+        index.keys = data['keys']
+        index.values = data['values']
+        index.ids = {key: id_ for id_, key in enumerate(index.keys)}
+        index.postings = defaultdict(list, data['postings'])
+        return index
+
+
+# Invoice fields with a q-gram index.
+INDEXED_FIELDS = ('vendor', 'reference')
+
+_loaded = {}
+
+
+def index_path(field):
+    return os.path.join(settings.QGRAM_INDEX_DIR, f'{field}.json.gz')
+
+
+def build_invoice_index(field):
+    """
+    Build the q-gram index of the distinct values of an Invoice field.
+    """
+    index = QGramIndex()
+    for value in Invoice.objects.order_by().values_list(field, flat=True).distinct().iterator():
+        index.add(value)
+    return index
+
+
+def get_invoice_index(field, request=None):
+    """
+    The q-gram index of an Invoice field, loaded from disk once per process.
+
+    The file is loaded again when it changes on disk. Without a saved index
+    it is built from the database (see the build_qgram_index command), and
+    built again when the data version changes.
+    """
+    path = index_path(field)
+    if os.path.exists(path):
+        source = ('file', os.path.getmtime(path))
+    else:
+        source = ('database', current_data_version(request)[0])
+    cached = _loaded.get(field)
+    if cached is None or cached[0] != source:
+        index = QGramIndex.load(path) if source[0] == 'file' else build_invoice_index(field)
+        cached = _loaded[field] = (source, index)
+    return cached[1]
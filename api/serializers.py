@@ -1,4 +1,8 @@
+import datetime
+import decimal
+from django.db import models
 from rest_framework import serializers
+from rest_framework.settings import ISO_8601, api_settings
 from .models import Invoice
 
 ## Serializers are used to convert complex data types, such as querysets and model instances, to native Python datatypes that can then be easily rendered into JSON, XML or other content types.
@@ -18,4 +22,119 @@ class InvoiceSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Invoice
-        fields = 'reference', 'date', 'unit_price', 'quantity', 'value', 'vendor', 'pattern', 'open', 'group_id', 'confidence', 'region', 'description', 'payment_method', 'pay_date', 'special_instructions', 'accuracy'
\ No newline at end of file
+        fields = 'reference', 'date', 'unit_price', 'quantity', 'value', 'vendor', 'pattern', 'open', 'group_id', 'confidence', 'region', 'description', 'payment_method', 'pay_date', 'special_instructions', 'accuracy'
+
+class FastRowSerializer:
+    """
+    Fast path of a ModelSerializer for read-only lists: rows are read with
+    values_list() and only the columns that need it go through a converter
+    precompiled from the serializer's field, instead of a full
+    Field.to_representation call per value on model instances.
+
+    Columns the database already returns as their JSON value (text, integer
+    and boolean model fields) are copied as they are. The converters of the
+    other columns produce JSON-native values, so the JSON renderer never
+    calls back into Python, and the rendered output is byte for byte the one
+    of the serializer. Fields without a fast converter use their own
+    to_representation.
+
+    Attributes:
+        serializer_class (class): The ModelSerializer reproduced.
+        names (list): The output keys, in the serializer's order.
+        sources (list): The model fields read, in the same order.
+    """
+
+    # Serializer fields whose value is the model field's value, when the
+    # model field is one of the given classes.
+    identity_fields = [
+        (serializers.CharField, (models.CharField, models.TextField)),
+        (serializers.IntegerField, (models.IntegerField,)),
+        (serializers.BooleanField, (models.BooleanField,)),
+    ]
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        fields = list(serializer_class().fields.values())
+        self.names = [field.field_name for field in fields]
+        self.sources = [field.source for field in fields]
+
+    def queryset(self, queryset, *extra, named=False):
+        """
+        The queryset returning the rows to serialize, with the extra fields
+        after the serialized ones.
+        """
+        return queryset.values_list(*self.sources, *extra, named=named)
+
+    def converters(self):
+        """
+        Compile one converter per field, None for the fields copied as they
+        are. The DateTime converters read the current time zone, so they are
+        compiled for each call.
+        """
+        return [self.converter(field) for field in self.serializer_class().fields.values()]
+
+    def converter(self, field):
+        model_field = self.serializer_class.Meta.model._meta.get_field(field.source)
+
+        for field_class, model_classes in self.identity_fields:
+            if type(field) is field_class and isinstance(model_field, model_classes):
+                return None
+
+        if isinstance(field, serializers.ChoiceField):
+            choices = field.choice_strings_to_values
+            if isinstance(model_field, models.CharField) and all(key == value for key, value in choices.items()):
+                return None
+
+            def convert_choice(value):
+                return value if value == '' else choices.get(str(value), value)
+            return convert_choice
+
+        if isinstance(field, serializers.DecimalField) and not (field.localize or field.normalize_output):
+            context = decimal.getcontext().copy()
+            if field.max_digits is not None:
+                context.prec = field.max_digits
+            exponent = decimal.Decimal('.1') ** field.decimal_places if field.decimal_places is not None else None
+            rounding = field.rounding
+            coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+
+            def convert_decimal(value):
+                if value.__class__ is not decimal.Decimal:
+                    return field.to_representation(value)
+                if exponent is not None:
+                    value = value.quantize(exponent, rounding=rounding, context=context)
+                # The JSON encoder renders Decimal as float.
+                return '{:f}'.format(value) if coerce_to_string else float(value)
+            return convert_decimal
+
+        if isinstance(field, serializers.DateTimeField) and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601:
+            field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+
+            def convert_datetime(value):
+                if value.__class__ is not datetime.datetime or value.tzinfo is None or field_timezone is None:
+                    return field.to_representation(value)
+                value = value.astimezone(field_timezone).isoformat()
+                return value[:-6] + 'Z' if value.endswith('+00:00') else value
+            return convert_datetime
+
+        return field.to_representation
+
+    def to_representation(self, rows):
+        """
+        Serialize values_list() rows, in the order of self.sources.
+
+        Values past the serialized fields (the extra fields of queryset()) are ignored.
+        """
+        names = self.names
+        converters = [(name, convert) for name, convert in zip(names, self.converters()) if convert is not None]
+        data = []
+        for row in rows:
+            item = dict(zip(names, row))
+            for name, convert in converters:
+                value = item[name]
+                if value is not None:
+                    item[name] = convert(value)
+            data.append(item)
+        return data
+
+
+invoice_rows = FastRowSerializer(InvoiceSerializer)
@@ -0,0 +1,98 @@
+import threading
+from contextlib import contextmanager
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from .facets import apply_change, invoice_row
+from .groups import deferred_refresh, refresh_groups
+from .incremental import match_invoice
+from .models import Invoice
+from .versioning import bump_data_version, current_data_version
+
+# Sent after invoices are created, updated or deleted, by any write path:
+# model saves and deletes, and the bulk_create, update and delete of
+# Invoice querysets. Receivers drop or update state derived from invoices.
+# created or deleted hold the invoices when the change is only creating or
+# deleting them, updated holds (before, after) pairs of the invoices when it
+# only updates them; all are None for other changes.
+invoices_changed = Signal()
+
+_collected = threading.local()
+
+
+@contextmanager
+def collected_deletes():
+    """
+    Collect the invoices deleted inside the block and send invoices_changed
+    once for all of them, on exit, instead of once per invoice.
+
+    Nested blocks join the outermost one. If the block raises, nothing is sent.
+    """
+    if getattr(_collected, 'deleted', None) is not None:
+        yield
+        return
+    _collected.deleted = []
+    try:
+        yield
+        deleted = _collected.deleted
+    finally:
+        _collected.deleted = None
+    if deleted:
+        invoices_changed.send(sender=Invoice, deleted=deleted)
+
+
+@receiver(post_save, sender=Invoice)
+def group_new_invoice(sender, instance, created, raw=False, **kwargs):
+    """
+    Match an invoice created without a group_id against its candidates, then
+    refresh the summaries of the groups it joined or left.
+    """
+    if raw:
+        return
+    with deferred_refresh():
+        if created and not instance.group_id:
+            match_invoice(instance)
+        refresh_groups({instance.group_id, getattr(instance, '_loaded_group_id', None)})
+    instance._loaded_group_id = instance.group_id
+    invoices_changed.send(sender=Invoice, created=[instance] if created else None)
+
+
+@receiver(post_delete, sender=Invoice)
+def refresh_deleted_invoice_group(sender, instance, **kwargs):
+    """
+    Refresh the summary of the group a deleted invoice belonged to.
+    """
+    refresh_groups({instance.group_id})
+    deleted = getattr(_collected, 'deleted', None)
+    if deleted is not None:
+        deleted.append(instance)
+    else:
+        invoices_changed.send(sender=Invoice, deleted=[instance])
+
+
+@receiver(invoices_changed)
+def bump_version(sender, **kwargs):
+    """
+    Bump the data version in the transaction of the change, so it becomes
+    visible together with the change.
+    """
+    bump_data_version()
+
+
+@receiver(invoices_changed)
+def update_facet_index(sender, created=None, deleted=None, updated=None, **kwargs):
+    """
+    Count created and deleted invoices in or out of the facet index once the
+    change is committed, and updated ones out with their old values and back
+    in with the new, as the change of the data version it made. The index is
+    rebuilt after any other change, since it falls behind the data version.
+    """
+    if created is None and deleted is None and updated is None:
+        return
+    # The version bump_version, connected first, just set in this transaction.
+    version = current_data_version()[0]
+    removed = [invoice_row(invoice) for invoice in deleted or ()]
+    removed += [invoice_row(old) for old, new in updated or ()]
+    added = [invoice_row(invoice) for invoice in created or ()]
+    added += [invoice_row(new) for old, new in updated or ()]
+    transaction.on_commit(lambda: apply_change(version, removed, added))
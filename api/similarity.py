@@ -0,0 +1,154 @@
+"""
+Batched nearest-invoice search.
+
+The corpus is stringified and normalized once, then queries are scored
+against all of it with rapidfuzz's matrix primitives instead of one
+fuzz.ratio call per pair. Scores are those of calc_similarity's
+indel_distance on the stringified invoices.
+"""
+
+import csv
+import numpy as np
+from rapidfuzz import fuzz, process
+from .qgram import QGramIndex
+
+
+def normalize(s):
+    return s.replace(' ', '').replace('-', '').replace('/', '').replace('.', '').lower()
+
+
+def stringify(invoice):
+    return ' '.join([normalize(str(invoice[key])) for key in invoice])
+
+
+def compared_string(invoice):
+    """
+    The string an invoice is scored on: stringified, then normalized again as
+    indel_distance does, which drops the spaces between the fields.
+    """
+    return normalize(stringify(invoice))
+
+
+def invoice_from_row(row):
+    """
+    Build the invoice dict compared by calc_similarity from an OutputData.csv row.
+    """
+    return {
+        "reference": row['reference'],
+        "date": row['Date'],
+        "value": row['value'],
+        "vendor": row['Vendor'],
+        "region": row['Region'],
+        "description": row['Description'],
+        "payment_method": row['Payment Method'],
+        "special_instructions": row['Special Intructions']
+    }
+
+
+class InvoiceSearch:
+    """
+    Top-k similarity search over a pre-normalized invoice corpus.
+
+    Attributes:
+        rows (list): The corpus rows, returned with each match.
+        choices (list): The compared_string of each row's invoice.
+        indexes (dict): Q-gram index of the vendors and references, with the
+            row positions as payloads. Built on the first shortlisted query.
+    """
+
+    shortlist_fields = ('vendor', 'reference')
+
+    def __init__(self, rows, to_invoice=invoice_from_row):
+        self.rows = list(rows)
+        self.invoices = [to_invoice(row) for row in self.rows]
+        self.choices = [compared_string(invoice) for invoice in self.invoices]
+        self.indexes = None
+
+    @classmethod
+    def from_csv(cls, path, to_invoice=invoice_from_row):
+        with open(path, newline='', encoding='utf-8-sig') as csvfile:
+            return cls(csv.DictReader(csvfile), to_invoice)
+
+    def shortlist(self, invoice, min_shared=2):
+        """
+        Positions of the rows whose vendor or reference shares q-grams with the invoice's.
+        """
+        if self.indexes is None:
+            self.indexes = {field: QGramIndex() for field in self.shortlist_fields}
+            for position, row_invoice in enumerate(self.invoices):
+                for field, index in self.indexes.items():
+                    index.add(row_invoice.get(field, ''), position)
+        positions = set()
+        for field, index in self.indexes.items():
+            for id_ in index.candidates(invoice.get(field, ''), min_shared):
+                positions.update(index.values[id_])
+        return np.array(sorted(positions), dtype=np.int64)
+
+    def top_k(self, invoices, k=5, score_cutoff=0, workers=1, shortlist=False):
+        """
+        Find the k most similar corpus rows for each query invoice.
+
+        Args:
+            invoices (list): Query invoices, as dicts with the compared fields.
+            k (int): Number of matches to return per query.
+            score_cutoff (float): Minimum similarity (0 to 1) of a match.
+            workers (int): Threads used by rapidfuzz to fill the score matrix (-1 for all cores).
+            shortlist (bool): Only score the rows whose vendor or reference
+                shares q-grams with the query's, instead of the whole corpus.
+
+        Returns:
+            list: For each query, a list of (similarity, row) tuples sorted by
+            decreasing similarity. Ties keep the corpus order.
+        """
+        if not invoices or not self.choices:
+            return [[] for _ in invoices]
+        cutoff = score_cutoff * 100
+
+        if shortlist:
+            results = []
+            for invoice in invoices:
+                positions = self.shortlist(invoice)
+                if not len(positions):
+                    results.append([])
+                    continue
+                scores = process.cdist(
+                    [compared_string(invoice)], [self.choices[i] for i in positions], scorer=fuzz.ratio,
+                    score_cutoff=cutoff, dtype=np.float64, workers=workers,
+                )
+                results.append(self.rank(scores[0], positions, k, cutoff))
+            return results
+
+        queries = [compared_string(invoice) for invoice in invoices]
+        scores = process.cdist(
+            queries, self.choices, scorer=fuzz.ratio, score_cutoff=cutoff,
+            dtype=np.float64, workers=workers,
+        )
+        positions = np.arange(len(self.choices))
+        return [self.rank(row_scores, positions, k, cutoff) for row_scores in scores]
+
+    def rank(self, row_scores, positions, k, cutoff):
+        """
+        The k best (similarity, row) tuples of one row of scores.
+        """
+        k = min(k, len(row_scores))
+        # Keep every score tied with the k-th best, then stable sort them so
+        # ties are broken by corpus position.
+        kth = np.partition(row_scores, -k)[-k]
+        candidates = np.flatnonzero(row_scores >= max(kth, cutoff))
+        order = candidates[np.argsort(-row_scores[candidates], kind='stable')][:k]
+        return [(float(row_scores[i]) / 100, self.rows[positions[i]]) for i in order]
+
+    def best(self, invoice, score_cutoff=0):
+        """
+        Find the most similar corpus row for a single invoice.
+
+        Returns:
+            tuple: (similarity, row), or None if nothing reaches score_cutoff.
+        """
+        match = process.extractOne(
+            compared_string(invoice), self.choices, scorer=fuzz.ratio, score_cutoff=score_cutoff * 100,
+        )
+        if match is None:
+            return None
+        _, score, i = match
+        return float(score) / 100, self.rows[i]
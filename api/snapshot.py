@@ -0,0 +1,304 @@
+"""
+Columnar snapshot of the invoices, for analytics.
+
+A snapshot is a compressed NumPy archive (.npz) with one typed array per
+column. Loading it decompresses ready-made arrays instead of parsing text, so
+there is no date, decimal or boolean parsing. String columns with few
+distinct values are dictionary-encoded, as int32 codes into an array of
+values, and become pandas Categoricals without being decoded.
+
+Columns:
+    id: int64
+    reference, reference_key: unicode strings
+    date: microseconds since 1970-01-01 UTC as int64, NaT when missing (a datetime64[us] view)
+    date_day: days since 1970-01-01 as int32, MISSING_DAY when missing
+    value_cents: the value in cents as int64, MISSING_CENTS when missing
+    open: bool
+    unit_price_cents: the unit price in cents as int64
+    quantity, accuracy: int64
+    pay_date: as date, NaT when missing
+    DICTIONARY_FIELDS: <field>.codes (int32, -1 for null) and <field>.values
+
+The __meta__ entry is a JSON string with the format, the number of rows, the
+data version the snapshot was taken at and its creation time.
+"""
+
+import glob
+import json
+import os
+import tempfile
+from array import array
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone as django_timezone
+from .matching import REFERENCE, DATE, VALUE, VENDOR, VENDOR_KEY, REFERENCE_KEY, DATE_DAY, VALUE_CENTS
+from .models import Invoice
+from .versioning import current_data_version
+
+SNAPSHOT_FORMAT = 2
+
+# String fields stored as codes into their distinct values.
+DICTIONARY_FIELDS = (
+    'vendor', 'vendor_key', 'pattern', 'confidence', 'region', 'description',
+    'payment_method', 'special_instructions', 'group_id',
+)
+
+# Invoice fields read into a snapshot, in column order.
+SNAPSHOT_FIELDS = (
+    'id', 'reference', 'reference_key', 'date', 'date_day', 'value_cents', 'open',
+    'unit_price', 'quantity', 'pay_date', 'accuracy',
+) + DICTIONARY_FIELDS
+
+MISSING_DAY = np.iinfo(np.int32).min
+MISSING_CENTS = np.iinfo(np.int64).min
+# NaT of datetime64, as int64.
+MISSING_DATE = np.iinfo(np.int64).min
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class Dictionary:
+    """
+    Codes of the distinct values of a column, in order of first appearance.
+    """
+
+    def __init__(self):
+        self.codes = {}
+
+    def encode(self, value):
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.codes)
+        return code
+
+    def values(self):
+        return np.array(list(self.codes), dtype=str)
+
+
+def microseconds(date):
+    """
+    A datetime as microseconds since 1970-01-01 UTC, MISSING_DATE if None.
+    """
+    return MISSING_DATE if date is None else (date - EPOCH) // MICROSECOND
+
+
+def snapshot_arrays(invoices, chunk_size=5000):
+    """
+    The snapshot columns of the invoices, read in id order with one pass over the table.
+
+    Returns:
+        dict: Archive entry name -> numpy array.
+    """
+    ids, days, dates, cents = array('q'), array('i'), array('q'), array('q')
+    opens = array('b')
+    unit_prices, quantities, pay_dates, accuracies = array('q'), array('q'), array('q'), array('q')
+    references, reference_keys = [], []
+    dictionaries = {field: Dictionary() for field in DICTIONARY_FIELDS}
+    codes = {field: array('i') for field in DICTIONARY_FIELDS}
+
+    rows = invoices.order_by('id').values_list(*SNAPSHOT_FIELDS).iterator(chunk_size=chunk_size)
+    for (
+        id_, reference, reference_key, date, date_day, value_cents, open,
+        unit_price, quantity, pay_date, accuracy, *encoded,
+    ) in rows:
+        ids.append(id_)
+        references.append(reference)
+        reference_keys.append(reference_key)
+        dates.append(microseconds(date))
+        days.append(MISSING_DAY if date_day is None else date_day)
+        cents.append(MISSING_CENTS if value_cents is None else value_cents)
+        opens.append(open)
+        unit_prices.append(int(unit_price.scaleb(2)))
+        quantities.append(quantity)
+        pay_dates.append(microseconds(pay_date))
+        accuracies.append(accuracy)
+        for field, value in zip(DICTIONARY_FIELDS, encoded):
+            codes[field].append(dictionaries[field].encode(value))
+
+    arrays = {
+        'id': np.frombuffer(ids, dtype=np.int64),
+        'reference': np.array(references, dtype=str),
+        'reference_key': np.array(reference_keys, dtype=str),
+        'date': np.frombuffer(dates, dtype=np.int64),
+        'date_day': np.frombuffer(days, dtype=np.int32),
+        'value_cents': np.frombuffer(cents, dtype=np.int64),
+        'open': np.frombuffer(opens, dtype=np.int8).astype(bool),
+        'unit_price_cents': np.frombuffer(unit_prices, dtype=np.int64),
+        'quantity': np.frombuffer(quantities, dtype=np.int64),
+        'pay_date': np.frombuffer(pay_dates, dtype=np.int64),
+        'accuracy': np.frombuffer(accuracies, dtype=np.int64),
+    }
+    for field in DICTIONARY_FIELDS:
+        arrays[f'{field}.codes'] = np.frombuffer(codes[field], dtype=np.int32)
+        arrays[f'{field}.values'] = dictionaries[field].values()
+    return arrays
+
+
+def write_snapshot(path, invoices=None, chunk_size=5000):
+    """
+    Write a snapshot of the invoices (all of them by default) to path.
+
+    The rows and the data version are read in one transaction, so the
+    snapshot is exactly the data of that version. The file is written under
+    a temporary name and moved into place.
+
+    Returns:
+        dict: The metadata of the snapshot.
+    """
+    if invoices is None:
+        invoices = Invoice.objects.all()
+    with transaction.atomic():
+        version = current_data_version()[0]
+        arrays = snapshot_arrays(invoices, chunk_size)
+    meta = {
+        'format': SNAPSHOT_FORMAT,
+        'rows': len(arrays['id']),
+        'data_version': version,
+        'created_at': django_timezone.now().isoformat(),
+    }
+    arrays['__meta__'] = np.array(json.dumps(meta))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.npz.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return meta
+
+
+def read_snapshot(path):
+    """
+    Load the arrays of a snapshot.
+
+    Returns:
+        tuple: (meta, arrays), the metadata dict and archive entry name -> numpy array.
+    """
+    with np.load(path, allow_pickle=False) as archive:
+        arrays = {name: archive[name] for name in archive.files}
+    meta = json.loads(str(arrays.pop('__meta__')))
+    if meta.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"{path} is not an invoice snapshot of format {SNAPSHOT_FORMAT}")
+    return meta, arrays
+
+
+def utc_dates(microseconds):
+    return pd.Series(microseconds.view('datetime64[us]')).dt.tz_localize('UTC')
+
+
+def snapshot_frame(path):
+    """
+    Load a snapshot as a pandas DataFrame.
+
+    Dictionary-encoded columns become Categoricals over the stored codes,
+    date and pay_date UTC datetime columns over the stored integers,
+    date_day and value_cents nullable integers, and value and unit_price
+    the amounts as floats.
+    The metadata is in frame.attrs['snapshot'].
+    """
+    meta, arrays = read_snapshot(path)
+    cents = arrays['value_cents']
+    missing_cents = cents == MISSING_CENTS
+    columns = {
+        'id': arrays['id'],
+        'reference': arrays['reference'],
+        'reference_key': arrays['reference_key'],
+        'date': utc_dates(arrays['date']),
+        'date_day': pd.arrays.IntegerArray(arrays['date_day'], arrays['date_day'] == MISSING_DAY),
+        'value_cents': pd.arrays.IntegerArray(cents, missing_cents),
+        'value': np.where(missing_cents, np.nan, cents / 100),
+        'open': arrays['open'],
+        'unit_price_cents': arrays['unit_price_cents'],
+        'unit_price': arrays['unit_price_cents'] / 100,
+        'quantity': arrays['quantity'],
+        'pay_date': utc_dates(arrays['pay_date']),
+        'accuracy': arrays['accuracy'],
+    }
+    for field in DICTIONARY_FIELDS:
+        columns[field] = pd.Categorical.from_codes(arrays[f'{field}.codes'], categories=arrays[f'{field}.values'])
+    frame = pd.DataFrame(columns)
+    frame.attrs['snapshot'] = meta
+    return frame
+
+
+def with_none(frame):
+    """
+    The frame as objects, with None for the missing values.
+    """
+    frame = frame.astype(object)
+    return frame.where(frame.notna(), None)
+
+
+def matching_frame(frame):
+    """
+    The columns compared by the matching rules (see invoicesimilar), with the
+    precomputed search keys so the rules do not normalize the invoices again.
+    Dates are naive UTC.
+    """
+    return with_none(pd.DataFrame({
+        REFERENCE: frame['reference'],
+        DATE: frame['date'].dt.tz_localize(None),
+        VALUE: frame['value'],
+        VENDOR: frame['vendor'],
+        VENDOR_KEY: frame['vendor_key'],
+        REFERENCE_KEY: frame['reference_key'],
+        DATE_DAY: frame['date_day'],
+        VALUE_CENTS: frame['value_cents'],
+    }))
+
+
+def output_data_rows(frame):
+    """
+    The invoices as rows of OutputData.csv (see calc_similarity), with its
+    column names and its M/D/YYYY dates.
+    """
+    dates = frame['date']
+    days = dates.dt.month.astype('string') + '/' + dates.dt.day.astype('string') + '/' + dates.dt.year.astype('string')
+    values = [None if pd.isna(cents) else str(Decimal(int(cents)).scaleb(-2)) for cents in frame['value_cents']]
+    return with_none(pd.DataFrame({
+        'Group Pattern': frame['pattern'],
+        'Confidence': frame['confidence'],
+        'Vendor': frame['vendor'],
+        'value': values,
+        'Date': days,
+        'Group UUID': frame['group_id'],
+        'Region': frame['region'],
+        'Description': frame['description'],
+        'Payment Method': frame['payment_method'],
+        'Special Intructions': frame['special_instructions'].astype(object).fillna(''),
+        'reference': frame['reference'],
+    })).to_dict('records')
+
+
+def snapshot_path(version):
+    return os.path.join(settings.SNAPSHOT_DIR, f'invoices-v{version}-f{SNAPSHOT_FORMAT}.npz')
+
+
+def get_snapshot():
+    """
+    The path of the snapshot of the current data version, written on first use.
+
+    Snapshots of older versions or formats are removed.
+    """
+    version = current_data_version()[0]
+    path = snapshot_path(version)
+    if not os.path.exists(path):
+        write_snapshot(path)
+        for old in glob.glob(os.path.join(settings.SNAPSHOT_DIR, 'invoices-v*.npz')):
+            if old != path:
+                try:
+                    os.unlink(old)
+                except FileNotFoundError:
+                    pass
+    return path
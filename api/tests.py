@@ -1,3 +1,1131 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import re
+import tempfile
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+import numpy as np
+from django.core.cache import caches
+from django.db import connection, models
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone as django_timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from .clustering import UnionFind, cluster
+from .facets import get_facet_index, invalidate_facets
+from .incremental import candidates, invoice_record
+from .ingest import batched, bulk_ingest
+from .management.commands.add_data import Command as AddData
+from .management.commands.calc_similarity import Command as CalcSimilarity
+from .matching import (
+    DATE, REFERENCE, VALUE, VENDOR, MISSING, Corpus, day_numbers, digit_key, get_match_patterns, is_transposition,
+    iter_matches, match_date_window, match_value_index, match_window, scan_patterns, similar_date, similar_value,
+    tag_patterns, value_cents,
+)
+from .groups import rebuild_groups
+from .kpis import get_kpis
+from .models import RANDOM_KEY_RANGE, Invoice, InvoiceGroup
+from .pagination import RandomSample
+from .versioning import bump_data_version
+from .qgram import QGramIndex, _loaded as loaded_qgram_indexes, get_invoice_index, index_path, qgrams
+from .serializers import InvoiceSerializer, invoice_rows
+from .similarity import InvoiceSearch, invoice_from_row, stringify
+from .snapshot import matching_frame, snapshot_frame, write_snapshot
 
+# A plan step reading a whole table without an index, e.g. "SCAN api_invoice".
+# Scans of a (covering) index or of a subquery are not table scans.
+TABLE_SCAN = re.compile(r'^SCAN (?!subquery\b)[A-Za-z_]\w*$')
 
+# (reference, date, value, vendor) of invoices covering every matching rule,
+# as read from the input CSV of invoicesimilar.
+MATCHING_ROWS = [
+    ('INV-100', '2024-01-10', 1000.0, 'Acme Corp'),
+    ('INV-100', '2024-01-10', 1000.0, 'Acme Corp'),     # exact match of 0
+    ('INV-100', '2024-01-10', 1000.0, 'Acme Corp.'),    # similar vendor
+    ('INV-1000', '2024-01-10', 1000.0, 'Acme Corp'),    # similar reference
+    ('INV-100', '2024-01-15', 1000.0, 'Acme Corp'),     # similar date
+    ('INV-100', '2024-01-30', 1000.0, 'Acme Corp'),     # too far from every date
+    ('INV-100', '2024-01-10', 1050.0, 'Acme Corp'),     # similar value
+    ('T-1', '2024-02-01', 2023.0, 'Beta'),
+    ('T-1', '2024-02-01', 2203.0, 'Beta'),              # transposed digits
+    ('T-1', '2024-02-01', 2400.0, 'Beta'),              # neither close nor transposed
+    ('INV-100', float('nan'), 1000.0, 'Acme Corp'),     # missing date
+    ('X-9', '2024-03-01', 50.0, 'Gamma'),
+]
+
+
+def matching_records(rows=MATCHING_ROWS):
+    return [{REFERENCE: reference, DATE: date, VALUE: value, VENDOR: vendor} for reference, date, value, vendor in rows]
+
+
+def pairwise_patterns(records):
+    """
+    The patterns of every record, from get_match_patterns on every pair.
+    """
+    found = [set() for _ in records]
+    for i in range(len(records)):
+        for j in range(i + 1, len(records)):
+            for pattern in get_match_patterns(records[i], records[j]):
+                found[i].add(pattern)
+                found[j].add(pattern)
+    return found
+
+
+class QueryPlanTests(TestCase):
+    """
+    The hot queries of the API must be answered through an index.
+
+    Each test runs an endpoint (or a query it builds) with the filters the
+    dashboard sends, captures the SQL, and fails if EXPLAIN QUERY PLAN shows
+    a full scan of a table.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        for k in range(6):
+            Invoice.objects.create(
+                reference=f'INV-{k % 3}',
+                date=datetime(2025, 1, 1 + k, tzinfo=timezone.utc),
+                unit_price=Decimal('100.00'),
+                quantity=1,
+                value=Decimal('100.00') + k % 2,
+                vendor='Acme Corp' if k % 2 else 'Globex',
+                pattern='unique',
+                confidence='Low',
+                open=bool(k % 2),
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        # Cached snapshots would hide the queries behind them, or outlive the
+        # test data: the test transactions never commit, so writes do not
+        # reach them.
+        for cache in caches.all():
+            cache.clear()
+        invalidate_facets()
+
+    def table_scans(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = cursor.fetchall()
+        return [row[-1] for row in plan if TABLE_SCAN.match(row[-1])]
+
+    def assertIndexed(self, path, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, params)
+            # Streamed responses run their queries while they are read.
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+        self.assertEqual(response.status_code, 200, content)
+        for query in queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            with self.subTest(path=path, params=params, sql=query['sql']):
+                self.assertEqual(self.table_scans(query['sql']), [])
+
+    def test_invoice_list_filters(self):
+        for params in [
+            {'reference': 'INV-1'},
+            {'vendor': ['Acme Corp', 'Globex']},
+            {'vendor_match': 'acme corp'},
+            {'pattern': 'unique'},
+            {'open': 'true'},
+            {'group_id': 'x'},
+            {'start_date': '2025-01-02'},
+            {'start_date': '2025-01-02', 'end_date': '2025-01-04'},
+            {'vendor': 'Acme Corp', 'start_date': '2025-01-02'},
+            {'pattern': 'unique', 'end_date': '2025-01-04'},
+            {'open': 'true', 'start_date': '2025-01-02'},
+        ]:
+            self.assertIndexed('/api/invoices/', params)
+
+    def test_invoice_list_cursor_and_random(self):
+        self.assertIndexed('/api/invoices/', {'pagination': 'cursor', 'count': 'true'})
+        self.assertIndexed('/api/invoices/', {'pagination': 'cursor', 'vendor': 'Globex'})
+        self.assertIndexed('/api/invoices/', {'random': 'true', 'seed': '1'})
+        self.assertIndexed('/api/invoices/', {'random': 'true', 'seed': '1', 'open': 'false'})
+
+    def test_kpis(self):
+        self.assertIndexed('/api/kpis/')
+
+    def test_metadata(self):
+        # The first request builds the facet index with one pass over the
+        # invoices, by design; the next ones are answered from memory, after
+        # reading the data version.
+        self.client.get('/api/metadata/')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/metadata/', {'reference_prefix': 'INV-', 'limit': 2})
+        self.assertEqual(response.data['reference_values'], ['INV-0', 'INV-1'])
+
+    def test_groups(self):
+        self.assertIndexed('/api/groups/')
+        self.assertIndexed('/api/groups/', {'pattern': 'unique', 'ordering': '-amount_overpaid'})
+        self.assertIndexed('/api/groups/', {'open': 'true', 'ordering': 'date'})
+        self.assertIndexed('/api/groups/', {'open': 'false'})
+
+    def test_exports(self):
+        self.assertIndexed('/api/invoices/export/', {'vendor': 'Globex', 'start_date': '2025-01-02'})
+        self.assertIndexed('/api/groups/export/', {'pattern': 'unique', 'ordering': '-amount_overpaid'})
+
+    def test_incremental_candidates(self):
+        invoice = Invoice.objects.first()
+        sql, params = candidates(invoice).query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        self.assertEqual([step for step in plan if TABLE_SCAN.match(step)], [])
+
+
+class ConditionalGetTests(TestCase):
+    """
+    Polls of unchanged data are answered with 304 from the data version alone.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.invoice = Invoice.objects.create(
+            reference='INV-1', date=datetime(2025, 1, 1, tzinfo=timezone.utc), unit_price=Decimal('10.00'),
+            quantity=1, value=Decimal('10.00'), vendor='Acme Corp', pattern='unique', confidence='Low',
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        for cache in caches.all():
+            cache.clear()
+        invalidate_facets()
+
+    def test_not_modified(self):
+        for path in ['/api/invoices/', '/api/kpis/', '/api/metadata/', '/api/groups/']:
+            with self.subTest(path=path):
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Last-Modified', response)
+                # Only the data version is read.
+                with self.assertNumQueries(1):
+                    response = self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+
+    def test_changes_bump_the_version(self):
+        etag = self.client.get('/api/kpis/')['ETag']
+        self.invoice.open = False
+        self.invoice.save()
+        response = self.client.get('/api/kpis/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_bulk_delete_bumps_the_version_once(self):
+        Invoice.objects.bulk_create([
+            Invoice(reference=f'INV-{k}', date=datetime(2025, 2, 1, tzinfo=timezone.utc), unit_price=Decimal('5.00'),
+                    quantity=1, value=Decimal('5.00'), vendor=f'Vendor {k}', pattern='unique', confidence='Low')
+            for k in range(2, 22)
+        ])
+        index = get_facet_index()
+        etag = self.client.get('/api/kpis/')['ETag']
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Invoice.objects.exclude(pk=self.invoice.pk).delete()
+        bumps = [query for query in queries if query['sql'].startswith('UPDATE "api_dataversion"')]
+        self.assertEqual(len(bumps), 1)
+        self.assertEqual(len(callbacks), 1)
+        self.assertIs(get_facet_index(), index)
+        self.assertEqual(index.facet('vendor'), {'Acme Corp': 1})
+        self.assertNotEqual(self.client.get('/api/kpis/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_unseeded_random_has_no_etag(self):
+        self.assertNotIn('ETag', self.client.get('/api/invoices/', {'random': 'true'}))
+        self.assertIn('ETag', self.client.get('/api/invoices/', {'random': 'true', 'seed': '1'}))
+
+
+class ResponseCacheTests(TestCase):
+    """
+    Identical requests are served from the response cache until the data changes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.invoice = Invoice.objects.create(
+            reference='INV-1', date=datetime(2025, 1, 1, tzinfo=timezone.utc), unit_price=Decimal('10.00'),
+            quantity=1, value=Decimal('10.00'), vendor='Acme Corp', pattern='unique', confidence='Low',
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        for cache in caches.all():
+            cache.clear()
+
+    def test_hit_after_miss(self):
+        for path in ['/api/invoices/', '/api/groups/']:
+            with self.subTest(path=path):
+                first = self.client.get(path, {'vendor': 'Acme Corp', 'pattern': 'unique'})
+                self.assertEqual(first['X-Cache'], 'MISS')
+                # Same parameters in another order: only the data version is read.
+                with self.assertNumQueries(1):
+                    second = self.client.get(path, {'pattern': 'unique', 'vendor': 'Acme Corp'})
+                self.assertEqual(second['X-Cache'], 'HIT')
+                self.assertEqual(second.content, first.content)
+
+    def test_change_misses(self):
+        self.client.get('/api/invoices/')
+        self.invoice.vendor = 'Globex'
+        self.invoice.save()
+        response = self.client.get('/api/invoices/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['vendor'], 'Globex')
+
+
+class FastSerializationTests(TestCase):
+    """
+    The values_list() fast path renders exactly the JSON of InvoiceSerializer.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        rows = [
+            ('INV-1', datetime(2025, 1, 1, tzinfo=timezone.utc), '1091.90', 'Acme Corp', None, None),
+            ('INV-2', datetime(2025, 3, 9, 23, 30, 5, 120, tzinfo=timezone.utc), '0.10', 'Café Ñandú\u2028S.A.',
+             datetime(2025, 4, 1, 8, tzinfo=timezone.utc), 'Pagar en dólares'),
+            ('INV-3', None, '12345678.99', 'Globex \u2029 "quoted"', None, ''),
+        ]
+        for reference, date, value, vendor, pay_date, special_instructions in rows:
+            Invoice.objects.create(
+                reference=reference, date=date, unit_price=Decimal(value), quantity=3, value=Decimal(value),
+                vendor=vendor, pattern='Similar Value', confidence='High', group_id='g',
+                pay_date=pay_date, special_instructions=special_instructions,
+            )
+
+    def assertSameJSON(self):
+        invoices = Invoice.objects.order_by('id')
+        expected = JSONRenderer().render(InvoiceSerializer(invoices, many=True).data)
+        rendered = JSONRenderer().render(invoice_rows.to_representation(invoice_rows.queryset(invoices)))
+        self.assertEqual(rendered, expected)
+
+    def test_same_json(self):
+        self.assertSameJSON()
+
+    def test_same_json_in_another_time_zone(self):
+        with django_timezone.override('America/Bogota'):
+            self.assertSameJSON()
+
+
+class ExportTests(TestCase):
+    """
+    The exports stream every matching row, as the list endpoints render them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        for k in range(5):
+            Invoice.objects.create(
+                reference=f'INV-{k}', date=datetime(2025, 1, 1 + k, tzinfo=timezone.utc), unit_price=Decimal('10.00'),
+                quantity=1, value=Decimal('10.00'), vendor='Acme Corp' if k % 2 else 'Globex', pattern='unique',
+                confidence='Low', open=bool(k % 2),
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def content(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_invoices_ndjson(self):
+        response = self.client.get('/api/invoices/export/', {'vendor': 'Globex', 'chunk_size': 2})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        expected = InvoiceSerializer(Invoice.objects.filter(vendor='Globex').order_by('id'), many=True).data
+        self.assertEqual(rows, json.loads(JSONRenderer().render(expected)))
+
+    def test_groups_csv(self):
+        response = self.client.get('/api/groups/export/', {'file_format': 'csv', 'open': 'true', 'ordering': 'date'})
+        rows = list(csv.DictReader(io.StringIO(self.content(response))))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual([row['open'] for row in rows], ['true', 'true'])
+        self.assertLess(rows[0]['date'], rows[1]['date'])
+
+    def test_invalid_options(self):
+        self.assertEqual(self.client.get('/api/invoices/export/', {'file_format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/groups/export/', {'chunk_size': 0}).status_code, 400)
+
+
+class SnapshotTests(TestCase):
+    """
+    A columnar snapshot loads back the values of the invoices.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Invoice.objects.create(
+            reference='INV-1', date=datetime(2025, 1, 1, 8, 30, tzinfo=timezone.utc), unit_price=Decimal('3.35'),
+            quantity=3, value=Decimal('10.05'), vendor='Acme Corp', pattern='unique', confidence='Low',
+            special_instructions='Net 30', pay_date=datetime(2025, 2, 1, 12, tzinfo=timezone.utc), accuracy=87,
+        )
+        Invoice.objects.create(
+            reference='INV-2', date=None, unit_price=Decimal('0.10'), quantity=1, value=Decimal('0.10'),
+            vendor='Acme Corp', pattern='Similar Value', confidence='High', open=False,
+        )
+
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'invoices.npz')
+            self.assertEqual(write_snapshot(path)['rows'], 2)
+            frame = snapshot_frame(path)
+
+        self.assertEqual(list(frame['reference']), ['INV-1', 'INV-2'])
+        self.assertEqual(list(frame['vendor'].cat.categories), ['Acme Corp'])
+        self.assertEqual(frame['date'][0], datetime(2025, 1, 1, 8, 30, tzinfo=timezone.utc))
+        self.assertTrue(frame['date'].isna()[1])
+        self.assertEqual(list(frame['value_cents']), [1005, 10])
+        self.assertEqual(list(frame['open']), [True, False])
+        self.assertTrue(frame['special_instructions'].isna()[1])
+        self.assertEqual(list(frame['unit_price_cents']), [335, 10])
+        self.assertEqual(list(frame['unit_price']), [3.35, 0.1])
+        self.assertEqual(list(frame['quantity']), [3, 1])
+        self.assertEqual(frame['pay_date'][0], datetime(2025, 2, 1, 12, tzinfo=timezone.utc))
+        self.assertTrue(frame['pay_date'].isna()[1])
+        self.assertEqual(list(frame['accuracy']), [87, 0])
+        self.assertEqual(
+            {column: str(dtype) for column, dtype in frame.dtypes.items() if column in ('unit_price_cents', 'quantity', 'accuracy', 'pay_date')},
+            {'unit_price_cents': 'int64', 'quantity': 'int64', 'pay_date': 'datetime64[us, UTC]', 'accuracy': 'int64'},
+        )
+
+        # The matching rules read the same search keys as from the database.
+        records = matching_frame(frame).to_dict('records')
+        for record, invoice in zip(records, Invoice.objects.order_by('id')):
+            expected = invoice_record(invoice)
+            for key in ['vendor_key', 'reference_key', 'date_day', 'value_cents']:
+                self.assertEqual(record[key], expected[key])
+
+
+class MatchingEngineTests(SimpleTestCase):
+    """
+    The blocking engine finds the same matches as comparing every pair of invoices.
+    """
+
+    def test_scan_equals_pairwise_loop(self):
+        records = matching_records()
+        found = scan_patterns(records, chunk_size=2)
+        self.assertEqual(found, pairwise_patterns(records))
+        self.assertEqual(found[11], set())
+        self.assertEqual(found[5], set())
+
+    def test_workers_give_the_serial_result(self):
+        records = matching_records()
+        self.assertEqual(scan_patterns(records, workers=2, chunk_size=1), scan_patterns(records))
+        self.assertEqual(list(iter_matches(records, workers=2, chunk_size=1)), list(iter_matches(records)))
+
+    def test_one_pass_gives_patterns_and_matches(self):
+        records = matching_records()
+        found = [set() for _ in records]
+        matches = list(tag_patterns(records, iter_matches(records), found))
+        self.assertEqual(matches, list(iter_matches(records)))
+        self.assertEqual(found, scan_patterns(records))
+
+
+def rule_pairs(records, rule, **options):
+    return {(i, j) for i in range(len(records)) for j in range(i + 1, len(records)) if rule(records[i], records[j], **options)}
+
+
+class DateWindowTests(SimpleTestCase):
+    """
+    Similar dates are found by a window over the sorted day numbers of each block.
+    """
+
+    def test_day_numbers(self):
+        days = day_numbers(matching_records([
+            ('A', '1970-01-02', 1.0, 'V'), ('A', '2024-01-10 23:30:00', 1.0, 'V'), ('A', '1/10/2024', 1.0, 'V'),
+            ('A', float('nan'), 1.0, 'V'), ('A', 'not a date', 1.0, 'V'),
+        ]))
+        self.assertEqual(days.tolist(), [1, 19732, 19732, MISSING, MISSING])
+
+    def test_window(self):
+        column = np.array([0, 7, 8, 20, MISSING, 27])
+        self.assertEqual(sorted(match_window(column, 7, [[0, 1, 2, 3, 4, 5]])), [(0, 1), (1, 2), (3, 5)])
+        self.assertEqual(match_window(column, 7, [[0, 2], [1, 3]]), [])
+        # Neighbours in sorted order are enough to flag every record with a match.
+        self.assertEqual(sorted(match_window(column, 7, [[0, 1, 2, 3, 4, 5]], flag_only=True)), [(0, 1), (1, 2), (3, 5)])
+
+    def test_window_equals_the_rule(self):
+        offsets = [0, 3, 7, 8, 14, 15, 30, None, 1, 22]
+        records = matching_records([
+            ('INV-1', None if offset is None else str(date(2024, 1, 1) + timedelta(days=offset)), 10.0, 'Acme')
+            for offset in offsets
+        ])
+        for max_days in [0, 1, 7, 14]:
+            with self.subTest(max_days=max_days):
+                found = match_date_window(Corpus(records, max_days=max_days), similar_date, [list(range(len(records)))])
+                self.assertEqual(set(found), rule_pairs(records, similar_date, max_days=max_days))
+                self.assertEqual(len(found), len(set(found)))
+
+
+class ValueIndexTests(SimpleTestCase):
+    """
+    Similar values are found by a window over the sorted amounts and by hashing their digits.
+    """
+
+    def test_value_cents(self):
+        cents = value_cents(matching_records([
+            ('A', '2024-01-01', value, 'V') for value in [10.05, '2023.1', 0.1, float('nan'), 'n/a', -3.5]
+        ]))
+        self.assertEqual(cents.tolist(), [1005, 202310, 10, MISSING, MISSING, -350])
+
+    def test_transposition(self):
+        self.assertTrue(is_transposition(202300, 220300))
+        self.assertTrue(is_transposition(12345, 12354))
+        self.assertTrue(is_transposition(-12345, 12354))
+        self.assertFalse(is_transposition(12345, 12345))
+        # Two swaps, a swap of digits that are not next to each other, and
+        # amounts of different lengths.
+        self.assertFalse(is_transposition(12345, 21354))
+        self.assertFalse(is_transposition(123450, 523410))
+        self.assertFalse(is_transposition(10000, 100000))
+        self.assertEqual(digit_key(220300), digit_key(202300))
+
+    def test_distant_swap_is_not_a_similar_value(self):
+        first, second = matching_records([('INV-1', '2024-01-01', value, 'Acme') for value in [1234.50, 5234.10]])
+        self.assertFalse(similar_value(first, second))
+
+    def test_index_equals_the_rule(self):
+        values = [1000.0, 1050.0, 1100.0, 1100.01, 2023.0, 2203.0, 2032.0, 3202.0, 2320.0, float('nan'), 'n/a', 50.0]
+        records = matching_records([('INV-1', '2024-01-01', value, 'Acme') for value in values])
+        for tolerance in [0.5, 100, 1000]:
+            with self.subTest(tolerance=tolerance):
+                found = match_value_index(Corpus(records, tolerance=tolerance), similar_value, [list(range(len(records)))])
+                self.assertEqual(set(found), rule_pairs(records, similar_value, tolerance=tolerance))
+                self.assertEqual(len(found), len(set(found)))
+
+
+class ClusteringTests(SimpleTestCase):
+    """
+    Matched pairs are grouped transitively, and each group summarized.
+    """
+
+    def test_union_find(self):
+        sets = UnionFind(5)
+        sets.union(0, 1)
+        sets.union(3, 1)
+        self.assertEqual(sets.find(3), sets.find(0))
+        self.assertNotEqual(sets.find(2), sets.find(0))
+        self.assertEqual(sets.size[sets.find(0)], 3)
+        self.assertEqual(sets.union(0, 3), sets.find(1))
+        self.assertEqual(sets.size[sets.find(0)], 3)
+
+    def test_groups_are_transitive_and_numbered_in_order(self):
+        group_ids, groups = cluster(6, [(4, 5, 'similar date'), (1, 4, 'similar date'), (0, 2, 'exact match')])
+        self.assertEqual(list(group_ids), [0, 1, 0, 2, 1, 1])
+        self.assertEqual(groups, [
+            {'group_id': 0, 'size': 2, 'pattern': 'Exact Match', 'confidence': 'High'},
+            {'group_id': 1, 'size': 3, 'pattern': 'Similar Date', 'confidence': 'Medium'},
+            {'group_id': 2, 'size': 1, 'pattern': 'unique', 'confidence': 'Low'},
+        ])
+
+    def test_merged_groups_keep_the_patterns_of_both(self):
+        group_ids, groups = cluster(4, [(0, 1, 'similar value'), (2, 3, 'similar vendor'), (1, 2, 'similar value')])
+        self.assertEqual(list(group_ids), [0, 0, 0, 0])
+        self.assertEqual((groups[0]['pattern'], groups[0]['confidence']), ('Multiple', 'High'))
+
+    def test_clusters_of_the_engine(self):
+        records = matching_records()
+        group_ids, groups = cluster(len(records), iter_matches(records))
+        # The Acme invoices matching the first one join its group, the
+        # transposed values form another, and the rest stand alone.
+        self.assertEqual(list(group_ids), [0, 0, 0, 0, 0, 1, 0, 2, 2, 3, 4, 5])
+        self.assertEqual([group['pattern'] for group in groups], ['Multiple', 'unique', 'Similar Value', 'unique', 'unique', 'unique'])
+
+    def test_add_data_groups_are_new_on_every_run(self):
+        records = matching_records(MATCHING_ROWS[7:10])
+        group_ids, groups = cluster(len(records), iter_matches(records))
+        first, second = [[invoice.group_id for invoice in AddData().iter_invoices(records, group_ids, groups)] for _ in range(2)]
+        self.assertEqual(first[0], first[1])
+        self.assertNotEqual(first[0], first[2])
+        self.assertFalse(set(first) & set(second))
+
+
+def output_data_row(reference, vendor, value='100.0', date='1/2/2025'):
+    """
+    A row of OutputData.csv, the corpus of calc_similarity.
+    """
+    return {
+        'reference': reference, 'Vendor': vendor, 'value': value, 'Date': date, 'Region': 'East',
+        'Description': 'Consulting', 'Payment Method': 'Cash', 'Special Intructions': '',
+    }
+
+
+class SimilaritySearchTests(SimpleTestCase):
+    """
+    The most similar invoice of calc_similarity, with and without the q-gram shortlist.
+    """
+
+    def command(self, rows, **options):
+        command = CalcSimilarity()
+        command.search = InvoiceSearch(rows)
+        for name, value in options.items():
+            setattr(command, name, value)
+        return command
+
+    def test_shortlist_finds_the_best_match(self):
+        rows = [output_data_row('Inv-1', 'Acme Corporation'), output_data_row('Inv-2', 'Pyramid Systems')]
+        query = CalcSimilarity.invoice1 | {'vendor': 'Pyramid Systemz', 'reference': 'Inv-2'}
+        best = self.command(rows).find_most_similar(query)
+        self.assertEqual(best[1]['reference'], 'Inv-2')
+        self.assertEqual(self.command(rows, shortlist=True).find_most_similar(query), best)
+
+    def test_workers_give_the_serial_result(self):
+        rows = [output_data_row(f'Inv-{k}', vendor) for k, vendor in enumerate(['Acme', 'Acme Corp', 'Pyramid', 'Beta'] * 3)]
+        queries = [CalcSimilarity.invoice1, CalcSimilarity.invoice2, CalcSimilarity.invoice3]
+        search = InvoiceSearch(rows)
+        self.assertEqual(search.top_k(queries, k=3, workers=2), search.top_k(queries, k=3))
+
+    def test_scores_are_those_of_indel_distance(self):
+        rows = [output_data_row(f'Inv-{k}', vendor) for k, vendor in enumerate(['Acme', 'Acme Corp', 'Pyramid', 'Beta'])]
+        command = CalcSimilarity()
+        query = CalcSimilarity.invoice1
+        expected = sorted(
+            ((command.indel_distance(stringify(query), stringify(invoice_from_row(row))), row) for row in rows),
+            key=lambda match: match[0], reverse=True,
+        )
+        search = InvoiceSearch(rows)
+        for matches in [search.top_k([query], k=4)[0], search.top_k([query], k=4, shortlist=True)[0][:1], [search.best(query)]]:
+            for (similarity, row), (expected_similarity, expected_row) in zip(matches, expected):
+                self.assertIs(type(similarity), float)
+                self.assertEqual((similarity, row), (expected_similarity, expected_row))
+
+    def test_empty_shortlist_falls_back_to_the_whole_corpus(self):
+        rows = [output_data_row('Inv-1', 'Acme Corporation')]
+        query = CalcSimilarity.invoice1 | {'vendor': 'Zq', 'reference': 'Wx'}
+        command = self.command(rows, shortlist=True)
+        self.assertEqual(command.get_search().top_k([query], shortlist=True), [[]])
+        self.assertEqual(command.find_most_similar(query)[1]['reference'], 'Inv-1')
+
+    def test_empty_corpus(self):
+        command = self.command([], shortlist=True)
+        self.assertIsNone(command.find_most_similar(CalcSimilarity.invoice3))
+        out = io.StringIO()
+        with redirect_stdout(out):
+            command.find_most_similar_data(CalcSimilarity.invoice3)
+        self.assertEqual(out.getvalue(), 'No similar invoice found for Inv-801\n')
+
+
+def create_invoice(reference='INV-1', day=1, value='10.00', vendor='Acme Corp', **fields):
+    """
+    Save an invoice of January 2025; without a group_id it is matched and grouped.
+    """
+    fields.setdefault('pattern', 'unique')
+    fields.setdefault('confidence', 'Low')
+    return Invoice.objects.create(
+        reference=reference, date=datetime(2025, 1, day, tzinfo=timezone.utc) if day else None,
+        unit_price=Decimal(value), quantity=1, value=Decimal(value), vendor=vendor, **fields,
+    )
+
+
+class IncrementalMatchingTests(TestCase):
+    """
+    New invoices join the group of the invoices they match, merging groups when needed.
+    """
+
+    def setUp(self):
+        invalidate_facets()
+
+    def test_unmatched_invoice_starts_a_group(self):
+        first = create_invoice()
+        second = create_invoice('INV-2', value='99.00', vendor='Globex')
+        self.assertTrue(first.group_id)
+        self.assertNotEqual(first.group_id, second.group_id)
+        self.assertEqual((second.pattern, second.confidence), ('unique', 'Low'))
+
+    def test_match_joins_the_group_and_tags_both_invoices(self):
+        first = create_invoice()
+        second = create_invoice(day=4)
+        first.refresh_from_db()
+        self.assertEqual(second.group_id, first.group_id)
+        self.assertEqual((second.pattern, second.confidence), ('Similar Date', 'Medium'))
+        self.assertEqual((first.pattern, first.confidence), ('Similar Date', 'Medium'))
+
+    def test_match_with_several_groups_merges_them(self):
+        first = create_invoice(group_id='g1')
+        second = create_invoice(group_id='g2')
+        third = create_invoice()
+        self.assertEqual(third.group_id, 'g1')
+        self.assertEqual(third.pattern, 'Exact Match')
+        self.assertEqual(set(Invoice.objects.values_list('group_id', flat=True)), {'g1'})
+        self.assertEqual(
+            list(Invoice.objects.filter(pk__in=[first.pk, second.pk]).values_list('pattern', flat=True)),
+            ['Exact Match', 'Exact Match'],
+        )
+
+    def test_batch_invoices_match_each_other(self):
+        first, second, third = Invoice.objects.bulk_create([
+            Invoice(reference='INV-1', date=datetime(2025, 1, 1, tzinfo=timezone.utc), unit_price=Decimal('10.00'),
+                    quantity=1, value=value, vendor='Acme Corp', pattern='unique', confidence='Low')
+            for value in [Decimal('10.00'), Decimal('60.00'), Decimal('900.00')]
+        ])
+        self.assertEqual(first.group_id, second.group_id)
+        self.assertNotEqual(first.group_id, third.group_id)
+        self.assertEqual(second.pattern, 'Similar Value')
+
+    def test_facet_index_follows_matches(self):
+        create_invoice()
+        index = get_facet_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            create_invoice(day=4)
+        self.assertIs(get_facet_index(), index)
+        self.assertEqual(index.facet('pattern'), {'Similar Date': 2})
+        with self.captureOnCommitCallbacks(execute=True):
+            Invoice.objects.bulk_create([
+                Invoice(reference=reference, date=datetime(2025, 2, 1, tzinfo=timezone.utc), unit_price=Decimal('5.00'),
+                        quantity=1, value=Decimal('5.00'), vendor='Globex', pattern='unique', confidence='Low')
+                for reference in ['G-1', 'G-1', 'H-7']
+            ])
+        self.assertIs(get_facet_index(), index)
+        self.assertEqual(index.facet('pattern'), {'Exact Match': 2, 'Similar Date': 2, 'unique': 1})
+
+
+class QGramIndexTests(SimpleTestCase):
+    """
+    Lookups only score the strings sharing enough q-grams with the query.
+    """
+
+    def setUp(self):
+        self.index = QGramIndex()
+        for vendor in ['Acme Corp', 'ACME Corp.', 'Acme Corporation', 'Globex', 'Initech', 'Ac']:
+            self.index.add(vendor)
+
+    def test_grams(self):
+        self.assertEqual(qgrams('ACME'), {'##A', '#AC', 'ACM', 'CME', 'ME#', 'E##'})
+
+    def test_spellings_share_a_key(self):
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.values[self.index.ids['ACMECORP']], ['Acme Corp', 'ACME Corp.'])
+
+    def test_candidates(self):
+        keys = [self.index.keys[id_] for id_ in self.index.candidates('acme corp')]
+        # Most shared grams first; 'Ac' shares only '##A' and '#AC'.
+        self.assertEqual(keys, ['ACMECORP', 'ACMECORPORATION', 'AC'])
+        self.assertEqual([self.index.keys[id_] for id_ in self.index.candidates('acme corp', min_shared=3)], ['ACMECORP', 'ACMECORPORATION'])
+        self.assertEqual(self.index.candidates('zzzz'), [])
+        # The minimum is capped at the grams of the query.
+        self.assertEqual([self.index.keys[id_] for id_ in self.index.candidates('g', min_shared=10)], [])
+        self.assertEqual([self.index.keys[id_] for id_ in self.index.candidates('i', min_shared=10)], [])
+
+    def test_search_and_round_trip(self):
+        found = self.index.search('Acme Corpp', limit=2, score_cutoff=50)
+        self.assertEqual([key for key, score, values in found], ['ACMECORP', 'ACMECORPORATION'])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'vendor.json.gz')
+            self.index.save(path)
+            loaded = QGramIndex.load(path)
+        self.assertEqual(loaded.search('Acme Corpp', limit=2, score_cutoff=50), found)
+        self.assertEqual(loaded.candidates('acme corp'), self.index.candidates('acme corp'))
+
+
+class InvoiceQGramIndexTests(TestCase):
+    """
+    The index served by /api/search/ follows the saved file, or the data when there is none.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(QGRAM_INDEX_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        loaded_qgram_indexes.clear()
+        self.addCleanup(loaded_qgram_indexes.clear)
+        create_invoice(vendor='Acme Corp')
+
+    def test_built_from_the_database_until_the_data_changes(self):
+        index = get_invoice_index('vendor')
+        self.assertEqual(index.keys, ['ACMECORP'])
+        self.assertIs(get_invoice_index('vendor'), index)
+        create_invoice('INV-2', vendor='Globex')
+        self.assertEqual(sorted(get_invoice_index('vendor').keys), ['ACMECORP', 'GLOBEX'])
+
+    def test_saved_index_is_loaded(self):
+        saved = QGramIndex()
+        saved.add('Initech')
+        saved.save(index_path('vendor'))
+        self.assertEqual(get_invoice_index('vendor').keys, ['INITECH'])
+
+    def test_fuzzy_search(self):
+        client = APIClient()
+        response = client.get('/api/search/', {'q': 'acme corporation', 'min_score': 50})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['value'], 'Acme Corp')
+        for params in [{'limit': 'abc'}, {'min_score': 'high'}, {'field': 'region'}]:
+            with self.subTest(params=params):
+                self.assertEqual(client.get('/api/search/', params).status_code, 400)
+
+
+class SearchKeyTests(TestCase):
+    """
+    The search keys of an invoice follow its vendor, reference, date and value on every write path.
+    """
+
+    def keys(self, invoice):
+        return Invoice.objects.values_list('vendor_key', 'reference_key', 'date_day', 'value_cents').get(pk=invoice.pk)
+
+    def test_save_and_bulk_create(self):
+        invoice = create_invoice('Inv-1/A', day=2, value='10.05', vendor='Acme Corp.')
+        self.assertEqual(self.keys(invoice), ('ACMECORP', 'Inv1A', 20090, 1005))
+        invoice.vendor, invoice.date = 'Globex', None
+        invoice.save(update_fields=['vendor', 'date'])
+        self.assertEqual(self.keys(invoice), ('GLOBEX', 'Inv1A', None, 1005))
+        [bulk] = Invoice.objects.bulk_create([Invoice(
+            reference='B 2', date=datetime(2025, 1, 3, tzinfo=timezone.utc), unit_price=Decimal('1'), quantity=1,
+            value=Decimal('1.50'), vendor='Initech', pattern='unique', confidence='Low',
+        )])
+        self.assertEqual(self.keys(bulk), ('INITECH', 'B2', 20091, 150))
+
+    def test_queryset_update(self):
+        invoice = create_invoice(vendor='Acme Corp')
+        Invoice.objects.filter(vendor='Acme Corp').update(
+            vendor='Globex, Inc.', reference='INV 9', date=datetime(2025, 2, 1, tzinfo=timezone.utc), value=Decimal('7.25'),
+        )
+        self.assertEqual(self.keys(invoice), ('GLOBEXINC', 'INV9', 20120, 725))
+        Invoice.objects.filter(pk=invoice.pk).update(date=None, open=False)
+        self.assertEqual(self.keys(invoice), ('GLOBEXINC', 'INV9', None, 725))
+
+    def test_queryset_update_with_expressions(self):
+        first = create_invoice(value='10.00')
+        second = create_invoice('INV-2', value='20.00', vendor='Globex')
+        Invoice.objects.filter(value__lt=15).update(value=F('value') * 2, vendor=F('reference'))
+        self.assertEqual(self.keys(first), ('INV1', 'INV1', 20089, 2000))
+        self.assertEqual(self.keys(second), ('GLOBEX', 'INV2', 20089, 2000))
+
+
+class BulkIngestTests(TestCase):
+    """
+    Streams of invoices are written in batches, pulling one batch at a time from the stream.
+    """
+
+    def test_batched(self):
+        self.assertEqual(list(batched(range(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(batched([], 3)), [])
+
+    def test_bulk_ingest(self):
+        pulled = []
+
+        def invoices():
+            for k in range(5):
+                pulled.append(k)
+                yield Invoice(
+                    reference=f'INV-{max(k, 1)}', date=datetime(2025, 1, 1, tzinfo=timezone.utc), unit_price=Decimal('2.00'),
+                    quantity=1, value=Decimal('2.00'), vendor=f'Vendor {max(k, 1)}',
+                    pattern='unique', confidence='Low',
+                )
+
+        progress = []
+        with self.assertNumQueries(0):
+            stream = invoices()
+        report = bulk_ingest(stream, batch_size=2, on_batch=lambda report: progress.append((report.rows, len(pulled))))
+        self.assertEqual(progress, [(2, 2), (4, 4), (5, 5)])
+        self.assertEqual((report.rows, report.batches), (5, 3))
+        self.assertIn('5 invoices in 3 batches', str(report))
+        self.assertEqual(Invoice.objects.count(), 5)
+        # Written through bulk_create: search keys set and invoices grouped,
+        # the first two as duplicates.
+        self.assertEqual(Invoice.objects.get(reference='INV-4').vendor_key, 'VENDOR4')
+        self.assertEqual(Invoice.objects.exclude(group_id='').count(), 5)
+        self.assertEqual(Invoice.objects.values('group_id').distinct().count(), 4)
+
+
+class GroupListTests(TestCase):
+    """
+    Group pages come from the summaries and one query for the invoices of the page.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.first = create_invoice('INV-1', day=3, value='10.00')
+        cls.second = create_invoice('INV-1', day=5, value='10.00', region='South')
+        for k in range(2, 6):
+            create_invoice(f'INV-{k}', day=k, value=f'{k}.00', vendor=f'Vendor {k}')
+
+    def setUp(self):
+        self.client = APIClient()
+        for cache in caches.all():
+            cache.clear()
+
+    def test_groups_with_their_invoices(self):
+        response = self.client.get('/api/groups/', {'ordering': '-amount_overpaid', 'page_size': 2})
+        self.assertEqual(response.data['count'], 5)
+        group = response.data['results'][0]
+        self.assertEqual(group['group_id'], self.first.group_id)
+        self.assertEqual(group['amount_overpaid'], Decimal('10.00'))
+        self.assertEqual((group['itemCount'], group['pattern'], group['confidence']), (2, 'Similar Date', 'Medium'))
+        self.assertEqual(group['date'], self.first.date)
+        self.assertEqual([item['region'] for item in group['items']], ['North', 'South'])
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_queries_do_not_grow_with_the_page(self):
+        counts = []
+        for page_size in [1, 5]:
+            for cache in caches.all():
+                cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(len(self.client.get('/api/groups/', {'page_size': page_size}).data['results']), page_size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class InvoiceGroupTests(TestCase):
+    """
+    The InvoiceGroup summaries follow every write to the invoices of their groups.
+    """
+
+    def summary(self, group_id):
+        return InvoiceGroup.objects.filter(group_id=group_id).values(
+            'first_invoice', 'total_value', 'amount_overpaid', 'item_count', 'date', 'region', 'pattern', 'open',
+        ).first()
+
+    def summaries(self):
+        return list(InvoiceGroup.objects.order_by('group_id').values_list(
+            'group_id', 'first_invoice', 'total_value', 'amount_overpaid', 'item_count', 'date', 'region', 'pattern', 'open', 'confidence',
+        ))
+
+    def assertRebuildKeeps(self):
+        summaries = self.summaries()
+        rebuild_groups()
+        self.assertEqual(self.summaries(), summaries)
+
+    def test_create(self):
+        first = create_invoice(value='10.00', region='East')
+        self.assertEqual(self.summary(first.group_id), {
+            'first_invoice': first.pk, 'total_value': Decimal('10.00'), 'amount_overpaid': Decimal('0.00'),
+            'item_count': 1, 'date': first.date, 'region': 'East', 'pattern': 'unique', 'open': True,
+        })
+        second = create_invoice(day=2, value='10.00')
+        summary = self.summary(first.group_id)
+        self.assertEqual(second.group_id, first.group_id)
+        self.assertEqual((summary['item_count'], summary['amount_overpaid'], summary['pattern']), (2, Decimal('10.00'), 'Similar Date'))
+        self.assertRebuildKeeps()
+
+    def test_update(self):
+        first = create_invoice(value='10.00')
+        second = create_invoice(day=2, value='10.00')
+        second.value = Decimal('15.00')
+        second.save()
+        self.assertEqual(self.summary(first.group_id)['total_value'], Decimal('25.00'))
+        Invoice.objects.filter(pk=first.pk).update(open=False, date=datetime(2024, 12, 30, tzinfo=timezone.utc))
+        summary = self.summary(first.group_id)
+        self.assertEqual((summary['open'], summary['date']), (False, datetime(2024, 12, 30, tzinfo=timezone.utc)))
+        # Moving an invoice refreshes the group it left and the one it joined.
+        second.group_id = 'elsewhere'
+        second.save()
+        self.assertEqual(self.summary(first.group_id)['item_count'], 1)
+        self.assertEqual(self.summary('elsewhere')['first_invoice'], second.pk)
+        Invoice.objects.filter(pk=first.pk).update(group_id='elsewhere')
+        self.assertIsNone(self.summary(first.group_id))
+        self.assertEqual(self.summary('elsewhere')['item_count'], 2)
+        self.assertRebuildKeeps()
+
+    def test_delete(self):
+        first = create_invoice(value='10.00')
+        second = create_invoice(day=2, value='12.00')
+        third = create_invoice('INV-3', vendor='Globex')
+        first.delete()
+        summary = self.summary(second.group_id)
+        self.assertEqual((summary['first_invoice'], summary['total_value'], summary['amount_overpaid']), (second.pk, Decimal('12.00'), Decimal('0.00')))
+        Invoice.objects.filter(pk__in=[second.pk, third.pk]).delete()
+        self.assertFalse(InvoiceGroup.objects.exists())
+
+    def test_merge(self):
+        first = create_invoice(group_id='g1')
+        create_invoice(group_id='g2')
+        create_invoice()
+        self.assertIsNone(self.summary('g2'))
+        summary = self.summary('g1')
+        self.assertEqual((summary['first_invoice'], summary['item_count'], summary['pattern']), (first.pk, 3, 'Exact Match'))
+        self.assertEqual(summary['total_value'], Decimal('30.00'))
+        self.assertRebuildKeeps()
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    Cursor pages follow (date, id) order across ties and missing dates, in both directions.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        days = [5, None, 3, 3, None, 3, 9]
+        invoices = [create_invoice(f'INV-{k}', day=day, vendor=f'Vendor {k}') for k, day in enumerate(days)]
+        cls.ordered = [invoice.reference for invoice in sorted(invoices, key=lambda i: (i.date is not None, i.date, i.id))]
+
+    def setUp(self):
+        self.client = APIClient()
+        for cache in caches.all():
+            cache.clear()
+
+    def walk(self, page_size, direction='next'):
+        pages = []
+        url, params = '/api/invoices/', {'pagination': 'cursor', 'page_size': page_size}
+        while url:
+            data = self.client.get(url, params).data
+            pages.append([row['reference'] for row in data['results']])
+            url, params = data[direction], None
+        return pages
+
+    def test_forward_and_back(self):
+        for page_size in [1, 2, 3, 7, 10]:
+            with self.subTest(page_size=page_size):
+                pages = self.walk(page_size)
+                self.assertEqual(sum(pages, []), self.ordered)
+                self.assertTrue(all(pages))
+                self.assertEqual(len(pages), -(-7 // page_size))
+
+    def test_previous_links_go_back_over_the_same_pages(self):
+        pages = self.walk(3)
+        data = self.client.get('/api/invoices/', {'pagination': 'cursor', 'page_size': 3}).data
+        data = self.client.get(data['next']).data
+        last = self.client.get(data['next']).data
+        self.assertIsNone(last['next'])
+        back = self.client.get(last['previous']).data
+        self.assertEqual([row['reference'] for row in back['results']], pages[1])
+        first = self.client.get(back['previous']).data
+        self.assertEqual([row['reference'] for row in first['results']], pages[0])
+        self.assertIsNone(first['previous'])
+
+    def test_cursor_is_stable_when_rows_are_added(self):
+        data = self.client.get('/api/invoices/', {'pagination': 'cursor', 'page_size': 3}).data
+        create_invoice('INV-early', day=None, vendor='Early')
+        following = self.client.get(data['next']).data
+        self.assertEqual([row['reference'] for row in following['results']], self.ordered[3:6])
+
+    def test_count_and_invalid_cursor(self):
+        data = self.client.get('/api/invoices/', {'pagination': 'cursor', 'page_size': 2, 'count': 'true'}).data
+        self.assertEqual(data['count'], 7)
+        self.assertEqual(self.client.get('/api/invoices/', {'pagination': 'cursor', 'cursor': 'garbage'}).status_code, 404)
+
+
+class RandomPaginationTests(TestCase):
+    """
+    Seeded random pages are slices of one fixed order, wrapping around the random_key index.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        for k in range(7):
+            invoice = create_invoice(f'INV-{k}', vendor=f'Vendor {k}')
+            # Keys spread over the whole range, so the test does not depend on the draw.
+            Invoice.objects.filter(pk=invoice.pk).update(random_key=k * (RANDOM_KEY_RANGE // 7))
+        cls.ids = set(Invoice.objects.values_list('id', flat=True))
+
+    def test_slices_of_one_order(self):
+        wrapped = 0
+        for seed in ['1', '2', '3', 'abc']:
+            with self.subTest(seed=seed):
+                sample = RandomSample(Invoice.objects.all(), seed)
+                order = [invoice.id for invoice in sample[0:None]]
+                wrapped += 0 < sample.head.count() < 7
+                self.assertEqual(set(order), self.ids)
+                self.assertEqual(len(order), len(self.ids))
+                self.assertEqual(sample.count(), 7)
+                for start in range(9):
+                    for stop in range(start, 10):
+                        self.assertEqual([invoice.id for invoice in RandomSample(Invoice.objects.all(), seed)[start:stop]], order[start:stop])
+                self.assertEqual([invoice.id for invoice in RandomSample(Invoice.objects.all(), seed)[0:None]], order)
+        # Some orders continue from the end of the index to its start.
+        self.assertTrue(wrapped)
+
+    def test_pages(self):
+        client = APIClient()
+        for cache in caches.all():
+            cache.clear()
+        pages = []
+        url, params = '/api/invoices/', {'random': 'true', 'seed': '42', 'page_size': 3}
+        while url:
+            data = client.get(url, params).data
+            self.assertEqual(data['seed'], '42')
+            pages.append([row['reference'] for row in data['results']])
+            url, params = data['next'], None
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        seen = [reference for page in pages for reference in page]
+        self.assertEqual(sorted(seen), [f'INV-{k}' for k in range(7)])
+        again = client.get('/api/invoices/', {'random': 'true', 'seed': '42', 'page_size': 7}).data
+        self.assertEqual([row['reference'] for row in again['results']], seen)
+        drawn = client.get('/api/invoices/', {'random': 'true', 'page_size': 7}).data
+        self.assertTrue(drawn['seed'])
+        self.assertEqual(sorted(row['reference'] for row in drawn['results']), sorted(seen))
+
+
+class KPITests(TestCase):
+    """
+    The KPIs are cached per data version, so writes made anywhere are seen.
+    """
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+
+    def test_kpis(self):
+        create_invoice(value='10.00')
+        create_invoice(day=2, value='10.00', open=False)
+        create_invoice('INV-3', value='5.00', vendor='Globex')
+        self.assertEqual(APIClient().get('/api/kpis/').data, {
+            'total_similar_invoices': 1,
+            'total_open_similar_invoices': 0,
+            'total_value_of_similar_invoices': Decimal('25.00'),
+            'total_value_of_open_similar_invoices': Decimal('15.00'),
+        })
+
+    def test_write_from_another_process(self):
+        create_invoice(value='10.00')
+        self.assertEqual(get_kpis()['total_value_of_similar_invoices'], Decimal('10.00'))
+        with self.assertNumQueries(1):
+            get_kpis()
+        # What another worker or a management command does: change the rows
+        # and bump the version, without this process's signals or on_commit.
+        models.QuerySet(Invoice).update(value=Decimal('99.00'))
+        bump_data_version()
+        self.assertEqual(get_kpis()['total_value_of_similar_invoices'], Decimal('99.00'))
+
+
+class MetadataTests(TestCase):
+    """
+    /api/metadata/ keeps the values and formats of the original endpoint, with facet counts added.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        create_invoice('INV-2', day=3)
+        create_invoice('INV-1', day=1, vendor='Globex')
+        create_invoice('INV-1', day=None, vendor='Globex', value='99.00')
+
+    def setUp(self):
+        self.client = APIClient()
+        invalidate_facets()
+
+    def test_values(self):
+        data = json.loads(self.client.get('/api/metadata/').content)
+        self.assertEqual(data['reference_values'], ['INV-1', 'INV-2'])
+        self.assertEqual(data['vendor_values'], ['Acme Corp', 'Globex'])
+        self.assertEqual(data['date_values'], ['2025-01-01T00:00:00Z', '2025-01-03T00:00:00Z'])
+        self.assertEqual(data['facets']['vendor'], {'Acme Corp': 1, 'Globex': 2})
+        self.assertEqual(data['facets']['day'], {'2025-01-01': 1, '2025-01-03': 1})
+
+    def test_new_invoices_are_counted(self):
+        self.client.get('/api/metadata/')
+        with self.captureOnCommitCallbacks(execute=True):
+            create_invoice('INV-3', day=2, vendor='Initech')
+        data = json.loads(self.client.get('/api/metadata/').content)
+        self.assertEqual(data['date_values'], ['2025-01-01T00:00:00Z', '2025-01-02T00:00:00Z', '2025-01-03T00:00:00Z'])
+
+    def test_changes_of_other_processes(self):
+        first = self.client.get('/api/metadata/')
+        # A write that did not go through this process's facet index.
+        models.QuerySet(Invoice).filter(vendor='Globex').update(vendor='Initech')
+        bump_data_version()
+        response = self.client.get('/api/metadata/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(json.loads(response.content)['vendor_values'], ['Acme Corp', 'Initech'])
+
+    def test_limit(self):
+        data = self.client.get('/api/metadata/', {'limit': 1}).data
+        self.assertEqual((data['reference_values'], data['vendor_values']), (['INV-1'], ['Acme Corp']))
+        self.assertEqual(len(data['date_values']), 1)
+        for limit in ['abc', '-1', '1.5']:
+            with self.subTest(limit=limit):
+                self.assertEqual(self.client.get('/api/metadata/', {'limit': limit}).status_code, 400)
@@ -11,6 +11,14 @@ Endpoints:
     - /kpis/ : Retrieve KPIs (KPIsList view)
     - /metadata/ : Retrieve metadata (Metadata view)
     - /groups/ : Retrieve a list of groups (GroupList view)
+    - /invoices/export/ : Stream the filtered invoices as NDJSON or CSV (InvoiceExport view)
+    - /groups/export/ : Stream the filtered group summaries as NDJSON or CSV (GroupExport view)
+    - /invoices/snapshot/ : Download a columnar snapshot of the invoices (InvoiceSnapshot view)
+    - /search/ : Fuzzy lookup of vendors or references (FuzzySearch view)
+
+The invoices, kpis, metadata, groups, export and snapshot endpoints send ETag and Last-Modified
+headers from the data version, and answer unchanged polls with 304 Not
+Modified (see api.versioning).
 """
 
 urlpatterns = [
@@ -18,5 +26,9 @@ urlpatterns = [
     path("kpis/", views.KPIsList.as_view(), name="kpis-list"),
     path("metadata/", views.Metadata.as_view(), name="metadata-list"),
     path("groups/", views.GroupList.as_view(), name="group-list"),
+    path("invoices/export/", views.InvoiceExport.as_view(), name="invoice-export"),
+    path("groups/export/", views.GroupExport.as_view(), name="group-export"),
+    path("invoices/snapshot/", views.InvoiceSnapshot.as_view(), name="invoice-snapshot"),
+    path("search/", views.FuzzySearch.as_view(), name="fuzzy-search"),
     
 ]
\ No newline at end of file
@@ -0,0 +1,70 @@
+"""
+Conditional GET support from the global data version.
+
+Every change of the invoices bumps DataVersion (see api.signals), in the
+same transaction as the change. Views decorated with conditional_on_data
+answer If-None-Match / If-Modified-Since with 304 Not Modified after reading
+that one row, before running any of their own queries.
+"""
+
+from django.db.models import F
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from .models import DataVersion
+
+DATA_VERSION_PK = 1
+
+
+def bump_data_version():
+    """
+    Increment the data version and set its modification time to now.
+    """
+    now = timezone.now()
+    updated = DataVersion.objects.filter(pk=DATA_VERSION_PK).update(version=F('version') + 1, updated_at=now)
+    if not updated:
+        DataVersion.objects.get_or_create(pk=DATA_VERSION_PK, defaults={'version': 1, 'updated_at': now})
+
+
+def current_data_version(request=None):
+    """
+    The (version, updated_at) of the data, read once per request.
+
+    Returns (0, None) before the first change.
+    """
+    cached = getattr(request, '_data_version', None)
+    if cached is not None:
+        return cached
+    found = DataVersion.objects.filter(pk=DATA_VERSION_PK).values_list('version', 'updated_at').first()
+    found = found or (0, None)
+    if request is not None:
+        request._data_version = found
+    return found
+
+
+def unseeded_random(request):
+    """
+    Whether the request asks for random invoices without a seed, a response
+    that differs on every request even if the data does not.
+    """
+    return request.GET.get('random', '').lower() == 'true' and not request.GET.get('seed')
+
+
+def data_etag(request, *args, **kwargs):
+    """
+    ETag of a response: the data version. It can be the same for every URL,
+    since a client only compares it with the ETag it got for the same URL.
+    """
+    if unseeded_random(request):
+        return None
+    return f'"v{current_data_version(request)[0]}"'
+
+
+def data_last_modified(request, *args, **kwargs):
+    if unseeded_random(request):
+        return None
+    return current_data_version(request)[1]
+
+
+# Decorator for the get method of an APIView.
+conditional_on_data = method_decorator(condition(etag_func=data_etag, last_modified_func=data_last_modified))
@@ -1,11 +1,21 @@
+from django.http import FileResponse
 from django.shortcuts import render
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from .models import Invoice
-from .serializers import InvoiceSerializer
+from .models import Invoice, InvoiceGroup
+from .serializers import invoice_rows
 from rest_framework.pagination import PageNumberPagination
-from django.db.models import Sum
+from rest_framework.exceptions import NotFound
+from .facets import get_facet_index
+from .filters import GROUP_ORDERINGS, filter_groups, filter_invoices, order_groups
+from .kpis import get_kpis
+from .pagination import KeysetPagination, RandomSamplePagination
+from .cache import cached_response
+from .export import GROUP_FIELDS, export_options, export_response, group_batches, invoice_batches
+from .snapshot import get_snapshot
+from .versioning import conditional_on_data
+from .qgram import INDEXED_FIELDS, get_invoice_index
 
 class InvoiceList(APIView):
     """
@@ -14,49 +24,49 @@ class InvoiceList(APIView):
     Filters:
         - reference: Filter by invoice references (multiple values allowed)
         - vendor: Filter by vendor names (multiple values allowed)
+        - vendor_match: Filter by vendor names ignoring case, spaces and punctuation (multiple values allowed)
         - pattern: Filter by pattern types (multiple values allowed)
         - open: Filter by open status (true/false)
-        - group: Filter by group ID
+        - group_id: Filter by group ID
         - start_date: Filter by start date (inclusive)
         - end_date: Filter by end date (inclusive)
-        - random: Randomize the order of the results (true/false)
+        - random: Randomize the order of the results (true/false), sampled through the random_key index
+        - seed: With random, the seed of the order, so the pages of a random view are reproducible
+        - pagination: cursor for keyset pagination ordered by (date, id), without
+          a COUNT(*) or OFFSET; page numbers otherwise
+        - count: With cursor pagination, include the total number of results (true/false)
+
+    Responses are cached per query parameters and data version (see api.cache).
     """
+    @conditional_on_data
+    @cached_response
     def get(self, request, format=None):
         try:
-            references = request.query_params.getlist('reference')
-            vendors = request.query_params.getlist('vendor')
-            patterns = request.query_params.getlist('pattern')
-            open = request.query_params.get('open')
-            group = request.query_params.get('group_id')
-            start_date = request.query_params.get('start_date')
-            end_date = request.query_params.get('end_date')
             random = request.query_params.get('random')
+            cursor = request.query_params.get('pagination') == 'cursor'
 
-            print(f"Received request with filters: references={references}, vendors={vendors}, patterns={patterns}, open={open}, group={group}, start_date={start_date}, end_date={end_date}, random={random}")
-
-            invoices = Invoice.objects.all()
-            print(f"Found {invoices.count()} invoices")
-            if references:
-                invoices = invoices.filter(reference__in=references)
-            if vendors:
-                invoices = invoices.filter(vendor__in=vendors)
-            if patterns:
-                invoices = invoices.filter(pattern__in=patterns)
-            if open:
-                invoices = invoices.filter(open=open.lower() == 'true')
-            if group:
-                invoices = invoices.filter(group_id=group)
-            if start_date:
-                invoices = invoices.filter(date__gte=start_date)
-            if end_date:
-                invoices = invoices.filter(date__lte=end_date)
-            if random and random.lower() == 'true':
-                invoices = invoices.order_by('?')
+            print(f"Received request with filters: {request.query_params.dict()}")
 
-            paginator = PageNumberPagination()
-            paginated_invoices = paginator.paginate_queryset(invoices, request)
-            serializer = InvoiceSerializer(paginated_invoices, many=True)
-            return paginator.get_paginated_response(serializer.data)
+            invoices = filter_invoices(Invoice.objects.all(), request.query_params)
+
+            if cursor:
+                if random and random.lower() == 'true':
+                    return Response({"error": "random is not supported with cursor pagination"}, status=400)
+                count = request.query_params.get('count', '').lower() == 'true'
+                paginator = KeysetPagination()
+                rows = paginator.paginate_queryset(invoice_rows.queryset(invoices, 'id', named=True), request)
+                return paginator.get_paginated_response(
+                    invoice_rows.to_representation(rows), count=invoices.count() if count else None
+                )
+
+            if random and random.lower() == 'true':
+                paginator = RandomSamplePagination()
+            else:
+                paginator = PageNumberPagination()
+            rows = paginator.paginate_queryset(invoice_rows.queryset(invoices), request)
+            return paginator.get_paginated_response(invoice_rows.to_representation(rows))
+        except NotFound as e:
+            return Response({"error": str(e.detail)}, status=404)
         except Exception as e:
             print(f"Error processing request: {e}")
             return Response({"error": str(e)}, status=500)
@@ -70,37 +80,53 @@ class KPIsList(APIView):
         - Total open similar invoices
         - Total value of similar invoices
         - Total value of open similar invoices
+
+    The KPIs are computed in one query and cached per data version (see api.kpis).
     """
+    @conditional_on_data
     def get(self, request, format=None):
         try:
-            total_invoices = Invoice.objects.count()
-            total_groups = Invoice.objects.values('group_id').distinct().count()
-            total_open_invoices = Invoice.objects.filter(open=True).count()
-            total_open_groups = Invoice.objects.filter(open=True).values('group_id').distinct().count()
-            total_value = Invoice.objects.aggregate(Sum('value'))['value__sum']
-            total_open_value = Invoice.objects.filter(open=True).aggregate(Sum('value'))['value__sum']
-            return Response({
-                'total_similar_invoices': total_invoices - total_groups,
-                'total_open_similar_invoices': total_open_invoices - total_open_groups,
-                'total_value_of_similar_invoices': total_value,
-                'total_value_of_open_similar_invoices': total_open_value
-            })
+            return Response(get_kpis(request))
         except Exception as e:
             print(f"Error processing request: {e}")
             return Response({"error": str(e)}, status=500)
         
 class Metadata(APIView):
+    """
+    API view to retrieve the values to filter invoices by, with their counts.
+
+    Served from the in-memory facet index (see api.facets), without scanning
+    the invoices. Every list is sorted, and cut to limit values if given.
+
+    Filters:
+        - reference_prefix: Only return the references starting with this prefix
+        - limit: Maximum number of values per list (default: all of them)
+
+    Returns:
+        - reference_values, vendor_values, pattern_values: The distinct values
+        - date_values: The distinct invoice dates, as timestamps
+        - facets: value -> number of invoices, for vendor, pattern, region,
+          payment_method, day (YYYY-MM-DD) and month (YYYY-MM)
+    """
+    facets = ('vendor', 'pattern', 'region', 'payment_method', 'day', 'month')
+
+    @conditional_on_data
     def get (self, request, format=None):
         try:
-            reference_list = Invoice.objects.values_list('reference', flat=True).distinct()
-            vendor_list = Invoice.objects.values_list('vendor', flat=True).distinct()
-            pattern_list = Invoice.objects.values_list('pattern', flat=True).distinct()
-            date_list = Invoice.objects.values_list('date', flat=True).distinct()
+            reference_prefix = request.query_params.get('reference_prefix', '')
+            limit = request.query_params.get('limit') or None
+            if limit is not None:
+                if not limit.isdigit():
+                    return Response({"error": "limit must be a non-negative integer"}, status=400)
+                limit = int(limit)
+
+            index = get_facet_index(request)
             return Response({
-                'reference_values': reference_list,
-                'vendor_values': vendor_list,
-                'pattern_values': pattern_list,
-                'date_values': date_list
+                'reference_values': index.values('reference', reference_prefix, limit),
+                'vendor_values': index.values('vendor', limit=limit),
+                'pattern_values': index.values('pattern', limit=limit),
+                'date_values': index.values('date', limit=limit),
+                'facets': {facet: index.facet(facet, limit=limit) for facet in self.facets},
             })
            
         except Exception as e:
@@ -108,39 +134,177 @@ class Metadata(APIView):
             return Response({"error": str(e)}, status=500)
         
 class GroupList(APIView):
+    """
+    API view to retrieve the groups of similar invoices, with their invoices.
+
+    The groups are read from the InvoiceGroup summary table, so listing,
+    sorting and filtering them is an indexed read of one table. The invoices
+    of the groups of the page come from one more query.
+
+    Filters:
+        - pattern: Filter by pattern types (multiple values allowed)
+        - confidence: Filter by confidence levels (multiple values allowed)
+        - region: Filter by regions (multiple values allowed)
+        - open: Filter by open status (true/false)
+        - start_date: Filter by start date (inclusive)
+        - end_date: Filter by end date (inclusive)
+        - ordering: date, amount_overpaid or itemCount, prefixed with - for descending order
+        - page_size: Number of groups per page (default 20)
+
+    Responses are cached per query parameters and data version (see api.cache).
+    """
+    @conditional_on_data
+    @cached_response
     def get(self, request, format=None):
         try:
-            group_list = Invoice.objects.values_list('group_id', flat=True).distinct()
-            group_data = []
-
-            for group_id in group_list:
-                group_invoices = Invoice.objects.filter(group_id=group_id)
-                group_value = group_invoices.aggregate(Sum('value'))['value__sum']
-                first_invoice_value = group_invoices.first().value if group_invoices.exists() else 0
-                group_value -= first_invoice_value
-                group_invoices_count = group_invoices.count()
-                serialized_invoices = InvoiceSerializer(group_invoices, many=True).data
-
-                group_data.append({
-                    'group_id': group_id,
-                    'amount_overpaid': group_value,
-                    'itemCount': group_invoices_count,
-                    'date': group_invoices.order_by('date').first().date if group_invoices.exists() else None,
-                    'region': group_invoices.first().region if group_invoices.exists() else None,
-                    'pattern': group_invoices.first().pattern if group_invoices.exists() else None,
-                    'open': group_invoices.first().open if group_invoices.exists() else None,
-                    'confidence': group_invoices.first().confidence if group_invoices.exists() else None,
-                    'items': serialized_invoices,
-                })
+            ordering = request.query_params.get('ordering')
+            if ordering and ordering.lstrip('-') not in GROUP_ORDERINGS:
+                return Response({"error": f"ordering must be one of {', '.join(GROUP_ORDERINGS)}"}, status=400)
+
+            groups = order_groups(filter_groups(InvoiceGroup.objects.all(), request.query_params), ordering)
 
             paginator = PageNumberPagination()
             page_size = request.query_params.get('page_size', paginator.page_size)
             if not page_size:
                 page_size = 20
             paginator.page_size = page_size
-            paginated_group_data = paginator.paginate_queryset(group_data, request)
-            return paginator.get_paginated_response(paginated_group_data)
+            page = paginator.paginate_queryset(groups, request)
+
+            items = {group.group_id: [] for group in page}
+            invoices = invoice_rows.queryset(Invoice.objects.filter(group_id__in=items).order_by('id'))
+            for item in invoice_rows.to_representation(invoices):
+                items[item['group_id']].append(item)
+
+            group_data = [
+                {
+                    'group_id': group.group_id,
+                    'amount_overpaid': group.amount_overpaid,
+                    'itemCount': group.item_count,
+                    'date': group.date,
+                    'region': group.region,
+                    'pattern': group.pattern,
+                    'open': group.open,
+                    'confidence': group.confidence,
+                    'items': items[group.group_id],
+                }
+                for group in page
+            ]
+            return paginator.get_paginated_response(group_data)
+
+        except Exception as e:
+            print(f"Error processing request: {e}")
+            return Response({"error": str(e)}, status=500)
+
+class InvoiceExport(APIView):
+    """
+    API view to download all the invoices matching the filters of InvoiceList.
+
+    The invoices are streamed in id order over a server-side iterator, so
+    the whole result is sent in one response with constant memory, without
+    pages, COUNT(*) or OFFSET.
+
+    Filters:
+        - The filters of InvoiceList: reference, vendor, vendor_match, pattern,
+          open, group_id, start_date and end_date
+        - file_format: ndjson (one JSON invoice per line, default) or csv
+        - chunk_size: Rows read from the database at a time (default 2000)
+    """
+    @conditional_on_data
+    def get(self, request, format=None):
+        try:
+            try:
+                file_format, chunk_size = export_options(request.query_params)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=400)
+
+            invoices = filter_invoices(Invoice.objects.all(), request.query_params).order_by('id')
+            return export_response(invoice_batches(invoices, chunk_size), invoice_rows.names, file_format, 'invoices')
+        except Exception as e:
+            print(f"Error processing request: {e}")
+            return Response({"error": str(e)}, status=500)
+
+class GroupExport(APIView):
+    """
+    API view to download all the group summaries matching the filters of GroupList.
+
+    Streams the rows of the InvoiceGroup summary table like InvoiceExport,
+    without the invoices of each group; those can be exported with the
+    group_id filter of InvoiceExport.
+
+    Filters:
+        - The filters of GroupList: pattern, confidence, region, open,
+          start_date, end_date and ordering
+        - file_format: ndjson (one JSON group per line, default) or csv
+        - chunk_size: Rows read from the database at a time (default 2000)
+    """
+    @conditional_on_data
+    def get(self, request, format=None):
+        try:
+            try:
+                file_format, chunk_size = export_options(request.query_params)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=400)
+            ordering = request.query_params.get('ordering')
+            if ordering and ordering.lstrip('-') not in GROUP_ORDERINGS:
+                return Response({"error": f"ordering must be one of {', '.join(GROUP_ORDERINGS)}"}, status=400)
+
+            groups = order_groups(filter_groups(InvoiceGroup.objects.all(), request.query_params), ordering)
+            names = [name for name, field in GROUP_FIELDS]
+            return export_response(group_batches(groups, chunk_size), names, file_format, 'groups')
+        except Exception as e:
+            print(f"Error processing request: {e}")
+            return Response({"error": str(e)}, status=500)
 
+class InvoiceSnapshot(APIView):
+    """
+    API view to download a columnar snapshot of all the invoices.
+
+    The snapshot is a compressed NumPy archive with typed columns and
+    dictionary-encoded strings (see api.snapshot), loaded with
+    api.snapshot.snapshot_frame or numpy.load. It is written once per data
+    version and served from disk until the invoices change.
+    """
+    @conditional_on_data
+    def get(self, request, format=None):
+        try:
+            return FileResponse(
+                open(get_snapshot(), 'rb'), as_attachment=True, filename='invoices.npz',
+                content_type='application/octet-stream',
+            )
+        except Exception as e:
+            print(f"Error processing request: {e}")
+            return Response({"error": str(e)}, status=500)
+
+class FuzzySearch(APIView):
+    """
+    API view to look up vendor names or references similar to a query.
+
+    Uses the q-gram index of the field, so only the values sharing trigrams
+    with the query are scored.
+
+    Filters:
+        - field: vendor or reference (default vendor)
+        - q: The text to look up
+        - limit: Maximum number of results (default 10)
+        - min_score: Minimum similarity score, 0 to 100 (default 80)
+    """
+    def get(self, request, format=None):
+        try:
+            field = request.query_params.get('field', 'vendor')
+            query = request.query_params.get('q', '')
+            try:
+                limit = int(request.query_params.get('limit', 10))
+                min_score = float(request.query_params.get('min_score', 80))
+            except ValueError:
+                return Response({"error": "limit must be an integer and min_score a number"}, status=400)
+            if field not in INDEXED_FIELDS:
+                return Response({"error": f"field must be one of {', '.join(INDEXED_FIELDS)}"}, status=400)
+
+            matches = get_invoice_index(field, request).search(query, limit=limit, score_cutoff=min_score)
+            return Response({
+                'field': field,
+                'results': [{'value': values[0], 'values': values, 'score': score} for key, score, values in matches],
+            })
         except Exception as e:
             print(f"Error processing request: {e}")
             return Response({"error": str(e)}, status=500)
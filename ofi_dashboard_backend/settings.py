@@ -134,4 +134,35 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20,  
 }
 
-CORS_ALLOW_ALL_ORIGINS = True
\ No newline at end of file
+CORS_ALLOW_ALL_ORIGINS = True
+
+# Directory of the q-gram indexes written by the build_qgram_index command.
+QGRAM_INDEX_DIR = BASE_DIR / 'api' / 'data' / 'indexes'
+
+# Directory of the columnar invoice snapshots served by /api/invoices/snapshot/.
+SNAPSHOT_DIR = BASE_DIR / 'api' / 'data' / 'snapshots'
+
+
+# Caches. 'responses' holds the cached responses of the read endpoints
+# (api.cache): an in-memory LRU of at most MAX_ENTRIES responses, each kept
+# TIMEOUT seconds. Set RESPONSE_CACHE_ALIAS to 'responses_file' to share
+# them between processes through files instead.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api-responses',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 500},
+    },
+    'responses_file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'api' / 'data' / 'cache',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+RESPONSE_CACHE_ALIAS = 'responses'